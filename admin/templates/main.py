@@ -1,10 +1,15 @@
 from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify
-import json
 import os
+import sys
 import secrets
+import uuid
 from werkzeug.utils import secure_filename
 from datetime import datetime
 
+# The shared data layer lives in the project root, next to the main app
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+from storage import bump_profile_version, get_store, open_storage
+
 app = Flask(__name__, template_folder='../templates')
 app.secret_key = 'admin_secret_key_for_pasma'
 
@@ -21,19 +26,15 @@ def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
 def load_data(file_path):
-    try:
-        with open(file_path, 'r') as file:
-            return json.load(file)
-    except (FileNotFoundError, json.JSONDecodeError):
-        return {}
+    return get_store(file_path).load()
 
 def save_data(data, file_path):
-    with open(file_path, 'w') as file:
-        json.dump(data, file, indent=4)
+    get_store(file_path).save(data)
+
+# Doctors and patients live in the storage backend shared with the main app
+storage = open_storage(os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
 
 # Data file paths
-DOCTORS_FILE = os.path.abspath(os.path.join(os.path.dirname(__file__), '../../doctors.json'))
-PATIENTS_FILE = os.path.abspath(os.path.join(os.path.dirname(__file__), '../../user_details.json'))
 MEDICINES_FILE = os.path.abspath(os.path.join(os.path.dirname(__file__), '../../purchase_medicines.json'))
 ADMINS_FILE = os.path.abspath(os.path.join(os.path.dirname(__file__), '../../data/admins.json'))
 
@@ -45,7 +46,7 @@ os.makedirs(os.path.dirname(ADMINS_FILE), exist_ok=True)
 os.makedirs('data', exist_ok=True)
 
 # Initialize data files if they don't exist
-for file_path in [DOCTORS_FILE, PATIENTS_FILE, MEDICINES_FILE, ADMINS_FILE]:
+for file_path in [MEDICINES_FILE, ADMINS_FILE]:
     if not os.path.exists(file_path):
         save_data({}, file_path)
 
@@ -103,8 +104,8 @@ def dashboard():
         flash('Please login first!', 'warning')
         return redirect(url_for('login'))
 
-    doctors = load_data(DOCTORS_FILE)
-    patients = load_data(PATIENTS_FILE)
+    doctors = storage.load('doctors')
+    patients = storage.load('user_details')
     medicines = load_data(MEDICINES_FILE)
 
     stats = {
@@ -122,7 +123,7 @@ def doctors():
         flash('Please login first!', 'warning')
         return redirect(url_for('login'))
 
-    doctors_data = load_data(DOCTORS_FILE)
+    doctors_data = storage.load('doctors')
     return render_template('doctors.html', doctors=doctors_data)
 
 @app.route('/doctors/add', methods=['GET', 'POST'])
@@ -138,12 +139,6 @@ def add_doctor():
         phone = request.form.get('phone')
         password = request.form.get('password')
 
-        doctors = load_data(DOCTORS_FILE)
-
-        if email in doctors:
-            flash('Doctor with this email already exists!', 'danger')
-            return redirect(url_for('add_doctor'))
-
         # Handle profile picture upload
         profile_pic = None
         if 'profile_pic' in request.files:
@@ -157,6 +152,7 @@ def add_doctor():
 
         # Create new doctor
         new_doctor = {
+            "id": str(uuid.uuid4()),
             "email": email,
             "name": name,
             "specialization": specialization,
@@ -165,9 +161,12 @@ def add_doctor():
             "created_at": datetime.now().strftime('%Y-%m-%d %H:%M:%S')
         }
 
-        doctors.append(new_doctor)
-
-        save_data(doctors, DOCTORS_FILE)
+        # Checked and added under the lock, so two submissions cannot both add the email
+        with storage.locked('doctors'):
+            if storage.find_one('doctors', email=email):
+                flash('Doctor with this email already exists!', 'danger')
+                return redirect(url_for('add_doctor'))
+            storage.put('doctors', new_doctor['id'], new_doctor)
         flash('Doctor added successfully!', 'success')
         return redirect(url_for('doctors'))
 
@@ -179,19 +178,21 @@ def edit_doctor(email):
         flash('Please login first!', 'warning')
         return redirect(url_for('login'))
 
-    doctors = load_data(DOCTORS_FILE)
+    doctor = storage.find_one('doctors', email=email)
 
-    if email not in doctors:
+    if doctor is None:
         flash('Doctor not found!', 'danger')
         return redirect(url_for('doctors'))
 
     if request.method == 'POST':
-        doctors[email]['name'] = request.form.get('name')
-        doctors[email]['specialization'] = request.form.get('specialization')
-        doctors[email]['phone'] = request.form.get('phone')
+        changes = {
+            'name': request.form.get('name'),
+            'specialization': request.form.get('specialization'),
+            'phone': request.form.get('phone')
+        }
 
         if request.form.get('password'):
-            doctors[email]['password'] = request.form.get('password')
+            changes['password'] = request.form.get('password')
 
         # Handle profile picture upload
         if 'profile_pic' in request.files:
@@ -201,13 +202,20 @@ def edit_doctor(email):
                 unique_filename = f"{datetime.now().strftime('%Y%m%d%H%M%S')}_{filename}"
                 file_path = os.path.join(app.config['UPLOAD_FOLDER'], unique_filename)
                 file.save(file_path)
-                doctors[email]['profile_pic'] = f"uploads/{unique_filename}"
-
-        save_data(doctors, DOCTORS_FILE)
+                changes['profile_pic'] = f"uploads/{unique_filename}"
+
+        # Applied to a copy of the latest record under the lock, so no concurrent change is lost
+        with storage.locked('doctors'):
+            doctor = storage.find_one('doctors', email=email)
+            if doctor is None:
+                flash('Doctor not found!', 'danger')
+                return redirect(url_for('doctors'))
+            storage.put('doctors', doctor['id'], dict(doctor, **changes))
+        bump_profile_version(storage, 'doctor', email)
         flash('Doctor updated successfully!', 'success')
         return redirect(url_for('doctors'))
 
-    return render_template('edit_doctor.html', doctor=doctors[email], email=email)
+    return render_template('edit_doctor.html', doctor=doctor, email=email)
 
 @app.route('/doctors/delete/<email>')
 def delete_doctor(email):
@@ -215,11 +223,10 @@ def delete_doctor(email):
         flash('Please login first!', 'warning')
         return redirect(url_for('login'))
 
-    doctors = load_data(DOCTORS_FILE)
+    doctor = storage.find_one('doctors', email=email)
 
-    if email in doctors:
-        del doctors[email]
-        save_data(doctors, DOCTORS_FILE)
+    if doctor is not None and storage.delete('doctors', doctor['id']):
+        bump_profile_version(storage, 'doctor', email)
         flash('Doctor deleted successfully!', 'success')
     else:
         flash('Doctor not found!', 'danger')
@@ -233,7 +240,7 @@ def patients():
         flash('Please login first!', 'warning')
         return redirect(url_for('login'))
 
-    patients_data = load_data(PATIENTS_FILE)
+    patients_data = storage.load('user_details')
     return render_template('patients.html', patients=patients_data)
 
 @app.route('/patients/add', methods=['GET', 'POST'])
@@ -248,12 +255,14 @@ def add_patient():
         phone = request.form.get('phone')
         password = request.form.get('password')
 
-        patients = load_data(PATIENTS_FILE)
-
-        if email in patients:
+        if storage.get('user_details', email) is not None:
             flash('Patient with this email already exists!', 'danger')
             return redirect(url_for('add_patient'))
 
+        if storage.conflict('user_details', email, {'phone': phone}):
+            flash('Patient with this phone number already exists!', 'danger')
+            return redirect(url_for('add_patient'))
+
         # Handle profile picture upload
         profile_pic = None
         if 'profile_pic' in request.files:
@@ -265,16 +274,22 @@ def add_patient():
                 file.save(file_path)
                 profile_pic = f"uploads/{unique_filename}"
 
-        # Create new patient
-        patients[email] = {
-            "name": name,
-            "phone": phone,
-            "password": password,
-            "profile_pic": profile_pic,
-            "created_at": datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        }
+        # Create new patient, checking again under the lock in case another request took the email or phone
+        with storage.locked('user_details'):
+            if storage.get('user_details', email, parts=()) is not None:
+                flash('Patient with this email already exists!', 'danger')
+                return redirect(url_for('add_patient'))
+
+            if storage.put_unique('user_details', email, {
+                "name": name,
+                "phone": phone,
+                "password": password,
+                "profile_pic": profile_pic,
+                "created_at": datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            }):
+                flash('Patient with this phone number already exists!', 'danger')
+                return redirect(url_for('add_patient'))
 
-        save_data(patients, PATIENTS_FILE)
         flash('Patient added successfully!', 'success')
         return redirect(url_for('patients'))
 
@@ -286,20 +301,15 @@ def edit_patient(email):
         flash('Please login first!', 'warning')
         return redirect(url_for('login'))
 
-    patients = load_data(PATIENTS_FILE)
+    patient = storage.get('user_details', email)
 
-    if email not in patients:
+    if patient is None:
         flash('Patient not found!', 'danger')
         return redirect(url_for('patients'))
 
     if request.method == 'POST':
-        patients[email]['name'] = request.form.get('name')
-        patients[email]['phone'] = request.form.get('phone')
-
-        if request.form.get('password'):
-            patients[email]['password'] = request.form.get('password')
-
         # Handle profile picture upload
+        profile_pic = None
         if 'profile_pic' in request.files:
             file = request.files['profile_pic']
             if file and allowed_file(file.filename):
@@ -307,13 +317,35 @@ def edit_patient(email):
                 unique_filename = f"{datetime.now().strftime('%Y%m%d%H%M%S')}_{filename}"
                 file_path = os.path.join(app.config['UPLOAD_FOLDER'], unique_filename)
                 file.save(file_path)
-                patients[email]['profile_pic'] = f"uploads/{unique_filename}"
+                profile_pic = f"uploads/{unique_filename}"
 
-        save_data(patients, PATIENTS_FILE)
+        # Change the latest copy under the lock, leaving the patient's history and appointments alone
+        with storage.locked('user_details'):
+            patient = storage.get('user_details', email, parts=())
+            if patient is None:
+                flash('Patient not found!', 'danger')
+                return redirect(url_for('patients'))
+            patient = dict(patient)  # put_unique() compares it with the stored copy
+
+            patient['name'] = request.form.get('name')
+            patient['phone'] = request.form.get('phone')
+
+            if request.form.get('password'):
+                patient['password'] = request.form.get('password')
+
+            if profile_pic is not None:
+                patient['profile_pic'] = profile_pic
+
+            # Only a changed phone number has to be free
+            if storage.put_unique('user_details', email, patient):
+                flash('Patient with this phone number already exists!', 'danger')
+                return redirect(url_for('edit_patient', email=email))
+
+        bump_profile_version(storage, 'user', email)
         flash('Patient updated successfully!', 'success')
         return redirect(url_for('patients'))
 
-    return render_template('edit_patient.html', patient=patients[email], email=email)
+    return render_template('edit_patient.html', patient=patient, email=email)
 
 @app.route('/patients/delete/<email>')
 def delete_patient(email):
@@ -321,11 +353,8 @@ def delete_patient(email):
         flash('Please login first!', 'warning')
         return redirect(url_for('login'))
 
-    patients = load_data(PATIENTS_FILE)
-
-    if email in patients:
-        del patients[email]
-        save_data(patients, PATIENTS_FILE)
+    if storage.delete('user_details', email):
+        bump_profile_version(storage, 'user', email)
         flash('Patient deleted successfully!', 'success')
     else:
         flash('Patient not found!', 'danger')
@@ -543,7 +572,7 @@ def api_doctors():
     if 'admin_email' not in session:
         return jsonify({"error": "Unauthorized"}), 401
 
-    doctors = load_data(DOCTORS_FILE)
+    doctors = storage.load('doctors')
     return jsonify(doctors)
 
 @app.route('/api/patients')
@@ -551,7 +580,7 @@ def api_patients():
     if 'admin_email' not in session:
         return jsonify({"error": "Unauthorized"}), 401
 
-    patients = load_data(PATIENTS_FILE)
+    patients = storage.load('user_details')
     return jsonify(patients)
 
 @app.route('/api/medicines')
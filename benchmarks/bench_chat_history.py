@@ -0,0 +1,58 @@
+"""Cost of saving one chat message: whole-file rewrite vs the append-only log.
+
+The rewrite is what save_user_chat did before: load chat_history.json, add
+the message, trim the user to 50 and write the file back. The log appends
+one line to the user's file. Both run against histories of a growing number
+of users in a temporary directory.
+
+Run from the repository root:  python benchmarks/bench_chat_history.py
+"""
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import storage  # noqa: E402
+
+MESSAGE = {"timestamp": "2024-01-01 12:00:00", "query": "what helps with a headache",
+           "response": "Rest, drink water and take a mild pain reliever. " * 6}
+
+
+def history(users, per_user=50):
+    return {f"user{n}@example.com": [MESSAGE] * per_user for n in range(users)}
+
+
+def rewrite_save(store, email):
+    with store.update() as data:
+        data[email] = (data.get(email, []) + [MESSAGE])[-50:]
+
+
+def timed(fn, rounds):
+    start = time.perf_counter()
+    for n in range(rounds):
+        fn(n)
+    return (time.perf_counter() - start) / rounds
+
+
+def run():
+    print(f"{'users':>7s} {'rewrite':>12s} {'append':>12s} {'tail(10)':>12s}")
+    for users in (10, 100, 1000, 5000):
+        with tempfile.TemporaryDirectory() as base_dir:
+            legacy = os.path.join(base_dir, 'chat_history.json')
+            storage.atomic_write_json(legacy, history(users))
+            store = storage.JsonStore(legacy)
+            rounds = 200 if users < 1000 else 20
+            rewrite = timed(lambda n: rewrite_save(store, f"user{n % users}@example.com"), rounds)
+
+            log = storage.AppendLog('chat_history', os.path.join(base_dir, 'chat_history'), legacy, 50)
+            log.tail('user0@example.com')  # Splits the flat file
+            append = timed(lambda n: log.append(f"user{n % users}@example.com", MESSAGE), 200)
+            tail = timed(lambda n: log.tail(f"user{n % users}@example.com", 10), 200)
+            log.compactor.join()
+        print(f"{users:7d} {rewrite * 1e3:9.2f} ms {append * 1e3:9.2f} ms {tail * 1e3:9.2f} ms")
+
+
+if __name__ == '__main__':
+    run()
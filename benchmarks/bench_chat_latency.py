@@ -0,0 +1,77 @@
+"""Time to first byte and total time of /chat: JSON reply vs the SSE stream.
+
+Each message is posted by a logged-in user through the Flask test client, so
+the JSON reply includes the chat history write and the stream hands it to
+the background writer. The second round makes the model 50 ms slower, to
+stand in for a heavier responder such as retrieval or a local model.
+
+Run from the repository root:  python benchmarks/bench_chat_latency.py [rounds]
+"""
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+MESSAGES = {
+    "canned reply": "can I book an appointment with a doctor",
+    "symptom prediction": "I have a headache, high fever and a stiff neck",
+}
+
+
+def timed_post(client, message, stream):
+    """(seconds to the first body byte, seconds to the end) of one /chat call"""
+    start = time.perf_counter()
+    response = client.post('/chat?stream=1' if stream else '/chat', json={"message": message}, buffered=False)
+    first = None
+    for chunk in response.response:
+        if chunk and first is None:
+            first = time.perf_counter() - start
+    response.close()
+    return first, time.perf_counter() - start
+
+
+def measure(client, label, rounds):
+    for name, message in MESSAGES.items():
+        for stream in (False, True):
+            timings = [timed_post(client, message, stream) for _ in range(rounds)]
+            ttfb = statistics.median(first for first, _ in timings)
+            total = statistics.median(end for _, end in timings)
+            mode = "SSE" if stream else "JSON"
+            print(f"{label:10s} {name:20s} {mode:5s} ttfb {ttfb * 1e3:8.2f} ms   total {total * 1e3:8.2f} ms")
+
+
+def run(rounds=50):
+    import main
+    from storage import JsonStorage
+
+    # The chat history is written to a scratch directory
+    work_dir = tempfile.mkdtemp()
+    try:
+        main.storage = JsonStorage(work_dir)
+        main.model_registry.preload()
+        client = main.app.test_client()
+        with client.session_transaction() as session:
+            session['user'] = 'bench@example.com'
+        for message in MESSAGES.values():  # Warm the caches
+            timed_post(client, message, True)
+        main.prediction_cache.maxsize = 0  # Every symptom message runs the model
+
+        measure(client, "model", rounds)
+        predict = main.get_predicted_value
+
+        def slow_predict(symptoms):
+            time.sleep(0.05)
+            return predict(symptoms)
+
+        main.get_predicted_value = slow_predict
+        measure(client, "model+50ms", max(rounds // 5, 5))
+        main.chat_writer.join()
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 50)
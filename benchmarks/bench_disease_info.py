@@ -0,0 +1,65 @@
+"""Micro-benchmark: per-request pandas filtering vs the precomputed disease table.
+
+Run from the repository root:  python benchmarks/bench_disease_info.py
+"""
+import ast
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402
+import model_registry  # noqa: E402
+
+
+def pandas_helper(dis):
+    """The original helper(): five DataFrame scans per call"""
+    description = model_registry.get('description')
+    precautions = model_registry.get('precautions')
+    medications = model_registry.get('medications')
+    diets = model_registry.get('diets')
+    workout = model_registry.get('workout')
+
+    desc = description[description['Disease'] == dis]['Description']
+    desc = " ".join([w for w in desc])
+
+    pre = precautions[precautions['Disease'] == dis][['Precaution_1', 'Precaution_2', 'Precaution_3', 'Precaution_4']]
+    pre = [col for col in pre.values]
+
+    med = medications[medications['Disease'] == dis]['Medication']
+    med = [med for med in med.values]
+
+    die = diets[diets['Disease'] == dis]['Diet']
+    die = [die for die in die.values]
+
+    wrkout = workout[workout['disease'] == dis]['workout']
+
+    return desc, pre, med, die, wrkout
+
+
+def check_same_content(diseases):
+    for dis in diseases:
+        desc, pre, med, die, wrkout = pandas_helper(dis)
+        info = main.helper(dis)
+        assert info.description == desc, dis
+        assert info.precautions == tuple(p for row in pre for p in row if isinstance(p, str)), dis
+        assert info.medications == tuple(m for cell in med for m in ast.literal_eval(cell)), dis
+        assert info.diet == tuple(d for cell in die for d in ast.literal_eval(cell)), dis
+        assert info.workout == tuple(wrkout), dis
+
+
+def run():
+    diseases = list(main.diseases_list.values())
+    check_same_content(diseases)
+    print(f"Same content as the pandas helper for all {len(diseases)} diseases")
+
+    rounds = 20
+    for label, fn in (("pandas helper", pandas_helper), ("disease table", main.helper)):
+        seconds = min(timeit.repeat(lambda: [fn(dis) for dis in diseases], number=rounds, repeat=5))
+        per_call = seconds / (rounds * len(diseases))
+        print(f"{label:14s}: {per_call * 1e6:10.2f} us per call")
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,98 @@
+"""Slot checks against a busy doctor, and a double-booking race between processes.
+
+A doctor with weekday hours gets two years of random bookings. is_free() and a
+month of free_slots() are timed against a linear scan over the bookings.
+Then several processes try to book the same slot at once through their own
+storage instances, and exactly one of them must succeed.
+
+Run from the repository root:  python benchmarks/bench_scheduling.py [bookings]
+"""
+import datetime
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import storage  # noqa: E402
+from scheduling import SLOT_MINUTES, Scheduler, format_slot, slot_start  # noqa: E402
+
+DOCTOR = {
+    "id": "doctor-1", "name": "Dr Bench",
+    "timeSlots": [{"day": day, "slots": ["09:00 AM - 12:00 PM", "02:00 PM - 05:00 PM"]}
+                  for day in ("Monday", "Tuesday", "Wednesday", "Thursday", "Friday")],
+}
+
+
+def appointment(start):
+    return {"id": str(uuid.uuid4()), "doctor_id": DOCTOR["id"], "status": "Upcoming", **format_slot(start)}
+
+
+def linear_is_free(appointments, start):
+    """The check without an index: compare with every booking of the doctor"""
+    end = start + datetime.timedelta(minutes=SLOT_MINUTES)
+    for item in appointments:
+        if item["doctor_id"] == DOCTOR["id"] and item["status"] != "Cancelled":
+            booked = slot_start(item["date"], item["time"])
+            if booked < end and start < booked + datetime.timedelta(minutes=SLOT_MINUTES):
+                return False
+    return True
+
+
+def timed(fn, rounds):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        fn()
+    return (time.perf_counter() - start) / rounds
+
+
+def race(base_dir, start, results):
+    # Each process has its own storage, as gunicorn workers do
+    scheduler = Scheduler(storage.JsonStorage(base_dir))
+    results.put(scheduler.book(DOCTOR, appointment(start)))
+
+
+def run(n=5000):
+    rng = random.Random(0)
+    with tempfile.TemporaryDirectory() as base_dir:
+        store = storage.JsonStorage(base_dir)
+        scheduler = Scheduler(store)
+        monday = datetime.date.today() + datetime.timedelta(days=7 - datetime.date.today().weekday())
+        candidates = list(scheduler.free_slots(DOCTOR, 730, monday))
+        # At most every other slot, so some stay free
+        booked = rng.sample(candidates, min(n, len(candidates) // 2))
+        store.save('appointments', [appointment(start) for start in booked])
+        appointments = store.load('appointments')
+        print(f"{len(booked)} bookings in two years of {len(candidates)} slots")
+
+        probes = rng.sample(candidates, 200)
+        scheduler.booked(DOCTOR["id"])
+        indexed = timed(lambda: [scheduler.is_free(DOCTOR, start) for start in probes], 5) / len(probes)
+        scan = timed(lambda: [linear_is_free(appointments, start) for start in probes[:20]], 1) / 20
+        mismatches = sum(scheduler.is_free(DOCTOR, start) != linear_is_free(appointments, start) for start in probes)
+        print(f"is_free:          indexed {indexed * 1e6:8.1f} us   linear scan {scan * 1e6:10.1f} us   "
+              f"({mismatches} disagreements)")
+        month = timed(lambda: list(scheduler.free_slots(DOCTOR, 30, monday)), 20)
+        print(f"free_slots(30 d): {month * 1e3:8.2f} ms")
+
+        # Every process aims at the same free slot
+        target = next(scheduler.free_slots(DOCTOR, 30, monday))
+        results = multiprocessing.Queue()
+        workers = [multiprocessing.Process(target=race, args=(base_dir, target, results)) for _ in range(8)]
+        for worker in workers:
+            worker.start()
+        outcomes = [results.get() for _ in workers]
+        for worker in workers:
+            worker.join()
+        won = outcomes.count(None)
+        print(f"8 processes booking {target}: {won} booked, {len(outcomes) - won} refused")
+        if won != 1 or mismatches:
+            raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 5000)
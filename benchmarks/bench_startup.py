@@ -0,0 +1,45 @@
+"""Cold start benchmark: importing main.py with lazy vs eager model loading.
+
+"eager" imports main and then preloads the model and disease table, which is
+what every import paid before the registry made loading lazy. Each sample is
+a fresh interpreter, so nothing is cached in-process.
+
+Run from the repository root:  python benchmarks/bench_startup.py [runs]
+"""
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SNIPPETS = {
+    'lazy': "import main",
+    'eager': "import main, model_registry; model_registry.preload()",
+}
+
+TIMED = """
+import sys, time, warnings
+warnings.simplefilter('ignore')
+start = time.perf_counter()
+{snippet}
+print(time.perf_counter() - start, 'pandas' in sys.modules)
+"""
+
+
+def sample(snippet):
+    output = subprocess.run([sys.executable, '-c', TIMED.format(snippet=snippet)], cwd=ROOT, check=True,
+                            capture_output=True, text=True).stdout.split()
+    return float(output[-2]), output[-1] == 'True'
+
+
+def run(runs=5):
+    for label, snippet in SNIPPETS.items():
+        samples = [sample(snippet) for _ in range(runs)]
+        seconds = [s for s, _ in samples]
+        print(f"{label:6s}: median {statistics.median(seconds) * 1000:7.1f} ms, "
+              f"min {min(seconds) * 1000:7.1f} ms, pandas imported: {samples[0][1]}")
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 5)
@@ -0,0 +1,73 @@
+"""Throughput of free-text symptom extraction on a synthetic chat corpus.
+
+Compares the Aho-Corasick SymptomExtractor with a regex search per alias,
+then runs extraction plus batch prediction end to end.
+
+Run from the repository root:  python benchmarks/bench_symptom_extraction.py [n_messages]
+"""
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402
+
+OPENERS = ["I have", "I've had", "Since yesterday I have", "My son has", "Been dealing with", "Doctor, I get"]
+FILLERS = ["for three days", "mostly at night", "after eating", "and it is getting worse", "on and off",
+           "since last week", "but I can still work", "which started suddenly"]
+CHATTER = ["hello", "can you help me", "thanks", "what should I do", "is this serious", "please advise"]
+
+
+def synthetic_corpus(n, seed=0):
+    rng = random.Random(seed)
+    phrases = [alias for alias, _ in main.symptom_resolver.aliases]
+    corpus = []
+    for _ in range(n):
+        mentioned = rng.sample(phrases, rng.randint(1, 4))
+        if rng.random() < 0.2:
+            mentioned[0] = "no " + mentioned[0]
+        text = f"{rng.choice(CHATTER)}. {rng.choice(OPENERS)} {', '.join(mentioned[:-1])}"
+        text += f" and {mentioned[-1]}" if len(mentioned) > 1 else mentioned[0]
+        corpus.append(f"{text} {rng.choice(FILLERS)}. {rng.choice(CHATTER)}?")
+    return corpus
+
+
+def regex_extract(patterns, text):
+    """The straightforward alternative: one regex search per alias"""
+    text = main.normalise(text)
+    return [name for pattern, name in patterns if pattern.search(text)]
+
+
+def timed(label, fn, corpus):
+    start = time.perf_counter()
+    result = fn(corpus)
+    seconds = time.perf_counter() - start
+    size = sum(len(text) for text in corpus) / 1e6
+    print(f"{label:30s}: {len(corpus) / seconds:10.0f} messages/s  {size / seconds:6.2f} MB/s")
+    return result
+
+
+def run(n=20000):
+    corpus = synthetic_corpus(n)
+    patterns = [(re.compile(r'\b' + re.escape(alias) + r'\b'), name) for alias, name in main.symptom_resolver.aliases]
+    extractor = main.symptom_extractor
+    print(f"{n} synthetic messages, {len(patterns)} symptom phrases")
+
+    timed("regex per alias", lambda texts: [regex_extract(patterns, text) for text in texts], corpus)
+    found = timed("Aho-Corasick extractor", lambda texts: [extractor.extract(text) for text in texts], corpus)
+
+    def extract_and_predict(texts):
+        symptom_sets = [symptoms for symptoms in (extractor.extract(text) for text in texts) if symptoms]
+        return main.get_predicted_values(symptom_sets)
+
+    main.model_registry.preload()
+    timed("extract + batch predict", extract_and_predict, corpus)
+    print(f"{sum(1 for symptoms in found if symptoms)} of {n} messages had symptoms, "
+          f"{sum(len(symptoms) for symptoms in found) / n:.2f} per message")
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
@@ -0,0 +1,100 @@
+"""Regression check: a cancelled appointment frees its slot for the next booking.
+
+A patient books a slot through the Flask routes, cancels it, and books the
+same slot again; the second booking must go through. The same is done with
+the doctor marking the appointment Cancelled, with a second booking of the
+patient at that doctor that must keep its status. Everything is written to a
+scratch directory (PASMA_STORAGE=sqlite checks the SQLite backend).
+
+Run from the repository root:  python benchmarks/check_appointment_cancel.py
+"""
+import datetime
+import os
+import shutil
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+PATIENT = 'check@example.com'
+DOCTOR = {
+    "id": "doctor-check", "name": "Dr Check", "email": "dr.check@example.com", "specialization": "General",
+    "timeSlots": [{"day": day, "slots": ["09:00 AM - 12:00 PM", "02:00 PM - 05:00 PM"]}
+                  for day in ("Monday", "Tuesday", "Wednesday", "Thursday", "Friday")],
+}
+
+
+def next_weekday():
+    day = datetime.date.today() + datetime.timedelta(days=1)
+    while day.weekday() >= 5:
+        day += datetime.timedelta(days=1)
+    return str(day)
+
+
+def run():
+    import main
+    from scheduling import Scheduler
+    from storage import open_storage
+
+    work_dir = tempfile.mkdtemp()
+    failures = []
+
+    def expect(label, ok):
+        print(f"{'ok  ' if ok else 'FAIL'} {label}")
+        if not ok:
+            failures.append(label)
+
+    try:
+        main.storage = open_storage(work_dir)
+        main.scheduler = Scheduler(main.storage)
+        main.storage.put('doctors', DOCTOR['id'], DOCTOR)
+        main.storage.put('user_details', PATIENT, {"name": "Check", "phone": "Not provided", "appointments": []})
+        client = main.app.test_client()
+        date = next_weekday()
+
+        def book(time):
+            client.post('/book_appointment', data={
+                "doctor_id": DOCTOR['id'], "doctor_name": DOCTOR['name'], "doctor_specialty": "General",
+                "appointment_date": date, "appointment_time": time, "purpose": "check"})
+            with client.session_transaction() as session:
+                refused = session.pop('_flashes', [])
+            return not refused
+
+        def own(time):
+            return [appointment for appointment in main.storage.get_part('user_details', PATIENT, 'appointments')
+                    if appointment['time'] == time]
+
+        def shared(time):
+            return [appointment for appointment in main.storage.find('appointments', doctor_id=DOCTOR['id'])
+                    if appointment['time'] == time]
+
+        with client.session_transaction() as session:
+            session['user'] = PATIENT
+
+        # Cancelled by the patient
+        expect("patient books 09:00 AM", book('09:00 AM'))
+        expect("the slot is then taken", not book('09:00 AM'))
+        client.post('/cancel_appointment', data={"appointment_id": own('09:00 AM')[0]['id']})
+        expect("the shared record is cancelled", shared('09:00 AM')[0]['status'] == 'Cancelled')
+        expect("the slot can be booked again", book('09:00 AM'))
+
+        # Cancelled by the doctor, next to another booking with the same doctor
+        expect("patient books 10:00 AM", book('10:00 AM'))
+        expect("patient books 10:30 AM", book('10:30 AM'))
+        with client.session_transaction() as session:
+            session['doctor'] = DOCTOR['email']
+        client.post('/update-appointment-status', data={"appointment_id": shared('10:30 AM')[0]['id'],
+                                                        "status": "Cancelled"})
+        expect("the patient's 10:30 AM copy is cancelled", own('10:30 AM')[0]['status'] == 'Cancelled')
+        expect("the patient's 10:00 AM copy keeps its status", own('10:00 AM')[0]['status'] == 'Upcoming')
+        expect("the 10:30 AM slot can be booked again", book('10:30 AM'))
+    finally:
+        main.chat_writer.join()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    print(f"{len(failures)} failures")
+    return not failures
+
+
+if __name__ == '__main__':
+    sys.exit(0 if run() else 1)
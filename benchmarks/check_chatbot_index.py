@@ -0,0 +1,144 @@
+"""Regression check and timings: chatbot.find_best_match vs the original linear scan.
+
+Every response key, variations of them and random word mixes go through
+both implementations and must get the same reply. Then both are timed on
+knowledge bases grown to tens of thousands of synthetic entries.
+
+Run from the repository root:  python benchmarks/check_chatbot_index.py
+"""
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import chatbot  # noqa: E402
+
+RESPONSES = chatbot.load_responses()
+
+
+def reference_find_best_match(user_input, responses=RESPONSES):
+    """find_best_match() as it was before the index, unchanged apart from the responses argument"""
+    user_input = user_input.lower()
+
+    # Check for exact matches first
+    if user_input in responses:
+        return responses[user_input]
+
+    # Check for greetings
+    if re.search(r'\b(hi|hello|hey|greetings)\b', user_input):
+        return responses["greeting"]
+
+    # Check for thanks
+    if re.search(r'\b(thanks|thank you|appreciate it)\b', user_input):
+        return responses["thanks"]
+
+    # Check for goodbyes
+    if re.search(r'\b(bye|goodbye|see you|farewell)\b', user_input):
+        return responses["goodbye"]
+
+    # Check for help requests
+    if re.search(r'\b(help|assist|support)\b', user_input):
+        return responses["help"]
+
+    # Check for partial matches
+    best_match = None
+    highest_score = 0
+
+    for key in responses:
+        if key in ["default", "greeting", "thanks", "goodbye", "help", "disclaimer"]:
+            continue
+
+        # Calculate match score based on word overlap
+        key_words = set(key.split())
+        input_words = set(user_input.split())
+        common_words = key_words.intersection(input_words)
+
+        if common_words:
+            score = len(common_words) / len(key_words)
+            if score > highest_score:
+                highest_score = score
+                best_match = key
+
+    # Return the best match if score is above threshold, otherwise default response
+    if best_match and highest_score > 0.3:
+        return responses[best_match]
+    else:
+        return responses["default"]
+
+
+def queries(responses, n_random=20000, seed=0):
+    rng = random.Random(seed)
+    keys = list(responses)
+    vocabulary = sorted({word for key in keys for word in key.split()}) + ["pizza", "tomorrow", "why", "my"]
+    yield from keys
+    yield from (key.upper() for key in keys)
+    for key in keys:
+        words = key.split()
+        yield " ".join(words[:-1])
+        yield " ".join(reversed(words))
+        yield "what about " + key + " please"
+    yield from ("", "   ", "hello there", "thank you", "see you", "can you assist", "bye", "HI", "this", "chip")
+    for _ in range(n_random):
+        yield " ".join(rng.choice(vocabulary) for _ in range(rng.randint(1, 8)))
+
+
+def check(responses, index, sample=None):
+    checked = list(queries(responses))
+    if sample is not None:
+        checked = random.Random(2).sample(checked, sample)
+    mismatches = 0
+    total = 0
+    for query in checked:
+        total += 1
+        if index.find_best_match(query) != reference_find_best_match(query, responses):
+            mismatches += 1
+            print(f"Mismatch for {query!r}")
+    print(f"{total} queries, {mismatches} mismatches")
+    return mismatches
+
+
+def grown_responses(size, seed=1):
+    """The real responses plus synthetic topics, to see how lookups scale"""
+    rng = random.Random(seed)
+    vocabulary = [f"term{n}" for n in range(5000)]
+    responses = dict(RESPONSES)
+    while len(responses) < size:
+        key = " ".join(rng.sample(vocabulary, rng.randint(2, 5)))
+        responses[key] = f"Answer about {key}."
+    return responses
+
+
+def timed(fn, inputs, rounds=1):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for text in inputs:
+            fn(text)
+    return (time.perf_counter() - start) / (rounds * len(inputs))
+
+
+def run():
+    failures = check(RESPONSES, chatbot.ResponseIndex(RESPONSES))
+    # The compiled artifact must give the same answers as indexing the source
+    compiled = chatbot.compile_knowledge_base(RESPONSES)
+    failures += check(RESPONSES, chatbot.ResponseIndex(chatbot.responses_from_compiled(compiled), compiled))
+    inputs = ["how to sleep better at night", "what are the symptoms of depression", "best foods for energy",
+              "my back hurts when lifting", "term17 term42 term99", "is coffee bad for me"]
+    print(f"\n{'entries':>8s} {'linear scan':>14s} {'inverted index':>16s}")
+    for size in (len(RESPONSES), 1000, 10000, 50000):
+        responses = grown_responses(size)
+        index = chatbot.ResponseIndex(responses)
+        if size == 10000:
+            # The linear scan is slow at this size, so only a sample of the queries
+            failures += check(responses, index, sample=2000)
+        scan = timed(lambda text: reference_find_best_match(text, responses), inputs)
+        indexed = timed(index.find_best_match, inputs, rounds=100)
+        print(f"{len(responses):8d} {scan * 1e6:11.1f} us {indexed * 1e6:13.1f} us")
+    if failures:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,72 @@
+"""Equivalence check and timings: sklearn SVC vs SVCEngine vs LinearSVCEngine.
+
+Every row of datasets/Training.csv, plus random sparse symptom sets, is
+predicted by the pickled model and by both engines (dense and active-index
+inputs); any disagreement fails the script.
+
+Run from the repository root:  python benchmarks/check_linear_engine.py
+"""
+import os
+import pickle
+import sys
+import time
+import warnings
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import svc_engine  # noqa: E402
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+
+def random_inputs(n, n_features, seed=0):
+    rng = np.random.default_rng(seed)
+    return (rng.random((n, n_features)) < rng.random((n, 1)) * 0.1).astype(np.float64)
+
+
+def check(svc, engines, X, label):
+    expected = svc.predict(X)
+    active = [np.flatnonzero(row).tolist() for row in X]
+    for name, engine in engines.items():
+        for mode, predicted in (('dense', engine.predict(X)), ('active', engine.predict_active(active))):
+            mismatches = int(np.count_nonzero(predicted != expected))
+            print(f"{label}: {name:16s} {mode:6s} {mismatches} mismatches in {len(X)} rows")
+            if mismatches:
+                raise SystemExit(1)
+
+
+def run():
+    # Version and feature-name warnings from sklearn would drown the output
+    warnings.simplefilter('ignore')
+    with open('models/svc.pkl', 'rb') as f:
+        svc = pickle.load(f)
+    meta, arrays = svc_engine.svc_arrays(svc)
+    engines = {'SVCEngine': svc_engine.SVCEngine(meta, arrays), 'LinearSVCEngine': svc_engine.LinearSVCEngine(meta, arrays)}
+
+    training = pd.read_csv('datasets/Training.csv').iloc[:, :-1].to_numpy(dtype=np.float64)
+    check(svc, engines, training, 'Training.csv')
+    check(svc, engines, random_inputs(50000, training.shape[1]), 'random')
+
+    X = random_inputs(20000, training.shape[1], seed=1)
+    active = [np.flatnonzero(row).tolist() for row in X]
+    single = active[:2000]
+    print()
+    print(f"{'':16s} {'batch of 20000':>16s} {'single request':>16s}")
+    _, batch = timed(svc.predict, X)
+    _, one = timed(lambda: [svc.predict(X[i:i + 1]) for i in range(len(single))])
+    print(f"{'sklearn SVC':16s} {batch * 1000:13.1f} ms {one / len(single) * 1e6:13.1f} us")
+    for name, engine in engines.items():
+        _, batch = timed(engine.predict_active, active)
+        _, one = timed(lambda: [engine.predict_active([indices]) for indices in single])
+        print(f"{name:16s} {batch * 1000:13.1f} ms {one / len(single) * 1e6:13.1f} us")
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,15 @@
+# gunicorn -c gunicorn.conf.py main:app
+import os
+
+bind = os.environ.get('PASMA_BIND', '0.0.0.0:5001')
+workers = int(os.environ.get('WEB_CONCURRENCY', '2'))
+# Threads per worker; chat history long-polls and event streams each hold one while they wait
+threads = int(os.environ.get('PASMA_THREADS', '8'))
+
+
+def on_starting(server):
+    # Load the model and disease table once in the master; forked workers
+    # share those pages instead of each loading its own copy
+    import model_registry
+    model_registry.preload()
+    server.log.info("Preloaded %s", ", ".join(model_registry.PREDICTION_RESOURCES))
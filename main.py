@@ -1,13 +1,21 @@
-from flask import Flask, request, render_template, jsonify, redirect, url_for, session, flash
-import numpy as np
-import pandas as pd
-import pickle
+from flask import Flask, Response, request, render_template, jsonify, redirect, url_for, session, flash
 import json
 import os
 import datetime
 import uuid
 import re
+import heapq
+import hashlib
+import threading
+import time
+import atexit
 from werkzeug.utils import secure_filename
+from storage import LOGS, BackgroundWorker, bump_profile_version, matches, open_storage, profile_version
+from prediction_cache import PredictionCache, symptom_mask
+from triage import TriageScorer
+from scheduling import Scheduler, format_slot, slot_start
+from symptom_resolver import SymptomExtractor, SymptomResolver, normalise
+import model_registry
 
 app = Flask(__name__)
 
@@ -33,172 +41,190 @@ CHAT_HISTORY_FILE = "chat_history.json"  # For storing AI assistant chat history
 NEWSLETTER_FILE = "newsletter_emails.json"  # For storing newsletter email subscriptions
 
 
+# Storage backend (flat JSON files by default, SQLite with PASMA_STORAGE=sqlite),
+# shared with the admin app
+storage = open_storage()
+
+
 def load_users():
-    if not os.path.exists(USER_FILE):  # Check if file exists
-        return {}  # Return empty dictionary if file is missing
-    try:
-        with open(USER_FILE, "r") as f:
-            return json.load(f)
-    except json.JSONDecodeError:
-        return {}  # If file is corrupted, return empty dictionary
+    return storage.load('users')
 
 
 def save_users(users):
-    with open(USER_FILE, "w") as f:
-        json.dump(users, f, indent=4)
+    storage.save('users', users)
 
 
 def load_user_details():
-    if not os.path.exists(USER_DETAILS_FILE):
-        return {}
-    try:
-        with open(USER_DETAILS_FILE, "r") as f:
-            return json.load(f)
-    except json.JSONDecodeError:
-        return {}
+    return storage.load('user_details')
 
 
 def save_user_details(user_details):
-    with open(USER_DETAILS_FILE, "w") as f:
-        json.dump(user_details, f, indent=4)
+    storage.save('user_details', user_details)
 
 
 # Helper functions for doctor data
 def load_doctors():
-    if not os.path.exists(DOCTOR_FILE):
-        return []
-    try:
-        with open(DOCTOR_FILE, "r") as f:
-            return json.load(f)
-    except json.JSONDecodeError:
-        return []
+    return storage.load('doctors')
 
 
 def save_doctors(doctors):
-    with open(DOCTOR_FILE, "w") as f:
-        json.dump(doctors, f, indent=4)
+    storage.save('doctors', doctors)
 
 
 def get_doctor_by_email(email):
-    doctors = load_doctors()
-    for doctor in doctors:
-        if doctor.get('email') == email:
-            return doctor
-    return None
+    return storage.find_one('doctors', email=email)
+
+
+def save_doctor(doctor):
+    storage.put('doctors', doctor['id'], doctor)
+
+
+def update_doctor(email, changes):
+    """Apply changes to the latest copy of a doctor's record under the doctors lock; False for an unknown doctor"""
+    with storage.locked('doctors'):
+        doctor = get_doctor_by_email(email)
+        if doctor is None:
+            return False
+        # A changed copy: the record find_one() gave is the shared cached one
+        save_doctor(dict(doctor, **changes))
+        return True
 
 
 def load_doctor_credentials():
-    if not os.path.exists(DOCTOR_CREDENTIALS_FILE):
-        return {}
-    try:
-        with open(DOCTOR_CREDENTIALS_FILE, "r") as f:
-            return json.load(f)
-    except json.JSONDecodeError:
-        return {}
+    return storage.load('doctor_credentials')
 
 
 def save_doctor_credentials(credentials):
-    with open(DOCTOR_CREDENTIALS_FILE, "w") as f:
-        json.dump(credentials, f, indent=4)
+    storage.save('doctor_credentials', credentials)
 
 
 # Helper functions for appointments
 def load_appointments():
-    if not os.path.exists(APPOINTMENT_FILE):
-        return []
-    try:
-        with open(APPOINTMENT_FILE, "r") as f:
-            return json.load(f)
-    except json.JSONDecodeError:
-        return []
+    return storage.load('appointments')
 
 
 def save_appointments(appointments):
-    with open(APPOINTMENT_FILE, "w") as f:
-        json.dump(appointments, f, indent=4)
+    storage.save('appointments', appointments)
 
 
 # Helper functions for medications
 def load_medications():
-    if not os.path.exists(MEDICATION_FILE):
-        return {}
-    try:
-        with open(MEDICATION_FILE, "r") as f:
-            return json.load(f)
-    except json.JSONDecodeError:
-        return {}
+    return storage.load('medications')
 
 
 def save_medications(medications):
-    with open(MEDICATION_FILE, "w") as f:
-        json.dump(medications, f, indent=4)
+    storage.save('medications', medications)
 
 
 # Helper functions for chat history
 def load_chat_history():
-    if not os.path.exists(CHAT_HISTORY_FILE):
-        return {}
-    try:
-        with open(CHAT_HISTORY_FILE, "r") as f:
-            return json.load(f)
-    except json.JSONDecodeError:
-        return {}
+    return storage.load('chat_history')
 
 
 def save_chat_history(chat_history):
-    with open(CHAT_HISTORY_FILE, "w") as f:
-        json.dump(chat_history, f, indent=4)
+    storage.save('chat_history', chat_history)
+
+
+# Free slots and booking conflicts of the doctors, from their timeSlots and the appointments
+scheduler = Scheduler(storage)
+NEXT_SLOT_DAYS = 14  # How far ahead the doctor list looks for each doctor's next free slot
+MAX_SLOT_DAYS = 60
 
 
 def load_newsletter_emails():
-    if not os.path.exists(NEWSLETTER_FILE):
-        return []
-    try:
-        with open(NEWSLETTER_FILE, "r") as f:
-            return json.load(f)
-    except json.JSONDecodeError:
-        return []
+    return storage.load('newsletter_emails')
 
 
 def save_newsletter_emails(emails):
-    with open(NEWSLETTER_FILE, "w") as f:
-        json.dump(emails, f, indent=4)
+    storage.save('newsletter_emails', emails)
 
 
-def allowed_file(filename):
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+def get_user_record(email, create=False, parts=None):
+    """Details of one patient, optionally creating the placeholder record.
 
+    parts names the growing lists (medical_history, appointments, medications)
+    to read along; by default all of them are.
+    """
+    details = storage.get('user_details', email, parts=parts)
+    if details is None and create:
+        details = {
+            "name": "User",
+            "phone": "Not provided"
+        }
+        storage.put('user_details', email, details)
+    return details
 
-# Loading dataset
-sym_des = pd.read_csv("datasets/symtoms_df.csv")
-precautions = pd.read_csv("datasets/precautions_df.csv")
-workout = pd.read_csv("datasets/workout_df.csv")
-description = pd.read_csv("datasets/description.csv")
-medications = pd.read_csv('datasets/medications.csv')
-diets = pd.read_csv("datasets/diets.csv")
 
-# Loading model
-svc = pickle.load(open('models/svc.pkl', 'rb'))
+def init_medications(email):
+    """Give the patient an empty medications list unless one was added meanwhile"""
+    with storage.locked('user_details'):
+        if storage.get_part('user_details', email, 'medications') is None:
+            storage.put_part('user_details', email, 'medications', [])
 
 
-# Custom and helping functions
-# 1. Helper functions
-def helper(dis):
-    desc = description[description['Disease'] == dis]['Description']
-    desc = " ".join([w for w in desc])
+def update_patient_appointment(email, changes, **match):
+    """Apply changes to the patient's own copy of an appointment whose fields equal match.
+
+    Returns the changed copy, or None when the patient has none that matches.
+    The list is read and written back under the user_details lock, so a
+    booking or edit made at the same time is not lost.
+    """
+    with storage.locked('user_details'):
+        appointments = storage.get_part('user_details', email, 'appointments')
+        for appointment in appointments or ():
+            if matches(appointment, match):
+                appointment.update(changes)
+                storage.put_part('user_details', email, 'appointments', appointments)
+                return appointment
+        return None
+
+
+def update_shared_appointment(email, own, changes):
+    """Apply changes to the appointments.json record of the patient's own copy, through the scheduler.
+
+    A cancellation goes through scheduler.update() as well, which frees the slot.
+    """
+    shared = shared_appointment(email, own)
+    if shared is not None:
+        scheduler.update(shared['id'], changes, patient_email=email)
+
+
+def shared_appointment(email, own):
+    """The appointments.json record of the patient's own copy of an appointment, or None.
+
+    The copies are numbered per patient and name the record as shared_id.
+    Copies booked before that are matched to the record booked together with
+    them, by the same patient with the same doctor.
+    """
+    if own.get('shared_id'):
+        shared = storage.get('appointments', own['shared_id'])
+        return shared if shared is not None and shared.get('patient_email') == email else None
+    found = storage.find('appointments', patient_email=email, doctor_id=own.get('doctor_id'),
+                         created_at=own.get('created_at'))
+    return found[0] if found else None
 
-    pre = precautions[precautions['Disease'] == dis][['Precaution_1', 'Precaution_2', 'Precaution_3', 'Precaution_4']]
-    pre = [col for col in pre.values]
 
-    med = medications[medications['Disease'] == dis]['Medication']
-    med = [med for med in med.values]
+def update_own_appointment(shared, changes):
+    """Apply changes to the patient's own copy of an appointments.json record; the inverse of shared_appointment()"""
+    email = shared['patient_email']
+    own = update_patient_appointment(email, changes, shared_id=shared['id'])
+    if own is None:
+        own = update_patient_appointment(email, changes, shared_id=None, doctor_id=shared.get('doctor_id'),
+                                         created_at=shared.get('created_at'))
+    return own
 
-    die = diets[diets['Disease'] == dis]['Diet']
-    die = [die for die in die.values]
 
-    wrkout = workout[workout['disease'] == dis]['workout']
+def allowed_file(filename):
+    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+
 
-    return desc, pre, med, die, wrkout
+# Datasets and the model load on first use (see model_registry.py)
+
+# Custom and helping functions
+# 1. Helper functions
+def helper(dis):
+    """(description, precautions, medications, diet, workout) of a disease"""
+    return model_registry.get('disease_table').get(dis, model_registry.NO_DISEASE_INFO)
 
 
 symptoms_dict = {'itching': 0, 'skin_rash': 1, 'nodal_skin_eruptions': 2, 'continuous_sneezing': 3, 'shivering': 4,
@@ -248,40 +274,164 @@ diseases_list = {15: 'Fungal infection', 4: 'Allergy', 16: 'GERD', 9: 'Chronic c
 
 
 # 2. Model Prediction function
+# Predictions by symptom set; PASMA_PREDICTION_CACHE names a SQLite file shared by all workers
+prediction_cache = PredictionCache(maxsize=int(os.environ.get('PASMA_PREDICTION_CACHE_SIZE', '4096')),
+                                   path=os.environ.get('PASMA_PREDICTION_CACHE'),
+                                   shared_maxsize=int(os.environ.get('PASMA_PREDICTION_CACHE_SHARED_SIZE', '100000')))
+
+
 def get_predicted_value(patient_symptoms):
-    input_vector = np.zeros(len(symptoms_dict))
-    for item in patient_symptoms:
-        input_vector[symptoms_dict[item]] = 1
-    return diseases_list[svc.predict([input_vector])[0]]
+    return get_predicted_values([patient_symptoms])[0]
 
 
-# Add a new function to get the profile picture URL
-def get_profile_picture(email):
-    user_details = load_user_details()
-    if email in user_details and 'profile_pic' in user_details[email]:
-        return user_details[email]['profile_pic']
-    return None
+def get_predicted_values(symptom_sets):
+    """Predict many symptom lists with a single model call, in input order"""
+    if not symptom_sets:
+        return []
+    active = [sorted({symptoms_dict[item] for item in items}) for items in symptom_sets]
+    model = model_registry.get('svc')
+    prediction_cache.use_model(model.meta.get('source_signature'))
+
+    masks = [symptom_mask(indices) for indices in active]
+    diseases = prediction_cache.get_many(masks)
+    # Each distinct uncached set goes to the model once
+    uncached = {}
+    for n, disease in enumerate(diseases):
+        if disease is None:
+            uncached.setdefault(masks[n], active[n])
+    if uncached:
+        predicted = dict(zip(uncached, (diseases_list[i] for i in model.predict_active(list(uncached.values())))))
+        prediction_cache.put_many(predicted)
+        diseases = [predicted[mask] if disease is None else disease for mask, disease in zip(masks, diseases)]
+    return diseases
+
+
+# 3. Triage: severity score and urgent symptom combinations (see triage.py)
+triage_scorer = model_registry.Lazy(lambda: TriageScorer.from_csv(symptoms_dict))
+
+
+def get_triage(symptom_sets):
+    """{"severity", "urgent", "urgent_reasons"} of many symptom lists, scored in one pass"""
+    scorer = triage_scorer.get()
+    X = scorer.dense([{symptoms_dict[item] for item in items} for items in symptom_sets])
+    scores, fired, urgent = scorer.assess(X)
+    return [{"severity": float(score), "urgent": bool(is_urgent),
+             "urgent_reasons": scorer.reasons(fired_row, score)}
+            for score, fired_row, is_urgent in zip(scores, fired, urgent)]
+
+
+def get_top_diseases(patient_symptoms, k):
+    """[(disease, votes)] of the k diseases that won most one-vs-one contests, best first"""
+    active = sorted({symptoms_dict[item] for item in patient_symptoms})
+    classes, votes = model_registry.get('svc').top_k_active([active], k)
+    return [(diseases_list[i], int(v)) for i, v in zip(classes[0], votes[0])]
+
+
+# Free text to symptom names ('Skin Rash', 'diarrhea', 'stomache pain'), built once at import
+symptom_resolver = SymptomResolver(symptoms_dict)
+# Symptom phrases in chat messages ("headache and high fever"), from the same names and synonyms
+symptom_extractor = SymptomExtractor(symptom_resolver)
+
 
+def resolve_symptoms(user_symptoms):
+    """(symptom names, entries that match no symptom) for what the user typed.
 
-# Add a function to get doctor profile picture
-def get_doctor_profile_picture(email):
-    doctors = load_doctors()
-    for doctor in doctors:
-        if doctor.get('email') == email and 'profile_pic' in doctor:
-            return doctor['profile_pic']
+    Only names and synonyms are taken: a prediction is never made from a
+    guess at what a misspelt or vague entry meant. invalid_message() offers
+    the close names instead.
+    """
+    resolved = []
+    invalid_symptoms = []
+    for symptom in user_symptoms:
+        name = symptom_resolver.resolve(symptom, fuzzy=False)
+        if name is None:
+            invalid_symptoms.append(symptom)
+        else:
+            resolved.append(name)
+    return resolved, invalid_symptoms
+
+
+SUGGESTIONS_PER_SYMPTOM = 3
+
+
+def symptom_suggestions(invalid_symptoms):
+    """{entry: [close symptom names]} for the entries resolve_symptoms() did not take"""
+    return {symptom: [suggestion['symptom'] for suggestion in symptom_resolver.suggest(symptom, SUGGESTIONS_PER_SYMPTOM)]
+            for symptom in invalid_symptoms}
+
+
+def invalid_message(invalid_symptoms):
+    """"Invalid symptoms: ..." naming the close symptom names of each entry"""
+    described = []
+    for symptom, names in symptom_suggestions(invalid_symptoms).items():
+        described.append(f"{symptom} (did you mean {' or '.join(names)}?)" if names else symptom)
+    return f"Invalid symptoms: {', '.join(described)}"
+
+
+def parse_symptoms(symptoms):
+    """Symptom names from the comma separated text the forms send"""
+    user_symptoms = [s.strip() for s in symptoms.split(',')]
+    return [symptom.strip("[]' ") for symptom in user_symptoms]
+
+
+def typed_symptoms(symptoms):
+    """Symptom names from a JSON list of names or comma separated text; None for any other value"""
+    if isinstance(symptoms, str):
+        return parse_symptoms(symptoms)
+    if isinstance(symptoms, list) and all(isinstance(symptom, str) for symptom in symptoms):
+        return [symptom.strip() for symptom in symptoms]
     return None
 
 
-# Modify the existing context processor to also include doctor profile pictures
-@app.context_processor
-def inject_profile_picture():
+def disease_info(disease):
+    """helper() output as a dict, ready for jsonify"""
+    return helper(disease)._asdict()
+
+
+def build_profile_header(role, email):
+    """Name, picture and role of a logged-in patient ("user") or doctor, read from storage"""
+    # The version first: a record read after it is at least that new
+    version = profile_version(storage, role, email)
+    record = get_doctor_by_email(email) if role == 'doctor' else get_user_record(email, parts=())
+    record = record or {}
+    return {"role": role, "email": email, "name": record.get('name'),
+            "profile_picture": record.get('profile_pic'), "version": version}
+
+
+def remember_profile_header(role, email):
+    """Cache the header of the identity that just logged in or changed in the session"""
+    session['profile_header'] = build_profile_header(role, email)
+
+
+def profile_changed(role, email):
+    """After a change to a name or picture: refresh this session's header and mark every other copy stale"""
+    bump_profile_version(storage, role, email)
+    header = session.get('profile_header')
+    if header and header.get('role') == role and header.get('email') == email:
+        remember_profile_header(role, email)
+
+
+def current_profile_header():
+    """The logged-in identity's header from the session, rebuilt only when its version moved on"""
     if 'user' in session:
-        profile_pic = get_profile_picture(session['user'])
-        return {'profile_picture': profile_pic}
+        role, email = 'user', session['user']
     elif 'doctor' in session:
-        profile_pic = get_doctor_profile_picture(session['doctor'])
-        return {'profile_picture': profile_pic}
-    return {'profile_picture': None}
+        role, email = 'doctor', session['doctor']
+    else:
+        return None
+    header = session.get('profile_header')
+    if (header is None or header.get('role') != role or header.get('email') != email
+            or header.get('version') != profile_version(storage, role, email)):
+        remember_profile_header(role, email)
+        header = session['profile_header']
+    return header
+
+
+# Every page's header shows the profile picture; it comes from the session, not the data files
+@app.context_processor
+def inject_profile_picture():
+    header = current_profile_header()
+    return {'profile_header': header, 'profile_picture': header['profile_picture'] if header else None}
 
 
 # AI Assistant functions
@@ -290,6 +440,28 @@ def get_ai_response(query, user_email=None):
     Generate AI response based on user query
     This is a simplified version - in a real app, you'd integrate with an AI service
     """
+    return ''.join(stream_ai_response(query, user_email))
+
+
+# Wording that makes a message about the sender's symptoms, not a passing word
+SYMPTOM_REPORT = re.compile(r"\b(symptoms?|suffering from|been having|diagnos\w*|what (could|might) (it|this) be)\b",
+                            re.IGNORECASE)
+MIN_CHAT_SYMPTOMS = 2
+
+
+def stream_ai_response(query, user_email=None):
+    """The pieces of get_ai_response(), each yielded as soon as it is known"""
+    # Symptoms named in the message go straight to the classifier, as long as
+    # the message is clearly describing them ("I'm tired of waiting" is not)
+    mentioned = symptom_extractor.extract(query)
+    if len(mentioned) >= MIN_CHAT_SYMPTOMS or (mentioned and SYMPTOM_REPORT.search(query)):
+        yield from symptom_chat_chunks(mentioned)
+        return
+    yield canned_ai_response(query)
+
+
+def canned_ai_response(query):
+    """Fixed reply for the topic of a message without symptom names"""
     # Check if query is about symptoms
     if re.search(r'(symptom|feeling|pain|ache|sick|ill)', query, re.IGNORECASE):
         return "It sounds like you're describing some symptoms. You can use our symptom checker on the home page to get a preliminary diagnosis. Would you like me to guide you there?"
@@ -311,34 +483,102 @@ def get_ai_response(query, user_email=None):
         return "I'm your healthcare assistant. I can help you with symptom checking, appointment scheduling, medication tracking, and more. How can I assist you today?"
 
 
-def save_user_chat(user_email, query, response):
-    """Save chat history for a user"""
-    chat_history = load_chat_history()
+def symptom_chat_response(symptoms):
+    """Chat reply with the prediction for symptoms found in a message"""
+    return ''.join(symptom_chat_chunks(symptoms))
+
 
-    if user_email not in chat_history:
-        chat_history[user_email] = []
+def symptom_chat_chunks(symptoms):
+    """symptom_chat_response() a sentence at a time; the opening goes out before the model runs"""
+    yield f"Based on the symptoms you mentioned ({', '.join(normalise(symptom) for symptom in symptoms)}), "
+    disease = get_predicted_value(symptoms)
+    info = helper(disease)
+    yield f"the most likely condition is {disease}. {info.description}"
+    if info.precautions:
+        yield f" Suggested precautions: {', '.join(info.precautions)}."
+    if get_triage([symptoms])[0]['urgent']:
+        yield " Some of these symptoms may need urgent care, please contact a doctor or emergency services promptly."
+    yield (" For medications, diet and workouts use the symptom checker on the home page. "
+           "This is not a diagnosis, please consult a doctor.")
 
-    chat_history[user_email].append({
+
+# Long-polls and event streams of this process wake up as soon as a message is
+# saved; messages saved by other workers are noticed within CHAT_POLL_SECONDS
+chat_saved = threading.Condition()
+CHAT_POLL_SECONDS = 1.0
+CHAT_WAIT_LIMIT = 30  # Longest long-poll of /get_chat_history, in seconds
+CHAT_STREAM_SECONDS = 300  # An event stream ends after this long and the browser reconnects
+CHAT_KEEPALIVE_SECONDS = 15
+
+
+def save_user_chat(user_email, query, response):
+    """Save chat history for a user; returns the saved message with its id"""
+    # One line appended to the user's log; the log keeps the last 50 messages
+    entry = storage.append('chat_history', user_email, {
         "timestamp": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
         "query": query,
         "response": response
     })
+    with chat_saved:
+        chat_saved.notify_all()
+    return entry
+
+
+def get_user_chat_history(user_email, limit=10, before=None, after=None):
+    """Get recent chat history for a user, or the messages before/after a message id"""
+    return storage.tail('chat_history', user_email, limit, before, after)
+
+
+def chat_version(user_email):
+    """(version, modified time) of the user's chat history without reading it, None when there is none"""
+    return storage.log_version('chat_history', user_email)
+
+
+def chat_etag(user_email, version):
+    tag = f"{user_email}:{version[0] if version else ''}"
+    return hashlib.sha1(tag.encode('utf-8')).hexdigest()[:20]
+
+
+def wait_for_chat(user_email, version, timeout):
+    """Block until the user's chat history is no longer at version or timeout seconds pass; returns its version"""
+    deadline = time.monotonic() + timeout
+    with chat_saved:
+        while True:
+            current = chat_version(user_email)
+            remaining = deadline - time.monotonic()
+            if current != version or remaining <= 0:
+                return current
+            chat_saved.wait(min(remaining, CHAT_POLL_SECONDS))
 
-    # Keep only the last 50 messages
-    if len(chat_history[user_email]) > 50:
-        chat_history[user_email] = chat_history[user_email][-50:]
 
-    save_chat_history(chat_history)
+def chat_history_unchanged(user_email, version):
+    """Whether the request's If-None-Match/If-Modified-Since say the client has this version already"""
+    if request.if_none_match:
+        return request.if_none_match.contains(chat_etag(user_email, version))
+    modified = version[1] if version else None
+    since = request.if_modified_since
+    return modified is not None and since is not None and int(modified) <= since.timestamp()
 
 
-def get_user_chat_history(user_email, limit=10):
-    """Get recent chat history for a user"""
-    chat_history = load_chat_history()
+def sse_event(data, event=None, event_id=None):
+    """One Server-Sent Events message with data as JSON"""
+    lines = [f"id: {event_id}"] if event_id is not None else []
+    if event:
+        lines.append(f"event: {event}")
+    lines.append(f"data: {json.dumps(data)}")
+    return '\n'.join(lines) + '\n\n'
 
-    if user_email in chat_history:
-        return chat_history[user_email][-limit:]
 
-    return []
+def save_chat_job(job):
+    user_email, query, response = job
+    save_user_chat(user_email, query, response)
+
+
+# Streamed replies hand their message over here, so the end of the stream never
+# waits for the history write; messages are saved in the order they were
+# submitted, and pending ones before the process exits
+chat_writer = BackgroundWorker(save_chat_job, name='chat-writer', coalesce=False)
+atexit.register(chat_writer.join)
 
 
 # Creating routes
@@ -355,11 +595,12 @@ def login():
     if request.method == 'POST':
         email = request.form['email']
         password = request.form['password']
-        users = load_users()
+        stored_password = storage.get('users', email)
 
-        if email in users and users[email] == password:  # Check if user exists
+        if stored_password is not None and stored_password == password:  # Check if user exists
             session['user'] = email
             session['login_success'] = True  # Set a session variable for success message
+            remember_profile_header('user', email)
             return redirect(url_for('index'))  # Redirect to dashboard
         else:
             return render_template('login.html', error="Invalid email or password. Please try again.")
@@ -388,24 +629,11 @@ def signup():
         if password != confirm_password:
             return "Passwords do not match!", 400
 
-        users = load_users()
-        user_details = load_user_details()
-
         # Check if email already exists
-        if email in users:
+        if storage.get('users', email) is not None:
             return "User already exists!", 400
 
-        # Check if NID/Birth Certificate Number already exists
-        for user_email, details in user_details.items():
-            if details.get('nid_birth_certificate') == nid_birth_certificate:
-                return "NID/Birth Certificate Number already registered!", 400
-
-        # Save user credentials
-        users[email] = password
-        save_users(users)
-
-        # Save user details
-        user_details[email] = {
+        details = {
             "name": name,
             "phone": phone,
             "nid_birth_certificate": nid_birth_certificate,  # New field
@@ -418,7 +646,16 @@ def signup():
             "emergency_contact": emergency_contact,  # New field
             "medications": []  # Initialize medications list
         }
-        save_user_details(user_details)
+
+        # Save user details unless the NID/Birth Certificate Number or phone already exists
+        taken = storage.put_unique('user_details', email, details)
+        if taken == 'nid_birth_certificate':
+            return "NID/Birth Certificate Number already registered!", 400
+        if taken == 'phone':
+            return "Phone number already registered!", 400
+
+        # Save user credentials
+        storage.put('users', email, password)
 
         # Flask handles the redirect after signup
         return redirect(url_for('login'))
@@ -430,6 +667,7 @@ def signup():
 @app.route('/logout')
 def logout():
     session.pop('user', None)
+    session.pop('profile_header', None)
     return redirect(url_for('login'))
 
 
@@ -439,17 +677,10 @@ def profile():
     if 'user' not in session:
         return redirect(url_for('login'))
 
-    user_details = load_user_details()
     email = session['user']
+    details = get_user_record(email, create=True, parts=('medical_history',))
 
-    if email not in user_details:
-        user_details[email] = {
-            "name": "User",
-            "phone": "Not provided"
-        }
-        save_user_details(user_details)
-
-    return render_template('my-profile.html', user_details=user_details[email])
+    return render_template('my-profile.html', user_details=details)
 
 
 # Update Profile
@@ -470,36 +701,43 @@ def update_profile():
     address = request.form.get('address', '')
     emergency_contact = request.form.get('emergency_contact', '')  # New field
 
-    user_details = load_user_details()
-
     # Process profile picture if uploaded
+    profile_pic_path = None
     if 'profile_pic' in request.files:
         profile_pic = request.files['profile_pic']
         if profile_pic and profile_pic.filename != '' and allowed_file(profile_pic.filename):
             filename = secure_filename(f"{email}_profile_{profile_pic.filename}")
-            file_path = os.path.join(UPLOAD_FOLDER, filename)
-            profile_pic.save(file_path)
-
-            # Update user record with file path
-            if email in user_details:
-                user_details[email]['profile_pic'] = file_path
-
-    if email in user_details:
-        user_details[email]['name'] = name
-        user_details[email]['phone'] = phone
+            profile_pic_path = os.path.join(UPLOAD_FOLDER, filename)
+            profile_pic.save(profile_pic_path)
+
+    # Read, change and write back the record under the lock, so no other write gets lost
+    with storage.locked('user_details'):
+        details = get_user_record(email, parts=())
+        if details is None:
+            # This case should not happen normally, but handling it just in case
+            return redirect(url_for('profile'))
+        details = dict(details)  # put_unique() compares it with the stored copy
+
+        # Update user record with file path
+        if profile_pic_path is not None:
+            details['profile_pic'] = profile_pic_path
+
+        details['name'] = name
+        details['phone'] = phone
         # Update additional fields
-        user_details[email]['age'] = age
-        user_details[email]['dob'] = dob
-        user_details[email]['gender'] = gender
-        user_details[email]['blood_group'] = blood_group
-        user_details[email]['address'] = address
-        user_details[email]['emergency_contact'] = emergency_contact  # New field
+        details['age'] = age
+        details['dob'] = dob
+        details['gender'] = gender
+        details['blood_group'] = blood_group
+        details['address'] = address
+        details['emergency_contact'] = emergency_contact  # New field
         # Note: We don't update nid_birth_certificate as it should be non-editable
-    else:
-        # This case should not happen normally, but handling it just in case
-        return redirect(url_for('profile'))
 
-    save_user_details(user_details)
+        # Only a changed phone number has to be free
+        if storage.put_unique('user_details', email, details):
+            return "Phone number already registered!", 400
+
+    profile_changed('user', email)
     return redirect(url_for('profile'))
 
 
@@ -510,16 +748,9 @@ def settings():
         return redirect(url_for('login'))
 
     email = session['user']
-    user_details = load_user_details()
-
-    if email not in user_details:
-        user_details[email] = {
-            "name": "User",
-            "phone": "Not provided"
-        }
-        save_user_details(user_details)
+    details = get_user_record(email, create=True, parts=())
 
-    return render_template('settings.html', user_details=user_details[email])
+    return render_template('settings.html', user_details=details)
 
 
 # Update Email
@@ -532,30 +763,28 @@ def update_email():
     new_email = request.form['new_email']
     password = request.form['password']
 
-    users = load_users()
-
     # Verify password
-    if users.get(current_email) != password:
+    if storage.get('users', current_email) != password:
         return render_template('settings.html', message="Incorrect password", message_type="danger")
 
     # Check if new email already exists
-    if new_email in users:
+    if storage.get('users', new_email) is not None:
         return render_template('settings.html', message="Email already in use", message_type="danger")
 
     # Update email in users.json
-    users[new_email] = users[current_email]
-    del users[current_email]
-    save_users(users)
+    storage.put('users', new_email, password)
+    storage.delete('users', current_email)
 
     # Update email in user_details.json
-    user_details = load_user_details()
-    if current_email in user_details:
-        user_details[new_email] = user_details[current_email]
-        del user_details[current_email]
-        save_user_details(user_details)
+    details = get_user_record(current_email)
+    if details is not None:
+        storage.put('user_details', new_email, details)
+        storage.delete('user_details', current_email)
 
     # Update session
     session['user'] = new_email
+    bump_profile_version(storage, 'user', current_email)
+    remember_profile_header('user', new_email)
 
     return render_template('settings.html', message="Email updated successfully", message_type="success")
 
@@ -571,10 +800,8 @@ def update_password():
     new_password = request.form['new_password']
     confirm_password = request.form['confirm_password']
 
-    users = load_users()
-
     # Verify current password
-    if users.get(email) != current_password:
+    if storage.get('users', email) != current_password:
         return render_template('settings.html', message="Incorrect current password", message_type="danger")
 
     # Check if new passwords match
@@ -582,8 +809,7 @@ def update_password():
         return render_template('settings.html', message="New passwords do not match", message_type="danger")
 
     # Update password
-    users[email] = new_password
-    save_users(users)
+    storage.put('users', email, new_password)
 
     return render_template('settings.html', message="Password updated successfully", message_type="success")
 
@@ -599,16 +825,9 @@ def index():
         login_success = session.pop('login_success')  # Get and remove the flag
 
     email = session['user']
-    user_details = load_user_details()
-
-    if email not in user_details:
-        user_details[email] = {
-            "name": "User",
-            "phone": "Not provided"
-        }
-        save_user_details(user_details)
+    details = get_user_record(email, create=True, parts=())
 
-    return render_template('index.html', login_success=login_success, user_details=user_details[email])
+    return render_template('index.html', login_success=login_success, user_details=details)
 
 
 # Prediction Route
@@ -624,49 +843,37 @@ def home():
             return render_template('index.html', message="Please enter valid symptoms")
 
         # Split the symptoms and check if they are valid
-        user_symptoms = [s.strip() for s in symptoms.split(',')]
-        user_symptoms = [symptom.strip("[]' ") for symptom in user_symptoms]
-
-        # Check if all symptoms are in the symptoms_dict
-        invalid_symptoms = [symptom for symptom in user_symptoms if symptom not in symptoms_dict]
+        user_symptoms, invalid_symptoms = resolve_symptoms(parse_symptoms(symptoms))
 
         if invalid_symptoms:
-            flash(f"Invalid symptoms: {', '.join(invalid_symptoms)}. Please enter valid symptoms.", "warning")
-            return render_template('index.html', message=f"Invalid symptoms: {', '.join(invalid_symptoms)}")
+            message = invalid_message(invalid_symptoms)
+            flash(f"{message}. Please enter valid symptoms.", "warning")
+            return render_template('index.html', message=message)
 
         # If all symptoms are valid, proceed with prediction
         try:
             predicted_disease = get_predicted_value(user_symptoms)
             dis_des, precautions, medications, rec_diet, workout = helper(predicted_disease)
 
-            my_precautions = []
-            for i in precautions[0]:
-                my_precautions.append(i)
+            triage = get_triage([user_symptoms])[0]
+
+            my_precautions = list(precautions)
 
             # Store the symptoms and predicted disease in the user's medical history if logged in
             if 'user' in session:
-                email = session['user']
-                user_details = load_user_details()
-
-                # Initialize medical_history if it doesn't exist
-                if email in user_details:
-                    if 'medical_history' not in user_details[email]:
-                        user_details[email]['medical_history'] = []
-
-                    # Add the current search to medical history
-                    timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                    user_details[email]['medical_history'].append({
-                        "date": timestamp,
-                        "symptoms": symptoms,
-                        "predicted_disease": predicted_disease
-                    })
-
-                    # Save the updated user details
-                    save_user_details(user_details)
+                # Add the current search to medical history, creating it if it doesn't exist;
+                # only that part is written, and concurrent searches all land
+                timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                storage.append_part('user_details', session['user'], 'medical_history', {
+                    "date": timestamp,
+                    "symptoms": symptoms,
+                    "predicted_disease": predicted_disease
+                })
 
             return render_template('index.html', predicted_disease=predicted_disease, dis_des=dis_des,
                                    my_precautions=my_precautions, medications=medications, my_diet=rec_diet,
-                                   workout=workout)
+                                   workout=workout, urgent_reasons=triage['urgent_reasons'],
+                                   symptom_names=[name.replace('_', ' ') for name in user_symptoms])
 
         except Exception as e:
             # If there's an error in prediction, show a friendly message
@@ -677,6 +884,114 @@ def home():
     return render_template('index.html')
 
 
+# Batch prediction for kiosks and bulk screening imports
+MAX_BATCH_SIZE = 10000
+
+
+@app.route('/api/predict/batch', methods=['POST'])
+def predict_batch():
+    payload = request.get_json(silent=True) or {}
+    symptom_sets = payload.get('symptoms')
+    if not isinstance(symptom_sets, list) or not symptom_sets:
+        return jsonify({"success": False, "message": "symptoms must be a non-empty list"}), 400
+    if len(symptom_sets) > MAX_BATCH_SIZE:
+        return jsonify({"success": False, "message": f"At most {MAX_BATCH_SIZE} symptom sets per request"}), 400
+
+    results, valid = check_symptom_sets(symptom_sets)
+    symptom_lists = [result['symptoms'] for result in valid]
+    for result, disease, triage in zip(valid, get_predicted_values(symptom_lists), get_triage(symptom_lists)):
+        result.update(disease=disease, **disease_info(disease), **triage)
+
+    return jsonify({"success": True, "results": results})
+
+
+def check_symptom_sets(symptom_sets):
+    """(results, valid) for a batch: one result dict per entry, errors filled in;
+    valid holds the results of the entries that can be predicted"""
+    # Each set is a list of symptom names or the comma separated text /predict takes
+    results = []
+    valid = []
+    for symptoms in symptom_sets:
+        typed = typed_symptoms(symptoms)
+        if typed is None:
+            results.append({"symptoms": symptoms, "error": "Expected a list of symptom names or comma separated text"})
+            continue
+        user_symptoms, invalid_symptoms = resolve_symptoms(typed)
+        if not typed:
+            results.append({"symptoms": typed, "error": "No symptoms given"})
+        elif invalid_symptoms:
+            results.append({"symptoms": typed, "error": invalid_message(invalid_symptoms),
+                            "suggestions": symptom_suggestions(invalid_symptoms)})
+        else:
+            results.append({"symptoms": user_symptoms})
+            valid.append(results[-1])
+    return results, valid
+
+
+# Orders a batch of submissions by urgency for bulk screening
+@app.route('/api/triage/rank', methods=['POST'])
+def triage_rank():
+    payload = request.get_json(silent=True) or {}
+    symptom_sets = payload.get('symptoms')
+    if not isinstance(symptom_sets, list) or not symptom_sets:
+        return jsonify({"success": False, "message": "symptoms must be a non-empty list"}), 400
+    if len(symptom_sets) > MAX_BATCH_SIZE:
+        return jsonify({"success": False, "message": f"At most {MAX_BATCH_SIZE} symptom sets per request"}), 400
+
+    results, valid = check_symptom_sets(symptom_sets)
+    for index, result in enumerate(results):
+        result['index'] = index
+    scorer = triage_scorer.get()
+    X = scorer.dense([{symptoms_dict[item] for item in result['symptoms']} for result in valid])
+    scores, fired, urgent = scorer.assess(X)
+    ranked = []
+    for row in scorer.order(scores, urgent):
+        valid[row].update(severity=float(scores[row]), urgent=bool(urgent[row]),
+                          urgent_reasons=scorer.reasons(fired[row], scores[row]))
+        ranked.append(valid[row])
+
+    return jsonify({"success": True, "ranked": ranked, "errors": [result for result in results if 'error' in result]})
+
+
+DEFAULT_TOP_K = 5
+
+
+@app.route('/api/predict/topk', methods=['POST'])
+def predict_top_k():
+    payload = request.get_json(silent=True) or {}
+    user_symptoms = typed_symptoms(payload.get('symptoms'))
+    if user_symptoms is None:
+        return jsonify({"success": False, "message": "symptoms must be a list or comma separated text"}), 400
+    if not user_symptoms:
+        return jsonify({"success": False, "message": "No symptoms given"}), 400
+    user_symptoms, invalid_symptoms = resolve_symptoms(user_symptoms)
+    if invalid_symptoms:
+        return jsonify({"success": False, "message": invalid_message(invalid_symptoms),
+                        "suggestions": symptom_suggestions(invalid_symptoms)}), 400
+
+    k = payload.get('k', DEFAULT_TOP_K)
+    if not isinstance(k, int) or isinstance(k, bool) or not 1 <= k <= len(diseases_list):
+        return jsonify({"success": False, "message": f"k must be an integer from 1 to {len(diseases_list)}"}), 400
+
+    # A disease's score is the share of its one-vs-one contests it won
+    contests = len(diseases_list) - 1
+    results = [dict(disease=disease, votes=votes, score=round(votes / contests, 4), **disease_info(disease))
+               for disease, votes in get_top_diseases(user_symptoms, k)]
+    return jsonify({"success": True, "symptoms": user_symptoms, "results": results})
+
+
+@app.route('/api/symptoms/suggest')
+def suggest_symptoms():
+    query = request.args.get('q', '')
+    limit = min(max(request.args.get('limit', 8, type=int), 1), 20)
+    return jsonify({"query": query, "suggestions": symptom_resolver.suggest(query, limit)})
+
+
+@app.route('/api/predict/cache')
+def prediction_cache_stats():
+    return jsonify(prediction_cache.stats())
+
+
 # About Page
 @app.route('/about')
 def about():
@@ -711,12 +1026,8 @@ def newsletter_signup():
         if not re.match(email_pattern, email):
             return jsonify({"success": False, "message": "Please enter a valid email address"}), 400
         
-        # Load existing newsletter emails
-        newsletter_emails = load_newsletter_emails()
-        
         # Check if email already exists
-        existing_emails = [entry['email'] for entry in newsletter_emails if isinstance(entry, dict)]
-        if email in existing_emails:
+        if storage.get('newsletter_emails', email) is not None:
             return jsonify({"success": False, "message": "This email is already subscribed to our newsletter"}), 400
         
         # Add new email subscription
@@ -727,10 +1038,8 @@ def newsletter_signup():
             "source": "landing_page"
         }
         
-        newsletter_emails.append(new_subscription)
-        
-        # Save updated newsletter emails
-        save_newsletter_emails(newsletter_emails)
+        # Save the new subscription
+        storage.put('newsletter_emails', email, new_subscription)
         
         return jsonify({
             "success": True, 
@@ -751,6 +1060,11 @@ def chat():
     # Get user email if logged in
     user_email = session.get('user', None)
 
+    # Clients that accept an event stream (or ask with ?stream=1) get the reply in pieces
+    if request.args.get('stream') == '1' or request.accept_mimetypes.best == 'text/event-stream':
+        return Response(chat_events(message, user_email), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
     # Generate AI response
     response = get_ai_response(message, user_email)
 
@@ -761,6 +1075,24 @@ def chat():
     return jsonify({"response": response})
 
 
+def chat_events(message, user_email):
+    """A "chunk" event per piece of the reply, then "done" with the whole reply; saved afterwards"""
+    chunks = []
+    try:
+        for chunk in stream_ai_response(message, user_email):
+            chunks.append(chunk)
+            yield sse_event({"text": chunk}, event='chunk')
+    except Exception as e:
+        print(f"Error in streamed chat reply: {e}")
+        yield sse_event({"message": "An error occurred. Please try again later."}, event='error')
+        return
+
+    response = ''.join(chunks)
+    if user_email:
+        chat_writer.schedule((user_email, message, response))
+    yield sse_event({"response": response}, event='done')
+
+
 # Get chat history endpoint
 @app.route('/get_chat_history', methods=['GET'])
 def get_chat_history():
@@ -769,10 +1101,69 @@ def get_chat_history():
 
     user_email = session['user']
     limit = request.args.get('limit', 10, type=int)
+    before = request.args.get('before', type=int)
+    after = request.args.get('after', type=int)
+    wait = min(max(request.args.get('wait', 0, type=float), 0), CHAT_WAIT_LIMIT)
+
+    # A client that has the current version gets a 304 from a stat() of the
+    # history, without reading it. With wait, it is held until a new message
+    # arrives instead, as is a request for the messages after one it has seen.
+    version = chat_version(user_email)
+    if wait and (chat_history_unchanged(user_email, version)
+                 or (after is not None and not get_user_chat_history(user_email, 1, after=after))):
+        version = wait_for_chat(user_email, version, wait)
+
+    if chat_history_unchanged(user_email, version):
+        response = app.response_class(status=304)
+    else:
+        history = get_user_chat_history(user_email, limit, before, after)
+        response = jsonify({"success": True, "history": history})
+    response.set_etag(chat_etag(user_email, version))
+    if version and version[1] is not None:
+        response.last_modified = version[1]
+    response.headers['Cache-Control'] = 'private, no-cache'
+    response.vary.add('Cookie')
+    return response
+
+
+# New chat messages as Server-Sent Events
+@app.route('/chat_history/stream', methods=['GET'])
+def chat_history_stream():
+    if 'user' not in session:
+        return jsonify({"success": False, "message": "Not logged in"}), 401
 
-    history = get_user_chat_history(user_email, limit)
-
-    return jsonify({"success": True, "history": history})
+    user_email = session['user']
+    # A reconnecting EventSource sends the id of the last message it got
+    after = request.headers.get('Last-Event-ID', type=int)
+    if after is None:
+        after = request.args.get('after', type=int)
+
+    def events():
+        last_id = after
+        version = None
+        if last_id is None:
+            # Only messages saved from now on
+            version = chat_version(user_email)
+            latest = get_user_chat_history(user_email, 1)
+            last_id = latest[-1].get('id', 0) if latest else 0
+        yield f"retry: {int(CHAT_POLL_SECONDS * 1000)}\n\n"
+
+        deadline = time.monotonic() + CHAT_STREAM_SECONDS
+        while True:
+            current = chat_version(user_email)
+            if current != version:
+                version = current
+                for entry in get_user_chat_history(user_email, LOGS['chat_history'][1], after=last_id):
+                    last_id = entry.get('id', last_id)
+                    yield sse_event(entry, event='message', event_id=last_id)
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            if wait_for_chat(user_email, version, min(remaining, CHAT_KEEPALIVE_SECONDS)) == version:
+                yield ": keepalive\n\n"
+
+    return Response(events(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 
 # AI Assistant page
@@ -782,15 +1173,15 @@ def assistant():
         return redirect(url_for('login'))
 
     user_email = session['user']
-    user_details = load_user_details()
+    details = get_user_record(user_email, parts=())
 
-    if user_email not in user_details:
+    if details is None:
         return redirect(url_for('index'))
 
     # Get recent chat history
     chat_history = get_user_chat_history(user_email)
 
-    return render_template('assistant.html', user_details=user_details[user_email], chat_history=chat_history)
+    return render_template('assistant.html', user_details=details, chat_history=chat_history)
 
 
 # New Appointment Page
@@ -811,6 +1202,7 @@ def new_appointment():
             for slot in doctor.get('timeSlots', []):
                 if 'day' in slot:
                     availability.append(slot['day'])
+            next_slot = next(scheduler.free_slots(doctor, NEXT_SLOT_DAYS), None) if doctor.get('id') else None
 
             formatted_doctors.append({
                 "id": doctor.get('id', ''),
@@ -819,6 +1211,7 @@ def new_appointment():
                 "experience": doctor.get('experience', '0'),
                 "hospital": doctor.get('hospital', ''),
                 "availability": availability,
+                "next_available": format_slot(next_slot) if next_slot else None,
                 "fee": doctor.get('fee', '0'),
                 "rating": 4,  # Default rating
                 "profile_pic": doctor.get('profile_pic', None)  # Add profile picture
@@ -841,45 +1234,20 @@ def book_appointment():
     purpose = request.form['purpose']
     notes = request.form.get('notes', '')
 
-    # Load user details
-    user_details = load_user_details()
-
-    # Initialize appointments list if it doesn't exist
-    if email in user_details:
-        if 'appointments' not in user_details[email]:
-            user_details[email]['appointments'] = []
-    else:
-        user_details[email] = {
-            "name": "User",
-            "phone": "Not provided",
-            "appointments": []
-        }
+    doctor = storage.get('doctors', doctor_id)
+    if doctor is None:
+        flash("That doctor could not be found.", 'danger')
+        return redirect(url_for('new_appointment'))
 
-    # Add the appointment
-    appointment = {
-        "id": str(len(user_details[email]['appointments']) + 1),
-        "doctor_id": doctor_id,
-        "doctor_name": doctor_name,
-        "department": doctor_specialty,
-        "date": appointment_date,
-        "time": appointment_time,
-        "purpose": purpose,
-        "notes": notes,
-        "status": "Upcoming",
-        "created_at": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    }
-
-    user_details[email]['appointments'].append(appointment)
-
-    # Save user details
-    save_user_details(user_details)
+    # Load user details
+    details = get_user_record(email, parts=())
+    patient_name = details.get('name', 'Patient') if details is not None else "User"
 
-    # Also save to the appointments.json file for doctor access
-    appointments = load_appointments()
+    # Saved to the appointments.json file for doctor access once the slot is taken
     new_appointment = {
         "id": str(uuid.uuid4()),
         "patient_id": email,  # Using email as patient ID
-        "patient_name": user_details[email].get('name', 'Patient'),
+        "patient_name": patient_name,
         "patient_email": email,
         "doctor_id": doctor_id,
         "doctor_name": doctor_name,
@@ -891,25 +1259,97 @@ def book_appointment():
         "status": "Upcoming",
         "created_at": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     }
-    appointments.append(new_appointment)
-    save_appointments(appointments)
+    # Checks the doctor's hours and existing bookings under the appointments lock
+    reason = scheduler.book(doctor, new_appointment)
+    if reason is not None:
+        flash(reason, 'danger')
+        return redirect(url_for('new_appointment'))
+
+    # Add the appointment; its id is numbered from the latest list, so read and write it under the lock
+    with storage.locked('user_details'):
+        details = get_user_record(email, parts=('appointments',))
+        if details is None:
+            details = {
+                "name": "User",
+                "phone": "Not provided",
+                "appointments": []
+            }
+        appointments = details.get('appointments') or []
+
+        appointment = {
+            "id": str(len(appointments) + 1),
+            "shared_id": new_appointment['id'],
+            "doctor_id": doctor_id,
+            "doctor_name": doctor_name,
+            "department": doctor_specialty,
+            "date": appointment_date,
+            "time": appointment_time,
+            "purpose": purpose,
+            "notes": notes,
+            "status": "Upcoming",
+            "created_at": new_appointment['created_at']
+        }
+
+        details['appointments'] = appointments + [appointment]
+
+        # Save user details
+        storage.put('user_details', email, details)
 
     # Redirect to profile page
     return redirect(url_for('profile'))
 
 
+# Free slots of a doctor over the next days (?days=7, from ?start=YYYY-MM-DD or today)
+@app.route('/api/doctors/<doctor_id>/free_slots', methods=['GET'])
+def doctor_free_slots(doctor_id):
+    if 'user' not in session and 'doctor' not in session:
+        return jsonify({"success": False, "message": "Not logged in"}), 401
+    doctor = storage.get('doctors', doctor_id)
+    if doctor is None:
+        return jsonify({"success": False, "message": "Doctor not found"}), 404
+
+    days = min(max(request.args.get('days', 7, type=int), 1), MAX_SLOT_DAYS)
+    start = request.args.get('start')
+    try:
+        first_day = datetime.datetime.strptime(start, "%Y-%m-%d").date() if start else None
+    except ValueError:
+        return jsonify({"success": False, "message": "start must be a YYYY-MM-DD date"}), 400
+
+    slots = [format_slot(slot) for slot in scheduler.free_slots(doctor, days, first_day)]
+    return jsonify({"success": True, "doctor_id": doctor_id, "has_hours": bool(doctor.get('timeSlots')),
+                    "slots": slots})
+
+
+# Whether one slot (?date=YYYY-MM-DD&time=09:30 AM) can be booked
+@app.route('/api/doctors/<doctor_id>/slot', methods=['GET'])
+def doctor_slot(doctor_id):
+    if 'user' not in session and 'doctor' not in session:
+        return jsonify({"success": False, "message": "Not logged in"}), 401
+    doctor = storage.get('doctors', doctor_id)
+    if doctor is None:
+        return jsonify({"success": False, "message": "Doctor not found"}), 404
+    try:
+        start = slot_start(request.args.get('date', ''), request.args.get('time', ''))
+    except ValueError:
+        return jsonify({"success": False, "message": "date and time must look like 2025-04-03 and 09:30 AM"}), 400
+
+    reason = scheduler.check(doctor, start)
+    return jsonify({"success": True, "free": reason is None, "reason": reason})
+
+
 # Doctor Routes
 @app.route('/doctor-login', methods=['GET', 'POST'])
 def doctor_login():
     if request.method == 'POST':
         email = request.form['email']
         password = request.form['password']
-        doctor_credentials = load_doctor_credentials()
+        stored_password = storage.get('doctor_credentials', email)
 
-        if email in doctor_credentials and doctor_credentials[email] == password:
+        if stored_password is not None and stored_password == password:
             session['doctor'] = email
             session['doctor_email'] = email
             session['login_success'] = True
+            remember_profile_header('doctor', email)
             return redirect(url_for('doctor_dashboard'))
         else:
             return render_template('doctor-login.html', error="Invalid credentials!")
@@ -933,26 +1373,20 @@ def doctor_signup():
         if password != confirm_password:
             return render_template('doctor-signup.html', error="Passwords do not match!")
 
-        doctor_credentials = load_doctor_credentials()
-        doctors = load_doctors()
-
         # Check if email already exists
-        if email in doctor_credentials:
+        if storage.get('doctor_credentials', email) is not None:
             return render_template('doctor-signup.html', error="Email already exists!")
 
         # Check if license already exists
-        for doctor in doctors:
-            if doctor.get('license') == license:
-                return render_template('doctor-signup.html', error="License number already registered!")
+        if storage.find_one('doctors', license=license):
+            return render_template('doctor-signup.html', error="License number already registered!")
 
         # Check if NID/Birth Certificate Number already exists
-        for doctor in doctors:
-            if doctor.get('nid') == nid:
-                return render_template('doctor-signup.html', error="NID/Birth Certificate Number already registered!")
+        if storage.find_one('doctors', nid=nid):
+            return render_template('doctor-signup.html', error="NID/Birth Certificate Number already registered!")
 
         # Save doctor credentials
-        doctor_credentials[email] = password
-        save_doctor_credentials(doctor_credentials)
+        storage.put('doctor_credentials', email, password)
 
         # Create new doctor
         new_doctor = {
@@ -976,8 +1410,7 @@ def doctor_signup():
             "createdAt": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         }
 
-        doctors.append(new_doctor)
-        save_doctors(doctors)
+        save_doctor(new_doctor)
 
         return redirect(url_for('doctor_login'))
 
@@ -988,6 +1421,7 @@ def doctor_signup():
 def doctor_logout():
     session.pop('doctor', None)
     session.pop('doctor_email', None)
+    session.pop('profile_header', None)
     return redirect(url_for('doctor_login'))
 
 
@@ -997,24 +1431,14 @@ def doctor_profile():
         return redirect(url_for('doctor_login'))
 
     email = session['doctor']
-    doctors = load_doctors()
-
-    doctor_details = None
-    for doctor in doctors:
-        if doctor['email'] == email:
-            doctor_details = doctor
-            break
+    doctor_details = get_doctor_by_email(email)
 
     if not doctor_details:
         # This should not happen normally, but handling it just in case
         return redirect(url_for('doctor_login'))
 
     # Get appointments for this doctor
-    appointments = load_appointments()
-    doctor_appointments = [
-        appointment for appointment in appointments
-        if appointment.get('doctor_id') == doctor_details.get('id')
-    ]
+    doctor_appointments = storage.find('appointments', doctor_id=doctor_details.get('id'))
 
     return render_template('doctor-profile.html', doctor_details=doctor_details, appointments=doctor_appointments)
 
@@ -1032,13 +1456,7 @@ def doctor_dashboard():
         return redirect(url_for('doctor_login'))
 
     email = session['doctor']
-    doctors = load_doctors()
-
-    doctor_details = None
-    for doctor in doctors:
-        if doctor['email'] == email:
-            doctor_details = doctor
-            break
+    doctor_details = get_doctor_by_email(email)
 
     if not doctor_details:
         return redirect(url_for('doctor_login'))
@@ -1046,37 +1464,23 @@ def doctor_dashboard():
     # Get current date
     current_date = datetime.datetime.now().strftime("%A, %B %d, %Y")
 
-    # Get appointments for this doctor
-    appointments = load_appointments()
-    doctor_appointments = [
-        appointment for appointment in appointments
-        if appointment.get('doctor_id') == doctor_details.get('id')
-    ]
-
-    # Get today's appointments
+    # Stats come straight from the appointment indexes
+    doctor_id = doctor_details.get('id')
     today = datetime.datetime.now().strftime("%Y-%m-%d")
-    today_appointments = [
-        appointment for appointment in doctor_appointments
-        if appointment.get('date') == today
-    ]
-
-    # Calculate statistics
-    unique_patients = set(appointment.get('patient_email') for appointment in doctor_appointments)
-    upcoming_appointments = len([a for a in doctor_appointments if a.get('status') == 'Upcoming'])
-    completed_appointments = len([a for a in doctor_appointments if a.get('status') == 'Completed'])
-
+    today_appointments = storage.find('appointments', doctor_id=doctor_id, date=today)
     stats = {
         'today_appointments': len(today_appointments),
-        'total_patients': len(unique_patients),
-        'upcoming_appointments': upcoming_appointments,
-        'completed_appointments': completed_appointments
+        'total_patients': storage.count_distinct('appointments', 'patient_email', doctor_id=doctor_id),
+        'upcoming_appointments': storage.count('appointments', doctor_id=doctor_id, status='Upcoming'),
+        'completed_appointments': storage.count('appointments', doctor_id=doctor_id, status='Completed')
     }
 
     # Generate recent activities (in a real app, this would come from a database)
     recent_activities = []
 
     # Add appointment activities
-    for appointment in sorted(doctor_appointments, key=lambda x: x.get('created_at', ''), reverse=True)[:3]:
+    doctor_appointments = storage.find('appointments', doctor_id=doctor_id)
+    for appointment in heapq.nlargest(3, doctor_appointments, key=lambda x: x.get('created_at', '')):
         if appointment.get('status') == 'Upcoming':
             recent_activities.append({
                 'icon': 'fas fa-calendar-plus',
@@ -1121,33 +1525,23 @@ def doctor_appointments():
         return redirect(url_for('doctor_login'))
 
     email = session['doctor']
-    doctors = load_doctors()
-
-    doctor_details = None
-    for doctor in doctors:
-        if doctor['email'] == email:
-            doctor_details = doctor
-            break
+    doctor_details = get_doctor_by_email(email)
 
     if not doctor_details:
         return redirect(url_for('doctor_login'))
 
     # Get appointments for this doctor
-    appointments = load_appointments()
-    doctor_appointments = [
-        appointment for appointment in appointments
-        if appointment.get('doctor_id') == doctor_details.get('id')
-    ]
-
-    # Load patient details for the appointments
-    user_details = load_user_details()
+    doctor_appointments = storage.find('appointments', doctor_id=doctor_details.get('id'))
 
-    # Add profile pictures to patient details
-    for email, details in user_details.items():
-        if 'profile_pic' not in details:
-            details['profile_pic'] = None
+    # Load the details of this doctor's patients only, without their growing lists
+    patient_details = {}
+    for patient_email in {appointment.get('patient_email') for appointment in doctor_appointments}:
+        details = storage.get('user_details', patient_email, parts=()) if patient_email else None
+        if details is not None:
+            # Add profile pictures to patient details (copies, so the cached records stay untouched)
+            patient_details[patient_email] = dict(details, profile_pic=details.get('profile_pic'))
 
-    return render_template('doctor-appointments.html', appointments=doctor_appointments, patient_details=user_details)
+    return render_template('doctor-appointments.html', appointments=doctor_appointments, patient_details=patient_details)
 
 
 @app.route('/update-appointment', methods=['POST'])
@@ -1167,37 +1561,13 @@ def update_appointment_status():
     appointment_id = request.form['appointment_id']
     status = request.form['status']
 
-    # Update in appointments.json
-    appointments = load_appointments()
-    patient_email = None
-
-    for appointment in appointments:
-        if appointment['id'] == appointment_id:
-            # Store patient email for updating their record
-            patient_email = appointment['patient_email']
-
-            # Update appointment status
-            appointment['status'] = status
-            appointment['updated_at'] = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            break
+    # Update in appointments.json; a cancellation frees the slot in the scheduler
+    changes = {"status": status, "updated_at": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")}
+    appointment = scheduler.update(appointment_id, changes)
 
-    save_appointments(appointments)
-
-    # Update in patient's user_details.json if patient email is found
-    if patient_email:
-        user_details = load_user_details()
-
-        if patient_email in user_details and 'appointments' in user_details[patient_email]:
-            for patient_appointment in user_details[patient_email]['appointments']:
-                # Match appointment by doctor, date and time
-                if (patient_appointment.get('doctor_id') == appointments[0].get('doctor_id') and
-                        patient_appointment.get('id') != appointment_id):
-                    # Update the patient's appointment status
-                    patient_appointment['status'] = status
-                    patient_appointment['updated_at'] = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                    break
-
-            save_user_details(user_details)
+    # Update the patient's own copy in user_details.json
+    if appointment is not None:
+        update_own_appointment(appointment, changes)
 
     return redirect(url_for('doctor_appointments'))
 
@@ -1214,19 +1584,16 @@ def update_doctor_profile():
     age = request.form['age']
     dob = request.form['dob']
 
-    doctors = load_doctors()
-
-    for doctor in doctors:
-        if doctor['email'] == email:
-            doctor['name'] = name
-            doctor['gender'] = gender
-            doctor['phone'] = phone
-            doctor['age'] = age
-            doctor['dob'] = dob
-            doctor['updatedAt'] = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            break
+    if update_doctor(email, {
+        'name': name,
+        'gender': gender,
+        'phone': phone,
+        'age': age,
+        'dob': dob,
+        'updatedAt': datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    }):
+        profile_changed('doctor', email)
 
-    save_doctors(doctors)
     return redirect(url_for('doctor_profile'))
 
 
@@ -1312,20 +1679,16 @@ def update_doctor_professional():
             day_slots["slots"].append("02:00 PM - 05:00 PM")
         formatted_slots.append(day_slots)
 
-    doctors = load_doctors()
-
-    for doctor in doctors:
-        if doctor['email'] == email:
-            doctor['specialization'] = specialization_str
-            doctor['license'] = license
-            doctor['experience'] = experience
-            doctor['fee'] = fee
-            doctor['hospital'] = hospital
-            doctor['timeSlots'] = formatted_slots
-            doctor['updatedAt'] = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            break
+    update_doctor(email, {
+        'specialization': specialization_str,
+        'license': license,
+        'experience': experience,
+        'fee': fee,
+        'hospital': hospital,
+        'timeSlots': formatted_slots,
+        'updatedAt': datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    })
 
-    save_doctors(doctors)
     return redirect(url_for('doctor_profile'))
 
 
@@ -1341,17 +1704,13 @@ def update_doctor_additional():
     languages_str = ','.join(languages)
     address = request.form['address']
 
-    doctors = load_doctors()
-
-    for doctor in doctors:
-        if doctor['email'] == email:
-            doctor['bio'] = bio
-            doctor['languages'] = languages_str
-            doctor['address'] = address
-            doctor['updatedAt'] = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            break
+    update_doctor(email, {
+        'bio': bio,
+        'languages': languages_str,
+        'address': address,
+        'updatedAt': datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    })
 
-    save_doctors(doctors)
     return redirect(url_for('doctor_profile'))
 
 
@@ -1366,20 +1725,16 @@ def upload_doctor_documents():
     if not os.path.exists(UPLOAD_FOLDER):
         os.makedirs(UPLOAD_FOLDER)
 
+    # File paths to record on the doctor, saved once at the end
+    uploaded = {}
+
     # Process license document
     if 'license_doc' in request.files:
         license_file = request.files['license_doc']
         if license_file and license_file.filename != '' and allowed_file(license_file.filename):
             filename = secure_filename(f"{email}_license_{license_file.filename}")
             license_file.save(os.path.join(UPLOAD_FOLDER, filename))
-
-            # Update doctor record with file path
-            doctors = load_doctors()
-            for doctor in doctors:
-                if doctor['email'] == email:
-                    doctor['license_doc'] = os.path.join(UPLOAD_FOLDER, filename)
-                    break
-            save_doctors(doctors)
+            uploaded['license_doc'] = os.path.join(UPLOAD_FOLDER, filename)
 
     # Process profile picture
     if 'profile_pic' in request.files:
@@ -1388,14 +1743,7 @@ def upload_doctor_documents():
             filename = secure_filename(f"{email}_profile_{profile_pic.filename}")
             file_path = os.path.join(UPLOAD_FOLDER, filename)
             profile_pic.save(file_path)
-
-            # Update doctor record with file path
-            doctors = load_doctors()
-            for doctor in doctors:
-                if doctor['email'] == email:
-                    doctor['profile_pic'] = file_path
-                    break
-            save_doctors(doctors)
+            uploaded['profile_pic'] = file_path
 
     # Process ID document
     if 'id_doc' in request.files:
@@ -1403,14 +1751,12 @@ def upload_doctor_documents():
         if id_file and id_file.filename != '' and allowed_file(id_file.filename):
             filename = secure_filename(f"{email}_id_{id_file.filename}")
             id_file.save(os.path.join(UPLOAD_FOLDER, filename))
+            uploaded['id_doc'] = os.path.join(UPLOAD_FOLDER, filename)
 
-            # Update doctor record with file path
-            doctors = load_doctors()
-            for doctor in doctors:
-                if doctor['email'] == email:
-                    doctor['id_doc'] = os.path.join(UPLOAD_FOLDER, filename)
-                    break
-            save_doctors(doctors)
+    # Update doctor record with file paths
+    if uploaded and update_doctor(email, uploaded):
+        if 'profile_pic' in uploaded:
+            profile_changed('doctor', email)
 
     return redirect(url_for('doctor_profile'))
 
@@ -1424,33 +1770,29 @@ def update_doctor_email():
     new_email = request.form['new_email']
     password = request.form['password']
 
-    doctor_credentials = load_doctor_credentials()
-
     # Verify password
-    if doctor_credentials.get(current_email) != password:
+    if storage.get('doctor_credentials', current_email) != password:
         return render_template('doctor-settings.html', message="Incorrect password", message_type="danger")
 
     # Check if new email already exists
-    if new_email in doctor_credentials:
+    if storage.get('doctor_credentials', new_email) is not None:
         return render_template('doctor-settings.html', message="Email already in use", message_type="danger")
 
     # Update email in credentials
-    doctor_credentials[new_email] = doctor_credentials[current_email]
-    del doctor_credentials[current_email]
-    save_doctor_credentials(doctor_credentials)
+    storage.put('doctor_credentials', new_email, password)
+    storage.delete('doctor_credentials', current_email)
 
     # Update email in doctors.json
-    doctors = load_doctors()
-    for doctor in doctors:
-        if doctor['email'] == current_email:
-            doctor['email'] = new_email
-            doctor['updatedAt'] = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            break
-    save_doctors(doctors)
+    update_doctor(current_email, {
+        'email': new_email,
+        'updatedAt': datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    })
 
     # Update session
     session['doctor'] = new_email
     session['doctor_email'] = new_email
+    bump_profile_version(storage, 'doctor', current_email)
+    remember_profile_header('doctor', new_email)
 
     return render_template('doctor-settings.html', message="Email updated successfully", message_type="success")
 
@@ -1465,10 +1807,8 @@ def update_doctor_password():
     new_password = request.form['new_password']
     confirm_password = request.form['confirm_password']
 
-    doctor_credentials = load_doctor_credentials()
-
     # Verify current password
-    if doctor_credentials.get(email) != current_password:
+    if storage.get('doctor_credentials', email) != current_password:
         return render_template('doctor-settings.html', message="Incorrect current password", message_type="danger")
 
     # Check if new passwords match
@@ -1476,8 +1816,7 @@ def update_doctor_password():
         return render_template('doctor-settings.html', message="New passwords do not match", message_type="danger")
 
     # Update password
-    doctor_credentials[email] = new_password
-    save_doctor_credentials(doctor_credentials)
+    storage.put('doctor_credentials', email, new_password)
 
     return render_template('doctor-settings.html', message="Password updated successfully", message_type="success")
 
@@ -1488,22 +1827,15 @@ def patient_appointment():
     if 'user' not in session:
         return redirect(url_for('login'))
 
-    user_details = load_user_details()
     email = session['user']
-
-    if email not in user_details:
-        user_details[email] = {
-            "name": "User",
-            "phone": "Not provided"
-        }
-        save_user_details(user_details)
+    details = get_user_record(email, create=True, parts=('appointments', 'medications'))
 
     # Initialize medications list if it doesn't exist
-    if 'medications' not in user_details[email]:
-        user_details[email]['medications'] = []
-        save_user_details(user_details)
+    if 'medications' not in details:
+        details['medications'] = []
+        init_medications(email)
 
-    return render_template('patient-appointment.html', user_details=user_details[email])
+    return render_template('patient-appointment.html', user_details=details)
 
 
 # New routes for enhanced patient appointment features
@@ -1519,25 +1851,11 @@ def add_appointment_notes():
     notes = request.form['notes']
 
     # Update in user_details.json
-    user_details = load_user_details()
-    if email in user_details and 'appointments' in user_details[email]:
-        for appointment in user_details[email]['appointments']:
-            if appointment['id'] == appointment_id:
-                appointment['notes'] = notes
-                appointment['updated_at'] = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                break
-
-        save_user_details(user_details)
-
+    changes = {"notes": notes, "updated_at": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")}
+    own = update_patient_appointment(email, changes, id=appointment_id)
+    if own is not None:
         # Also update in appointments.json
-        appointments = load_appointments()
-        for appointment in appointments:
-            if appointment['id'] == appointment_id and appointment['patient_email'] == email:
-                appointment['notes'] = notes
-                appointment['updated_at'] = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                break
-
-        save_appointments(appointments)
+        update_shared_appointment(email, own, changes)
 
         return redirect(url_for('patient_appointment'))
 
@@ -1556,27 +1874,15 @@ def add_appointment_feedback():
     feedback = request.form['feedback']
 
     # Update in user_details.json
-    user_details = load_user_details()
-    if email in user_details and 'appointments' in user_details[email]:
-        for appointment in user_details[email]['appointments']:
-            if appointment['id'] == appointment_id:
-                appointment['rating'] = rating
-                appointment['feedback'] = feedback
-                appointment['feedback_date'] = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                break
-
-        save_user_details(user_details)
-
+    changes = {
+        "rating": rating,
+        "feedback": feedback,
+        "feedback_date": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    }
+    own = update_patient_appointment(email, changes, id=appointment_id)
+    if own is not None:
         # Also update in appointments.json
-        appointments = load_appointments()
-        for appointment in appointments:
-            if appointment['id'] == appointment_id and appointment['patient_email'] == email:
-                appointment['rating'] = rating
-                appointment['feedback'] = feedback
-                appointment['feedback_date'] = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                break
-
-        save_appointments(appointments)
+        update_shared_appointment(email, own, changes)
 
         return redirect(url_for('patient_appointment'))
 
@@ -1595,46 +1901,32 @@ def reschedule_appointment():
     new_time = request.form['new_time']
     reason = request.form['reason']
 
-    # Update in user_details.json
-    user_details = load_user_details()
-    if email in user_details and 'appointments' in user_details[email]:
-        for appointment in user_details[email]['appointments']:
-            if appointment['id'] == appointment_id:
-                # Store old date and time for notification
-                old_date = appointment['date']
-                old_time = appointment['time']
-
-                # Update appointment
-                appointment['date'] = new_date
-                appointment['time'] = new_time
-                appointment['reschedule_reason'] = reason
-                appointment['rescheduled_at'] = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                appointment['rescheduled_from'] = f"{old_date} at {old_time}"
-                break
-
-        save_user_details(user_details)
+    appointments = storage.get_part('user_details', email, 'appointments') or []
+    own = next((appointment for appointment in appointments if appointment['id'] == appointment_id), None)
+    if own is None:
+        return jsonify({"success": False, "message": "Appointment not found"}), 404
 
-        # Also update in appointments.json
-        appointments = load_appointments()
-        for appointment in appointments:
-            if appointment['id'] == appointment_id and appointment['patient_email'] == email:
-                # Store old date and time
-                old_date = appointment['date']
-                old_time = appointment['time']
-
-                # Update appointment
-                appointment['date'] = new_date
-                appointment['time'] = new_time
-                appointment['reschedule_reason'] = reason
-                appointment['rescheduled_at'] = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                appointment['rescheduled_from'] = f"{old_date} at {old_time}"
-                break
-
-        save_appointments(appointments)
+    shared = shared_appointment(email, own)
+    doctor = storage.get('doctors', own.get('doctor_id'))
+    if shared is None or doctor is None:
+        flash("That appointment can no longer be rescheduled.", 'danger')
+        return redirect(url_for('patient_appointment'))
 
+    # Checks the new slot and frees the old one in one write under the appointments lock
+    changes = {
+        "reschedule_reason": reason,
+        "rescheduled_at": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    }
+    problem = scheduler.move(doctor, shared['id'], new_date, new_time,
+                             dict(changes, rescheduled_from=f"{shared['date']} at {shared['time']}"))
+    if problem is not None:
+        flash(problem, 'danger')
         return redirect(url_for('patient_appointment'))
 
-    return jsonify({"success": False, "message": "Appointment not found"}), 404
+    # Update in user_details.json once the new slot is taken
+    update_patient_appointment(email, dict(changes, date=new_date, time=new_time,
+                                           rescheduled_from=f"{own['date']} at {own['time']}"), id=appointment_id)
+    return redirect(url_for('patient_appointment'))
 
 
 # Cancel appointment
@@ -1647,25 +1939,11 @@ def cancel_appointment():
     appointment_id = request.form['appointment_id']
 
     # Update in user_details.json
-    user_details = load_user_details()
-    if email in user_details and 'appointments' in user_details[email]:
-        for appointment in user_details[email]['appointments']:
-            if appointment['id'] == appointment_id:
-                appointment['status'] = "Cancelled"
-                appointment['cancelled_at'] = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                break
-
-        save_user_details(user_details)
-
+    changes = {"status": "Cancelled", "cancelled_at": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")}
+    own = update_patient_appointment(email, changes, id=appointment_id)
+    if own is not None:
         # Also update in appointments.json
-        appointments = load_appointments()
-        for appointment in appointments:
-            if appointment['id'] == appointment_id and appointment['patient_email'] == email:
-                appointment['status'] = "Cancelled"
-                appointment['cancelled_at'] = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                break
-
-        save_appointments(appointments)
+        update_shared_appointment(email, own, changes)
 
         return jsonify({"success": True})
 
@@ -1692,37 +1970,26 @@ def add_medication():
         # Debug logging
         print(f"Adding medication for {email}: {medication_name}, {dosage}, {frequency}")
 
-        # Update in user_details.json
-        user_details = load_user_details()
-        if email in user_details:
-            # Initialize medications list if it doesn't exist
-            if 'medications' not in user_details[email]:
-                user_details[email]['medications'] = []
-
-            # Create new medication
-            medication = {
-                "id": str(uuid.uuid4()),
-                "name": medication_name,
-                "dosage": dosage,
-                "frequency": frequency,
-                "start_date": start_date,
-                "end_date": end_date,
-                "instructions": instructions,
-                "reminder": set_reminder,
-                "created_at": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            }
+        # Create new medication
+        medication = {
+            "id": str(uuid.uuid4()),
+            "name": medication_name,
+            "dosage": dosage,
+            "frequency": frequency,
+            "start_date": start_date,
+            "end_date": end_date,
+            "instructions": instructions,
+            "reminder": set_reminder,
+            "created_at": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        }
 
-            user_details[email]['medications'].append(medication)
-            save_user_details(user_details)
+        # Update in user_details.json, initializing the medications list if it doesn't exist
+        if storage.append_part('user_details', email, 'medications', medication):
             print(f"Medication added to user_details: {medication}")
 
             # Also save to medications.json for potential future use
-            medications_data = load_medications()
-            if email not in medications_data:
-                medications_data[email] = []
-
-            medications_data[email].append(medication)
-            save_medications(medications_data)
+            with storage.locked('medications'):
+                storage.put('medications', email, storage.get('medications', email, []) + [medication])
             print("Medication saved to medications.json")
 
             flash("Medication added successfully!", "success")
@@ -1745,17 +2012,17 @@ def get_medications():
 
     try:
         email = session['user']
-        user_details = load_user_details()
+        details = get_user_record(email, parts=('medications',))
 
         print(f"Getting medications for {email}")
 
-        if email in user_details:
-            if 'medications' not in user_details[email]:
-                user_details[email]['medications'] = []
-                save_user_details(user_details)
+        if details is not None:
+            if 'medications' not in details:
+                details['medications'] = []
+                init_medications(email)
                 print(f"Initialized empty medications list for {email}")
 
-            medications = user_details[email]['medications']
+            medications = details['medications']
             print(f"Found {len(medications)} medications for {email}")
             return jsonify({"success": True, "medications": medications})
         else:
@@ -1776,30 +2043,25 @@ def delete_medication():
     email = session['user']
     medication_id = request.form['medication_id']
 
-    # Update in user_details.json
-    user_details = load_user_details()
-    if email in user_details and 'medications' in user_details[email]:
+    # Update in user_details.json, under the lock so a medication added meanwhile stays
+    with storage.locked('user_details'):
+        medications = storage.get_part('user_details', email, 'medications')
         # Find the medication to delete
-        found = False
-        for med in user_details[email]['medications']:
-            if med['id'] == medication_id:
-                found = True
-                break
-
+        found = medications is not None and any(med['id'] == medication_id for med in medications)
         if found:
             # Remove the medication
-            user_details[email]['medications'] = [m for m in user_details[email]['medications'] if
-                                                  m['id'] != medication_id]
-            save_user_details(user_details)
-
-            # Also update in medications.json
-            medications_data = load_medications()
-            if email in medications_data:
-                medications_data[email] = [m for m in medications_data[email] if m['id'] != medication_id]
-                save_medications(medications_data)
-
-            flash("Medication deleted successfully!", "success")
-            return jsonify({"success": True})
+            storage.put_part('user_details', email, 'medications',
+                             [m for m in medications if m['id'] != medication_id])
+
+    if found:
+        # Also update in medications.json
+        with storage.locked('medications'):
+            user_medications = storage.get('medications', email)
+            if user_medications is not None:
+                storage.put('medications', email, [m for m in user_medications if m['id'] != medication_id])
+
+        flash("Medication deleted successfully!", "success")
+        return jsonify({"success": True})
 
     return jsonify({"success": False, "message": "Medication not found"})
 
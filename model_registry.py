@@ -0,0 +1,115 @@
+import ast
+import threading
+from collections import namedtuple
+from types import MappingProxyType
+
+# Heavy imports (pandas, pickle/sklearn) happen inside the loaders, so
+# importing this module, or main.py, costs nothing until a prediction is made.
+
+MODEL_PATH = 'models/svc.pkl'
+
+DATASETS = {
+    'symptoms': "datasets/symtoms_df.csv",
+    'precautions': "datasets/precautions_df.csv",
+    'workout': "datasets/workout_df.csv",
+    'description': "datasets/description.csv",
+    'medications': "datasets/medications.csv",
+    'diets': "datasets/diets.csv",
+}
+
+
+class Lazy:
+    """Value built by load() on first use and cached for the life of the process.
+
+    Concurrent first callers wait for a single load instead of each running it.
+    """
+
+    def __init__(self, load):
+        self._load = load
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._value = None
+
+    @property
+    def loaded(self):
+        return self._loaded
+
+    def get(self):
+        if not self._loaded:
+            with self._lock:
+                if not self._loaded:
+                    self._value = self._load()
+                    self._loaded = True
+        return self._value
+
+
+def _csv_loader(path):
+    def load():
+        import pandas as pd
+        return pd.read_csv(path)
+    return load
+
+
+def _load_svc():
+    # Prefer the memory-mapped export (see svc_engine.py) while it matches the pickle
+    import svc_engine
+    if svc_engine.is_current(svc_engine.EXPORT_DIR, MODEL_PATH):
+        return svc_engine.load_engine(svc_engine.EXPORT_DIR)
+    print(f"Warning: {svc_engine.EXPORT_DIR} is missing or older than {MODEL_PATH}, unpickling the model; "
+          f"run python svc_engine.py to re-export it")
+
+    import pickle
+    with open(MODEL_PATH, 'rb') as f:
+        return svc_engine.engine_for_svc(pickle.load(f), source=MODEL_PATH)
+
+
+DiseaseInfo = namedtuple('DiseaseInfo', ['description', 'precautions', 'medications', 'diet', 'workout'])
+
+NO_DISEASE_INFO = DiseaseInfo("", (), (), (), ())
+
+
+def _group_by_disease(frame, disease_column, value_columns, parse=None):
+    """disease -> tuple of the non-empty values in value_columns, in file order"""
+    groups = {}
+    for row in frame[[disease_column] + value_columns].itertuples(index=False):
+        values = groups.setdefault(row[0], [])
+        for value in row[1:]:
+            if isinstance(value, str):
+                # medications.csv and diets.csv hold stringified Python lists
+                values.extend(ast.literal_eval(value) if parse else [value])
+    return {disease: tuple(values) for disease, values in groups.items()}
+
+
+def build_disease_table():
+    """Enrichment for every disease, parsed once from the five CSVs"""
+    descriptions = _group_by_disease(get('description'), 'Disease', ['Description'])
+    disease_precautions = _group_by_disease(get('precautions'), 'Disease',
+                                            ['Precaution_1', 'Precaution_2', 'Precaution_3', 'Precaution_4'])
+    disease_medications = _group_by_disease(get('medications'), 'Disease', ['Medication'], parse=True)
+    disease_diets = _group_by_disease(get('diets'), 'Disease', ['Diet'], parse=True)
+    workouts = _group_by_disease(get('workout'), 'disease', ['workout'])
+
+    table = {}
+    for dis in set(descriptions) | set(disease_precautions) | set(disease_medications) | set(disease_diets) | set(workouts):
+        table[dis] = DiseaseInfo(" ".join(descriptions.get(dis, ())), disease_precautions.get(dis, ()),
+                                 disease_medications.get(dis, ()), disease_diets.get(dis, ()), workouts.get(dis, ()))
+    return MappingProxyType(table)
+
+
+REGISTRY = {name: Lazy(_csv_loader(path)) for name, path in DATASETS.items()}
+REGISTRY['svc'] = Lazy(_load_svc)
+REGISTRY['disease_table'] = Lazy(build_disease_table)
+
+# What a prediction request needs; preload() loads these by default
+PREDICTION_RESOURCES = ('svc', 'disease_table')
+
+
+def get(name):
+    """The named dataset, model or derived table, loading it on first use"""
+    return REGISTRY[name].get()
+
+
+def preload(names=PREDICTION_RESOURCES):
+    """Load resources up front, e.g. in the gunicorn master before it forks"""
+    for name in names:
+        get(name)
@@ -0,0 +1,147 @@
+import sqlite3
+import threading
+from collections import OrderedDict
+
+
+def symptom_mask(indices):
+    """Order-insensitive key of a symptom set: bit i is set when symptom i is present"""
+    mask = 0
+    for i in indices:
+        mask |= 1 << i
+    return mask
+
+
+class PredictionCache:
+    """Bounded LRU cache of mask -> predicted disease, with an optional shared tier.
+
+    Entries belong to one model, identified by its signature (the SHA-256 of
+    models/svc.pkl); use_model() with a different signature drops them. With
+    a path, misses in memory fall through to a SQLite table that every worker
+    on the machine reads and writes, keyed on (signature, mask) so workers
+    running different models never see each other's results. The table keeps
+    the shared_maxsize most recently stored rows; each put trims the older
+    ones by rowid, which grows with every insert.
+    """
+
+    # Keep IN (...) lists under SQLite's default variable limit
+    SQL_CHUNK = 500
+
+    def __init__(self, maxsize=4096, path=None, shared_maxsize=100000):
+        self.maxsize = maxsize
+        self.path = path
+        self.shared_maxsize = shared_maxsize
+        self.signature = None
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.hits = self.shared_hits = self.misses = 0
+
+        if path:
+            conn = self._connection()
+            conn.execute('CREATE TABLE IF NOT EXISTS predictions '
+                         '(signature TEXT NOT NULL, mask TEXT NOT NULL, disease TEXT NOT NULL, '
+                         'PRIMARY KEY (signature, mask))')
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def use_model(self, signature):
+        """Drop every entry unless they were made by the model with this signature"""
+        with self._lock:
+            if signature == self.signature:
+                return
+            self._entries.clear()
+            self.signature = signature
+        if self.path:
+            # Results of older models can never be served again
+            self._connection().execute('DELETE FROM predictions WHERE signature != ?', (str(signature),))
+
+    def get_many(self, masks):
+        """Cached disease of every mask, None where it is not cached"""
+        found = [None] * len(masks)
+        missing = []
+        with self._lock:
+            for n, mask in enumerate(masks):
+                disease = self._entries.get(mask)
+                if disease is None:
+                    missing.append(n)
+                else:
+                    self._entries.move_to_end(mask)
+                    found[n] = disease
+            self.hits += len(masks) - len(missing)
+
+        if missing and self.path:
+            shared = self._read_shared({masks[n] for n in missing})
+            if shared:
+                self._store(shared)
+                still_missing = []
+                for n in missing:
+                    found[n] = shared.get(masks[n])
+                    if found[n] is None:
+                        still_missing.append(n)
+                with self._lock:
+                    self.shared_hits += len(missing) - len(still_missing)
+                missing = still_missing
+
+        with self._lock:
+            self.misses += len(missing)
+        return found
+
+    def put_many(self, predictions):
+        """Cache a mask -> disease dict in memory and in the shared tier"""
+        self._store(predictions)
+        if self.path:
+            rows = [(str(self.signature), format(mask, 'x'), disease) for mask, disease in predictions.items()]
+            conn = self._connection()
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                # A replaced row is inserted again, so rowids follow the order rows were last stored in
+                conn.executemany('INSERT OR REPLACE INTO predictions (signature, mask, disease) '
+                                 'VALUES (?, ?, ?)', rows)
+                conn.execute('DELETE FROM predictions WHERE rowid <= (SELECT MAX(rowid) FROM predictions) - ?',
+                             (self.shared_maxsize,))
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+            conn.execute('COMMIT')
+
+    def _store(self, predictions):
+        with self._lock:
+            for mask, disease in predictions.items():
+                self._entries[mask] = disease
+                self._entries.move_to_end(mask)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def _read_shared(self, masks):
+        # Masks go in as hex text: 132 bits do not fit an SQLite integer
+        keys = [format(mask, 'x') for mask in masks]
+        found = {}
+        conn = self._connection()
+        for start in range(0, len(keys), self.SQL_CHUNK):
+            chunk = keys[start:start + self.SQL_CHUNK]
+            rows = conn.execute(f'SELECT mask, disease FROM predictions WHERE signature = ? AND mask IN '
+                                f'({", ".join("?" * len(chunk))})', [str(self.signature)] + chunk)
+            found.update((int(mask, 16), disease) for mask, disease in rows)
+        return found
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.shared_hits + self.misses
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "shared_maxsize": self.shared_maxsize if self.path else None,
+                "hits": self.hits,
+                "shared_hits": self.shared_hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits + self.shared_hits) / lookups if lookups else 0.0,
+                "shared": bool(self.path),
+                "model": self.signature,
+            }
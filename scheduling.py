@@ -0,0 +1,221 @@
+import datetime
+from bisect import bisect_left
+
+# Length of one appointment; the booking form offers times on the half hour
+SLOT_MINUTES = 30
+
+# Appointments in these states no longer hold their slot
+RELEASED_STATUSES = frozenset({'Cancelled'})
+
+DATE_FORMAT = '%Y-%m-%d'
+TIME_FORMAT = '%I:%M %p'  # "09:30 AM", as in the booking form and timeSlots
+WEEKDAYS = ('Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday')
+
+
+def parse_minutes(text):
+    """Minutes after midnight of a "09:30 AM" style time"""
+    moment = datetime.datetime.strptime(text.strip(), TIME_FORMAT)
+    return moment.hour * 60 + moment.minute
+
+
+def slot_start(date, time):
+    """datetime of an appointment's "2025-04-03" date and "09:30 AM" time; ValueError when malformed"""
+    day = datetime.datetime.strptime(date.strip(), DATE_FORMAT)
+    return day + datetime.timedelta(minutes=parse_minutes(time))
+
+
+def format_slot(start):
+    return {"date": start.strftime(DATE_FORMAT), "time": start.strftime(TIME_FORMAT)}
+
+
+def weekly_hours(time_slots):
+    """{weekday number: [(start minute, end minute)]} from a doctor's timeSlots, overlaps merged"""
+    hours = {}
+    for entry in time_slots or ():
+        try:
+            weekday = WEEKDAYS.index(entry['day'].strip().capitalize())
+            for text in entry.get('slots', ()):
+                opens, closes = text.split('-')
+                hours.setdefault(weekday, []).append((parse_minutes(opens), parse_minutes(closes)))
+        except (KeyError, ValueError, AttributeError):
+            print(f"Warning: skipping unreadable time slot {entry!r}")
+    for weekday, ranges in hours.items():
+        merged = []
+        for opens, closes in sorted(ranges):
+            if merged and opens <= merged[-1][1]:
+                merged[-1] = (merged[-1][0], max(merged[-1][1], closes))
+            else:
+                merged.append((opens, closes))
+        hours[weekday] = merged
+    return hours
+
+
+class BookedIntervals:
+    """One doctor's booked (start, end) intervals, sorted by start.
+
+    Next to the starts it keeps the latest end among each prefix of them, so
+    whether anything overlaps a new interval is one binary search even if old
+    data holds overlapping bookings.
+    """
+
+    def __init__(self, intervals):
+        intervals = sorted(intervals)
+        self.starts = [start for start, _ in intervals]
+        self.ends = [end for _, end in intervals]
+        self.reach = []
+        for _, end in intervals:
+            self.reach.append(max(end, self.reach[-1]) if self.reach else end)
+
+    def __len__(self):
+        return len(self.starts)
+
+    def overlaps(self, start, end):
+        # Intervals starting before end overlap unless all of them ended by start
+        before_end = bisect_left(self.starts, end)
+        return before_end > 0 and self.reach[before_end - 1] > start
+
+    def without(self, start, end):
+        """Copy without one (start, end) interval, as when that booking moves"""
+        intervals = list(zip(self.starts, self.ends))
+        if (start, end) in intervals:
+            intervals.remove((start, end))
+        return BookedIntervals(intervals)
+
+
+class Scheduler:
+    """Bookable slots of the doctors and the appointments holding them.
+
+    A doctor's weekly timeSlots ("09:00 AM - 12:00 PM" on Fridays) expand to
+    SLOT_MINUTES slots. The appointments holding a slot are kept per doctor as
+    BookedIntervals, built from storage on first use, so checking a slot is a
+    binary search and listing free slots costs one per candidate.
+
+    Doctors without timeSlots take bookings at any time, checked only for
+    conflicts, and have no free slots to list.
+
+    Appointments are written through book(), move() and update(), which hold
+    the appointments writer lock, so two workers cannot both take the same
+    slot, and leave the other doctors' intervals current. Any other change
+    to the collection, such as a write by another process, makes every
+    doctor's intervals rebuild on next use.
+    """
+
+    def __init__(self, storage, slot_minutes=SLOT_MINUTES):
+        self.storage = storage
+        self.slot = datetime.timedelta(minutes=slot_minutes)
+        self._booked = {}  # doctor id -> (appointments version it is current for, BookedIntervals)
+
+    def booked(self, doctor_id):
+        version = self.storage.version('appointments')
+        cached = self._booked.get(doctor_id)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        intervals = []
+        for appointment in self.storage.find('appointments', doctor_id=doctor_id):
+            if appointment.get('status') in RELEASED_STATUSES:
+                continue
+            try:
+                start = slot_start(appointment['date'], appointment['time'])
+            except (KeyError, ValueError, AttributeError):
+                continue  # Hand-edited records without a usable date and time hold nothing
+            intervals.append((start, start + self.slot))
+        booked = BookedIntervals(intervals)
+        self._booked[doctor_id] = (version, booked)
+        return booked
+
+    def _put(self, appointment, doctor_id):
+        """Store appointment, holding the lock; only doctor_id's intervals go stale"""
+        before = self.storage.version('appointments')
+        self.storage.put('appointments', appointment['id'], appointment)
+        after = self.storage.version('appointments')
+        self._booked.pop(doctor_id, None)
+        # The other doctors' intervals that were current before this write still are
+        for other, (version, booked) in list(self._booked.items()):
+            if version == before and other != doctor_id:
+                self._booked[other] = (after, booked)
+
+    def check(self, doctor, start, now=None, moving=None):
+        """None when doctor can be booked at start, otherwise the reason why not.
+
+        moving is an appointment of the doctor being moved to start; its own
+        slot does not count as taken.
+        """
+        if start < (now or datetime.datetime.now()):
+            return "That time has already passed."
+        hours = weekly_hours(doctor.get('timeSlots'))
+        if hours:
+            first = start.hour * 60 + start.minute
+            last = first + self.slot.seconds // 60
+            if not any(opens <= first and last <= closes for opens, closes in hours.get(start.weekday(), ())):
+                return f"{doctor.get('name', 'The doctor')} does not see patients at that time."
+        booked = self.booked(doctor['id'])
+        if moving is not None and moving.get('status') not in RELEASED_STATUSES:
+            try:
+                old_start = slot_start(moving['date'], moving['time'])
+                booked = booked.without(old_start, old_start + self.slot)
+            except (KeyError, ValueError, AttributeError):
+                pass
+        if booked.overlaps(start, start + self.slot):
+            return "That time is already booked, please choose another one."
+        return None
+
+    def is_free(self, doctor, start):
+        return self.check(doctor, start) is None
+
+    def free_slots(self, doctor, days, first_day=None, now=None):
+        """Start times of the doctor's free slots over days days from first_day (default today), in order"""
+        now = now or datetime.datetime.now()
+        day = datetime.datetime.combine(first_day or now.date(), datetime.time())
+        hours = weekly_hours(doctor.get('timeSlots'))
+        booked = self.booked(doctor['id'])
+        step = self.slot.seconds // 60
+        for _ in range(days):
+            for opens, closes in hours.get(day.weekday(), ()):
+                for minute in range(opens, closes - step + 1, step):
+                    start = day + datetime.timedelta(minutes=minute)
+                    if start >= now and not booked.overlaps(start, start + self.slot):
+                        yield start
+            day += datetime.timedelta(days=1)
+
+    def book(self, doctor, appointment):
+        """Store appointment if its slot is free; returns None, or why it was not booked"""
+        try:
+            start = slot_start(appointment['date'], appointment['time'])
+        except (KeyError, ValueError, AttributeError):
+            return "Please choose a valid date and time."
+        with self.storage.locked('appointments'):
+            reason = self.check(doctor, start)
+            if reason is None:
+                self._put(appointment, doctor['id'])
+        return reason
+
+    def move(self, doctor, appointment_id, date, time, changes=None):
+        """Move a stored appointment of doctor to date and time if that slot is free.
+
+        Returns None, or why it was not moved. The new slot is checked and the
+        old one freed in the same write, under the lock.
+        """
+        try:
+            start = slot_start(date, time)
+        except (ValueError, AttributeError):
+            return "Please choose a valid date and time."
+        with self.storage.locked('appointments'):
+            appointment = self.storage.get('appointments', appointment_id)
+            if appointment is None or appointment.get('doctor_id') != doctor['id']:
+                return "That appointment could not be found."
+            if appointment.get('status') in RELEASED_STATUSES:
+                return "That appointment was cancelled and can no longer be rescheduled."
+            reason = self.check(doctor, start, moving=appointment)
+            if reason is None:
+                self._put(dict(appointment, date=date, time=time, **(changes or {})), doctor['id'])
+        return reason
+
+    def update(self, appointment_id, changes, **owner):
+        """Apply changes to a stored appointment whose fields equal owner; returns it, or None"""
+        with self.storage.locked('appointments'):
+            appointment = self.storage.get('appointments', appointment_id)
+            if appointment is None or any(appointment.get(field) != value for field, value in owner.items()):
+                return None
+            appointment = dict(appointment, **changes)
+            self._put(appointment, appointment.get('doctor_id'))
+        return appointment
@@ -0,0 +1,339 @@
+import argparse
+import json
+import sqlite3
+import threading
+import uuid
+from contextlib import contextmanager
+
+from storage import (BLANK_VALUES, COLLECTIONS, INDEXES, LOGS, PARTS, UNIQUE, BackgroundWorker, DuplicateError,
+                     JsonStorage, Storage, merge_parts, record_key, select_parts)
+
+
+def _json_path(field):
+    return '$."' + field + '"'
+
+
+def _unique_index(name, field):
+    return f"ux_{name}_{field}"
+
+
+def _log_entry(seq, data):
+    entry = json.loads(data)
+    return dict(entry, id=seq) if isinstance(entry, dict) else entry
+
+
+def _log_data(entry):
+    # The id is the row number, assigned on insert
+    return json.dumps({field: value for field, value in entry.items() if field != 'id'}
+                      if isinstance(entry, dict) else entry)
+
+
+class SQLiteStorage(Storage):
+    """Storage backed by one SQLite database in WAL mode.
+
+    Every collection is a table of (key, JSON data) rows with an expression
+    index for each entry in INDEXES, so single-record writes and lookups
+    touch one row instead of rewriting the whole collection. Readers and the
+    single writer do not block each other in WAL mode. UNIQUE fields also get
+    a unique index leaving out BLANK_VALUES, so the database itself refuses a
+    duplicate; put() raises DuplicateError for one.
+
+    Collections in LOGS are a <name>_log table with a row per entry instead,
+    so append() is one insert, and an entry's row number is its id. Reads
+    take the newest rows per key up to the retention, and the older ones are
+    deleted in the background every COMPACT_EVERY appends.
+    """
+
+    COMPACT_EVERY = 1000
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._loaded = {}  # name -> (version, data) of the last load()
+        self.compactor = BackgroundWorker(self.compact)
+
+        with self._transaction() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS _versions (name TEXT PRIMARY KEY, version INTEGER NOT NULL)')
+            for name in COLLECTIONS:
+                conn.execute(f'CREATE TABLE IF NOT EXISTS "{name}" (key TEXT PRIMARY KEY, data TEXT NOT NULL)')
+                conn.execute('INSERT OR IGNORE INTO _versions (name, version) VALUES (?, 0)', (name,))
+                for fields in INDEXES.get(name, ()):
+                    columns = ', '.join(f"json_extract(data, '{_json_path(field)}')" for field in fields)
+                    conn.execute(f'CREATE INDEX IF NOT EXISTS "ix_{name}_{"_".join(fields)}" ON "{name}" ({columns})')
+                self._create_unique_indexes(conn, name)
+            for name in LOGS:
+                conn.execute(f'CREATE TABLE IF NOT EXISTS "{name}_log" '
+                             f'(seq INTEGER PRIMARY KEY AUTOINCREMENT, key TEXT NOT NULL, data TEXT NOT NULL)')
+                conn.execute(f'CREATE INDEX IF NOT EXISTS "ix_{name}_log_key" ON "{name}_log" (key, seq)')
+                # Databases from before the log table kept each key's whole list in one row
+                legacy = conn.execute(f'SELECT key, data FROM "{name}" ORDER BY rowid').fetchall()
+                if legacy:
+                    conn.executemany(f'INSERT INTO "{name}_log" (key, data) VALUES (?, ?)',
+                                     [(key, _log_data(entry)) for key, value in legacy for entry in json.loads(value)])
+                    conn.execute(f'DELETE FROM "{name}"')
+
+    def _create_unique_indexes(self, conn, name):
+        blanks = ', '.join("'" + value + "'" for value in BLANK_VALUES)
+        for field in UNIQUE.get(name, ()):
+            column = f"json_extract(data, '{_json_path(field)}')"
+            try:
+                conn.execute(f'CREATE UNIQUE INDEX IF NOT EXISTS "{_unique_index(name, field)}" '
+                             f'ON "{name}" ({column}) WHERE {column} NOT IN ({blanks})')
+            except sqlite3.IntegrityError:
+                print(f"Warning: {name} holds duplicate {field} values, so the database cannot refuse new ones")
+
+    def _connection(self):
+        # sqlite3 connections cannot be shared between threads
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.depth = 0
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        """Write transaction; nested calls join the outer one"""
+        conn = self._connection()
+        if self._local.depth:
+            self._local.depth += 1
+            try:
+                yield conn
+            finally:
+                self._local.depth -= 1
+            return
+
+        conn.execute('BEGIN IMMEDIATE')
+        self._local.depth = 1
+        try:
+            yield conn
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        else:
+            conn.execute('COMMIT')
+        finally:
+            self._local.depth = 0
+
+    def _bump_version(self, conn, name):
+        conn.execute('UPDATE _versions SET version = version + 1 WHERE name = ?', (name,))
+
+    def locked(self, name):
+        # BEGIN IMMEDIATE takes the database's write lock, and the puts inside join the transaction
+        return self._transaction()
+
+    def version(self, name):
+        """Counter that changes whenever any process writes the collection"""
+        row = self._connection().execute('SELECT version FROM _versions WHERE name = ?', (name,)).fetchone()
+        return row[0]
+
+    def load(self, name):
+        version = self.version(name)
+        loaded = self._loaded.get(name)
+        if loaded is not None and loaded[0] == version:
+            return loaded[1]
+
+        if name in LOGS:
+            data = {}
+            for key, seq, value in self._connection().execute(
+                    f'SELECT key, seq, data FROM (SELECT key, data, seq, ROW_NUMBER() OVER '
+                    f'(PARTITION BY key ORDER BY seq DESC) AS n FROM "{name}_log") WHERE n <= ? ORDER BY seq',
+                    (LOGS[name][1],)):
+                data.setdefault(key, []).append(_log_entry(seq, value))
+            self._loaded[name] = (version, data)
+            return data
+
+        rows = self._connection().execute(f'SELECT key, data FROM "{name}" ORDER BY rowid')
+        if COLLECTIONS[name][1] is dict:
+            data = {key: json.loads(value) for key, value in rows}
+        else:
+            data = [json.loads(value) for _, value in rows]
+        self._loaded[name] = (version, data)
+        return data
+
+    def save(self, name, data):
+        if name in LOGS:
+            with self._transaction() as conn:
+                conn.execute(f'DELETE FROM "{name}_log"')
+                for key, entries in data.items():
+                    self._insert_entries(conn, name, key, entries)
+                self._bump_version(conn, name)
+            return
+
+        if isinstance(data, dict):
+            rows = [(key, json.dumps(value)) for key, value in data.items()]
+        else:
+            rows = [(record_key(name, item) or str(uuid.uuid4()), json.dumps(item)) for item in data]
+
+        with self._transaction() as conn:
+            # Whole collections are taken as they are: imported duplicates only cost the unique indexes
+            for field in UNIQUE.get(name, ()):
+                conn.execute(f'DROP INDEX IF EXISTS "{_unique_index(name, field)}"')
+            conn.execute(f'DELETE FROM "{name}"')
+            conn.executemany(f'INSERT OR REPLACE INTO "{name}" (key, data) VALUES (?, ?)', rows)
+            self._create_unique_indexes(conn, name)
+            self._bump_version(conn, name)
+
+    def get(self, name, key, default=None, parts=None):
+        if name in LOGS:
+            entries = self._tail(name, key, LOGS[name][1])
+            return entries if entries else default
+        row = self._connection().execute(f'SELECT data FROM "{name}" WHERE key = ?', (key,)).fetchone()
+        return default if row is None else select_parts(name, json.loads(row[0]), parts)
+
+    def put(self, name, key, value):
+        with self._transaction() as conn:
+            if name in LOGS:
+                conn.execute(f'DELETE FROM "{name}_log" WHERE key = ?', (key,))
+                self._insert_entries(conn, name, key, value)
+                self._bump_version(conn, name)
+                return
+            if name in PARTS:
+                row = conn.execute(f'SELECT data FROM "{name}" WHERE key = ?', (key,)).fetchone()
+                if row is not None:
+                    value = merge_parts(name, json.loads(row[0]), value)
+            try:
+                conn.execute(f'INSERT INTO "{name}" (key, data) VALUES (?, ?) '
+                             f'ON CONFLICT(key) DO UPDATE SET data = excluded.data', (key, json.dumps(value)))
+            except sqlite3.IntegrityError as e:
+                for field in UNIQUE.get(name, ()):
+                    if _unique_index(name, field) in str(e):
+                        raise DuplicateError(name, field) from e
+                raise
+            self._bump_version(conn, name)
+
+    def put_part(self, name, key, part, value):
+        with self._transaction() as conn:
+            updated = conn.execute(f'UPDATE "{name}" SET data = json_set(data, ?, json(?)) WHERE key = ?',
+                                   (_json_path(part), json.dumps(value), key)).rowcount
+            if updated:
+                self._bump_version(conn, name)
+        return bool(updated)
+
+    def append_part(self, name, key, part, entry):
+        # One statement: json_insert adds at the end of the stored list, or of a new one
+        path = _json_path(part)
+        with self._transaction() as conn:
+            updated = conn.execute(
+                f"UPDATE \"{name}\" SET data = json_set(data, ?, json(json_insert("
+                f"COALESCE(json_extract(data, ?), '[]'), '$[#]', json(?)))) WHERE key = ?",
+                (path, path, json.dumps(entry), key)).rowcount
+            if updated:
+                self._bump_version(conn, name)
+        return bool(updated)
+
+    def delete(self, name, key):
+        table = f'{name}_log' if name in LOGS else name
+        with self._transaction() as conn:
+            deleted = conn.execute(f'DELETE FROM "{table}" WHERE key = ?', (key,)).rowcount
+            if deleted:
+                self._bump_version(conn, name)
+        return bool(deleted)
+
+    def _where(self, criteria):
+        return ' AND '.join(f"json_extract(data, '{_json_path(field)}') = ?" for field in criteria) or '1'
+
+    def find(self, name, **criteria):
+        rows = self._connection().execute(f'SELECT data FROM "{name}" WHERE {self._where(criteria)} ORDER BY rowid',
+                                          tuple(criteria.values()))
+        return [json.loads(value) for value, in rows]
+
+    def find_keys(self, name, **criteria):
+        rows = self._connection().execute(f'SELECT key FROM "{name}" WHERE {self._where(criteria)} ORDER BY rowid',
+                                          tuple(criteria.values()))
+        return [key for key, in rows]
+
+    def count(self, name, **criteria):
+        row = self._connection().execute(f'SELECT COUNT(*) FROM "{name}" WHERE {self._where(criteria)}',
+                                         tuple(criteria.values())).fetchone()
+        return row[0]
+
+    def count_distinct(self, name, field, **criteria):
+        # COUNT(DISTINCT) skips NULL, the Python fallbacks count a missing field once
+        row = self._connection().execute(
+            f"SELECT COUNT(DISTINCT json_extract(data, '{_json_path(field)}')), "
+            f"MAX(json_extract(data, '{_json_path(field)}') IS NULL) FROM \"{name}\" WHERE {self._where(criteria)}",
+            tuple(criteria.values())).fetchone()
+        return row[0] + (row[1] or 0)
+
+    def _insert_entries(self, conn, name, key, entries):
+        conn.executemany(f'INSERT INTO "{name}_log" (key, data) VALUES (?, ?)',
+                         [(key, _log_data(entry)) for entry in entries[-LOGS[name][1]:]])
+
+    def _tail(self, name, key, limit, before=None, after=None):
+        # Rows older than the key's newest `retention` ones only wait for compaction
+        conditions = ['key = ?', f'seq >= COALESCE((SELECT seq FROM "{name}_log" WHERE key = ? '
+                                 f'ORDER BY seq DESC LIMIT 1 OFFSET ?), 0)']
+        params = [key, key, LOGS[name][1] - 1]
+        if before is not None:
+            conditions.append('seq < ?')
+            params.append(before)
+        if after is not None:
+            conditions.append('seq > ?')
+            params.append(after)
+        rows = self._connection().execute(
+            f'SELECT seq, data FROM "{name}_log" WHERE {" AND ".join(conditions)} '
+            f'ORDER BY seq {"ASC" if after is not None else "DESC"} LIMIT ?', params + [limit]).fetchall()
+        if after is None:
+            rows.reverse()
+        return [_log_entry(seq, value) for seq, value in rows]
+
+    def append(self, name, key, entry):
+        with self._transaction() as conn:
+            seq = conn.execute(f'INSERT INTO "{name}_log" (key, data) VALUES (?, ?)',
+                               (key, _log_data(entry))).lastrowid
+            self._bump_version(conn, name)
+        if seq % self.COMPACT_EVERY == 0:
+            self.compactor.schedule(name)
+        return dict(entry, id=seq)
+
+    def tail(self, name, key, limit, before=None, after=None):
+        if limit <= 0:
+            return []
+        return self._tail(name, key, min(limit, LOGS[name][1]), before, after)
+
+    def log_version(self, name, key):
+        # Row numbers are never reused, so the newest one changes with every write to the key
+        row = self._connection().execute(f'SELECT MAX(seq) FROM "{name}_log" WHERE key = ?', (key,)).fetchone()
+        return None if row[0] is None else (str(row[0]), None)
+
+    def compact(self, name):
+        """Delete the log entries past the retention of every key"""
+        with self._transaction() as conn:
+            conn.execute(f'DELETE FROM "{name}_log" WHERE seq IN (SELECT seq FROM (SELECT seq, ROW_NUMBER() OVER '
+                         f'(PARTITION BY key ORDER BY seq DESC) AS n FROM "{name}_log") WHERE n > ?)',
+                         (LOGS[name][1],))
+
+    def is_empty(self):
+        conn = self._connection()
+        tables = [f'{name}_log' if name in LOGS else name for name in COLLECTIONS]
+        return all(conn.execute(f'SELECT 1 FROM "{table}" LIMIT 1').fetchone() is None for table in tables)
+
+
+def migrate_json_files(storage, base_dir='.'):
+    """One-shot copy of every flat JSON collection into storage; returns record counts"""
+    source = JsonStorage(base_dir)
+    counts = {}
+    for name in COLLECTIONS:
+        data = source.load(name)
+        storage.save(name, data)
+        counts[name] = len(data)
+    return counts
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Import the PASMA JSON data files into a SQLite database")
+    parser.add_argument('--db', default='pasma.db', help="SQLite database to create (default: pasma.db)")
+    parser.add_argument('--data-dir', default='.', help="Directory holding the JSON files (default: .)")
+    parser.add_argument('--force', action='store_true', help="Overwrite a database that already has data")
+    args = parser.parse_args()
+
+    target = SQLiteStorage(args.db)
+    if not target.is_empty() and not args.force:
+        parser.exit(1, f"{args.db} already has data, use --force to overwrite it\n")
+
+    for collection, count in migrate_json_files(target, args.data_dir).items():
+        print(f"{collection}: {count} records")
+    print(f"Done. Start the app with PASMA_STORAGE=sqlite PASMA_DB={args.db}")
@@ -1,159 +1,25 @@
-// List of valid symptoms that the backend can handle
-const validSymptoms = [
-  "itching",
-  "skin_rash",
-  "nodal_skin_eruptions",
-  "continuous_sneezing",
-  "shivering",
-  "chills",
-  "joint_pain",
-  "stomach_pain",
-  "acidity",
-  "ulcers_on_tongue",
-  "muscle_wasting",
-  "vomiting",
-  "burning_micturition",
-  "spotting_ urination",
-  "fatigue",
-  "weight_gain",
-  "anxiety",
-  "cold_hands_and_feets",
-  "mood_swings",
-  "weight_loss",
-  "restlessness",
-  "lethargy",
-  "patches_in_throat",
-  "irregular_sugar_level",
-  "cough",
-  "high_fever",
-  "sunken_eyes",
-  "breathlessness",
-  "sweating",
-  "dehydration",
-  "indigestion",
-  "headache",
-  "yellowish_skin",
-  "dark_urine",
-  "nausea",
-  "loss_of_appetite",
-  "pain_behind_the_eyes",
-  "back_pain",
-  "constipation",
-  "abdominal_pain",
-  "diarrhoea",
-  "mild_fever",
-  "yellow_urine",
-  "yellowing_of_eyes",
-  "acute_liver_failure",
-  "fluid_overload",
-  "swelling_of_stomach",
-  "swelled_lymph_nodes",
-  "malaise",
-  "blurred_and_distorted_vision",
-  "phlegm",
-  "throat_irritation",
-  "redness_of_eyes",
-  "sinus_pressure",
-  "runny_nose",
-  "congestion",
-  "chest_pain",
-  "weakness_in_limbs",
-  "fast_heart_rate",
-  "pain_during_bowel_movements",
-  "pain_in_anal_region",
-  "bloody_stool",
-  "irritation_in_anus",
-  "neck_pain",
-  "dizziness",
-  "cramps",
-  "bruising",
-  "obesity",
-  "swollen_legs",
-  "swollen_blood_vessels",
-  "puffy_face_and_eyes",
-  "enlarged_thyroid",
-  "brittle_nails",
-  "swollen_extremeties",
-  "excessive_hunger",
-  "extra_marital_contacts",
-  "drying_and_tingling_lips",
-  "slurred_speech",
-  "knee_pain",
-  "hip_joint_pain",
-  "muscle_weakness",
-  "stiff_neck",
-  "swelling_joints",
-  "movement_stiffness",
-  "spinning_movements",
-  "loss_of_balance",
-  "unsteadiness",
-  "weakness_of_one_body_side",
-  "loss_of_smell",
-  "bladder_discomfort",
-  "foul_smell_of urine",
-  "continuous_feel_of_urine",
-  "passage_of_gases",
-  "internal_itching",
-  "toxic_look_(typhos)",
-  "depression",
-  "irritability",
-  "muscle_pain",
-  "altered_sensorium",
-  "red_spots_over_body",
-  "belly_pain",
-  "abnormal_menstruation",
-  "dischromic _patches",
-  "watering_from_eyes",
-  "increased_appetite",
-  "polyuria",
-  "family_history",
-  "mucoid_sputum",
-  "rusty_sputum",
-  "lack_of_concentration",
-  "visual_disturbances",
-  "receiving_blood_transfusion",
-  "receiving_unsterile_injections",
-  "coma",
-  "stomach_bleeding",
-  "distention_of_abdomen",
-  "history_of_alcohol_consumption",
-  "fluid_overload.1",
-  "blood_in_sputum",
-  "prominent_veins_on_calf",
-  "palpitations",
-  "painful_walking",
-  "pus_filled_pimples",
-  "blackheads",
-  "scurring",
-  "skin_peeling",
-  "silver_like_dusting",
-  "small_dents_in_nails",
-  "inflammatory_nails",
-  "blister",
-  "red_sore_around_nose",
-  "yellow_crust_ooze",
-]
+// Symptom names are resolved on the server (/api/symptoms/suggest and /predict),
+// which also understands everyday wording and small typos
 
 // Function to validate symptoms input
 function validateSymptoms(input) {
   // Split the input by commas and trim each symptom
-  const inputSymptoms = input.split(",").map((symptom) => symptom.trim().toLowerCase())
-
-  // Check if all symptoms are valid
-  const invalidSymptoms = inputSymptoms.filter((symptom) => !validSymptoms.includes(symptom))
+  const inputSymptoms = input.split(",").map((symptom) => symptom.trim()).filter((symptom) => symptom !== "")
 
   return {
-    valid: invalidSymptoms.length === 0 && inputSymptoms.length > 0,
-    invalidSymptoms: invalidSymptoms,
+    valid: inputSymptoms.length > 0,
+    invalidSymptoms: [],
   }
 }
 
-// Function to show symptom suggestions
+// Function to fetch symptom suggestions
 function showSymptomSuggestions(input) {
-  const searchTerm = input.toLowerCase()
-  if (searchTerm.length < 2) return []
+  if (input.length < 2) return Promise.resolve([])
 
-  return validSymptoms.filter((symptom) => symptom.includes(searchTerm)).slice(0, 5) // Limit to 5 suggestions
+  return fetch(`/api/symptoms/suggest?q=${encodeURIComponent(input)}&limit=5`) // Limit to 5 suggestions
+    .then((response) => (response.ok ? response.json() : { suggestions: [] }))
+    .then((data) => data.suggestions)
+    .catch(() => [])
 }
 
 // Initialize the symptom form validation
@@ -177,31 +43,34 @@ document.addEventListener("DOMContentLoaded", () => {
     const lastSymptom = value.split(",").pop().trim()
 
     if (lastSymptom.length >= 2) {
-      const suggestions = showSymptomSuggestions(lastSymptom)
-
-      if (suggestions.length > 0) {
-        suggestionsList.innerHTML = ""
-        suggestions.forEach((suggestion) => {
-          const item = document.createElement("a")
-          item.href = "#"
-          item.className = "list-group-item list-group-item-action"
-          item.textContent = suggestion
-          item.addEventListener("click", (e) => {
-            e.preventDefault()
-            const currentValue = symptomsInput.value
-            const symptoms = currentValue.split(",")
-            symptoms.pop() // Remove the last incomplete symptom
-            symptoms.push(suggestion) // Add the selected suggestion
-            symptomsInput.value = symptoms.join(", ")
-            suggestionsList.innerHTML = ""
-            symptomsInput.focus()
+      showSymptomSuggestions(lastSymptom).then((suggestions) => {
+        // Ignore answers for text the user has already changed
+        if (symptomsInput.value.split(",").pop().trim() !== lastSymptom) return
+
+        if (suggestions.length > 0) {
+          suggestionsList.innerHTML = ""
+          suggestions.forEach((suggestion) => {
+            const item = document.createElement("a")
+            item.href = "#"
+            item.className = "list-group-item list-group-item-action"
+            item.textContent = suggestion.label
+            item.addEventListener("click", (e) => {
+              e.preventDefault()
+              const currentValue = symptomsInput.value
+              const symptoms = currentValue.split(",")
+              symptoms.pop() // Remove the last incomplete symptom
+              symptoms.push(suggestion.symptom) // Add the selected suggestion
+              symptomsInput.value = symptoms.join(", ")
+              suggestionsList.innerHTML = ""
+              symptomsInput.focus()
+            })
+            suggestionsList.appendChild(item)
           })
-          suggestionsList.appendChild(item)
-        })
-        suggestionsList.style.display = "block"
-      } else {
-        suggestionsList.style.display = "none"
-      }
+          suggestionsList.style.display = "block"
+        } else {
+          suggestionsList.style.display = "none"
+        }
+      })
     } else {
       suggestionsList.style.display = "none"
     }
@@ -0,0 +1,1149 @@
+import hashlib
+import json
+import os
+import queue
+import re
+import stat
+import tempfile
+import threading
+from contextlib import contextmanager
+from itertools import islice
+
+try:
+    import fcntl
+except ImportError:  # Windows: only in-process locking is available
+    fcntl = None
+
+
+def atomic_write_json(path, data, indent=4):
+    """Write data to path so readers only ever see the old or the new file.
+
+    The JSON is written to a temp file in the same directory, fsynced and
+    renamed over the target, so a crash mid-dump never leaves a truncated file.
+    """
+    atomic_write_text(path, json.dumps(data, indent=indent))
+
+
+def atomic_write_text(path, text):
+    """Replace path with text the same way atomic_write_json does"""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.' + os.path.basename(path) + '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        try:
+            os.chmod(tmp_path, stat.S_IMODE(os.stat(path).st_mode))
+        except FileNotFoundError:
+            os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
+
+    # Make the rename itself durable
+    if hasattr(os, 'O_DIRECTORY'):
+        dir_fd = os.open(directory, os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+
+def file_signature(path):
+    """(inode, mtime, size) of path, or None when it does not exist"""
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return st.st_ino, st.st_mtime_ns, st.st_size
+
+
+@contextmanager
+def file_lock(path):
+    """Exclusive lock on path + '.lock', held across processes"""
+    if fcntl is None:
+        yield
+        return
+    with open(path + '.lock', 'a') as lock_file:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+
+def split_legacy_file(legacy_path, directory, noun, write_split):
+    """Create directory from the flat JSON object in legacy_path unless it exists.
+
+    write_split(tmp_dir, legacy) fills a fresh directory next to the target,
+    which is then renamed into place, so other processes see all of it or none.
+    """
+    if os.path.isdir(directory):
+        return
+    with file_lock(legacy_path):
+        if os.path.isdir(directory):
+            return
+        legacy = get_store(legacy_path).load()
+        legacy = legacy if isinstance(legacy, dict) else {}
+        parent, base = os.path.split(os.path.abspath(directory))
+        tmp_dir = tempfile.mkdtemp(dir=parent, prefix='.' + base + '.')
+        write_split(tmp_dir, legacy)
+        os.rename(tmp_dir, directory)
+        print(f"Split {legacy_path} into {len(legacy)} {noun} under {directory}")
+
+
+class JsonStore:
+    """Cached, parsed copy of one JSON data file.
+
+    The parsed data is kept in memory and only re-read when the file's
+    signature (inode, mtime, size) changes, so a write from another process
+    such as the admin app is picked up on the next load. Saves write the file
+    atomically and replace the cached copy in place, so they never cost a
+    re-parse.
+
+    Writers are serialised across threads and processes with a lock file;
+    readers never take that lock. Use update() for read-modify-write so two
+    workers cannot overwrite each other's changes.
+
+    load() hands out the shared cached object: mutate it only on the way to a
+    save(), otherwise other requests will see the unsaved change.
+    """
+
+    def __init__(self, path, default=dict):
+        self.path = path
+        self.default = default
+        self.generation = 0  # Bumped every time the cached data is replaced
+        self._cached = (None, None)  # (file signature, parsed data)
+        self._read_lock = threading.Lock()
+        self._write_lock = threading.RLock()
+        self._write_depth = 0
+
+    def load(self):
+        signature = file_signature(self.path)
+        cached_signature, data = self._cached
+        if data is not None and signature == cached_signature:
+            return data
+
+        with self._read_lock:
+            # Another thread may have refreshed the cache while we waited
+            cached_signature, data = self._cached
+            if data is not None and signature == cached_signature:
+                return data
+
+            if signature is None:
+                data = self.default()
+            else:
+                try:
+                    with open(self.path, "r") as f:
+                        data = json.load(f)
+                except FileNotFoundError:
+                    data = self.default()
+                except json.JSONDecodeError:
+                    print(f"Warning: {self.path} is not valid JSON, using an empty {self.default.__name__}")
+                    data = self.default()
+
+            self._cached = (signature, data)
+            self.generation += 1
+            return data
+
+    @contextmanager
+    def locked(self):
+        """Hold the writer lock for this file (re-entrant within a thread)"""
+        with self._write_lock:
+            if self._write_depth:
+                self._write_depth += 1
+                try:
+                    yield
+                finally:
+                    self._write_depth -= 1
+                return
+
+            with file_lock(self.path):
+                self._write_depth = 1
+                try:
+                    yield
+                finally:
+                    self._write_depth = 0
+
+    def save(self, data):
+        with self.locked():
+            atomic_write_json(self.path, data)
+            self._cached = (file_signature(self.path), data)
+            self.generation += 1
+
+    @contextmanager
+    def update(self):
+        """Load the latest data under the writer lock, yield it and save it back"""
+        with self.locked():
+            data = self.load()
+            try:
+                yield data
+            except BaseException:
+                # The shared copy may be half-modified; re-read it next time
+                self.invalidate()
+                raise
+            self.save(data)
+
+    def invalidate(self):
+        """Drop the cached copy so the next load re-reads the file"""
+        self._cached = (None, None)
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_store(path, default=dict):
+    """Return the process-wide JsonStore for a data file"""
+    key = os.path.abspath(path)
+    store = _stores.get(key)
+    if store is None:
+        with _stores_lock:
+            store = _stores.get(key)
+            if store is None:
+                store = _stores[key] = JsonStore(path, default)
+    return store
+
+
+# Collections shared by main.py and the admin app:
+# name -> (JSON file, shape of the file, key field of the items of list-shaped files)
+COLLECTIONS = {
+    'users': ("users.json", dict, None),
+    'user_details': ("user_details.json", dict, None),
+    'doctors': ("doctors.json", list, 'id'),
+    'doctor_credentials': ("doctor_credentials.json", dict, None),
+    'appointments': ("appointments.json", list, 'id'),
+    'medications': ("medications.json", dict, None),
+    'chat_history': ("chat_history.json", dict, None),
+    'newsletter_emails': ("newsletter_emails.json", list, 'email'),
+    'profile_versions': ("profile_versions.json", dict, None),
+}
+
+# Record fields that are looked up by value; backends keep an index for each
+INDEXES = {
+    'user_details': [('nid_birth_certificate',), ('phone',)],
+    'doctors': [('email',), ('license',), ('nid',)],
+    'appointments': [('doctor_id',), ('patient_email',), ('status',),
+                     ('doctor_id', 'date'), ('doctor_id', 'status'), ('doctor_id', 'patient_email')],
+}
+
+# Record fields no two keys may share (keys themselves are unique already);
+# each one also needs a single-field entry in INDEXES
+UNIQUE = {
+    'user_details': ('nid_birth_certificate', 'phone'),
+}
+
+# Values of UNIQUE fields that stand for "none given" and may repeat
+# (None too); "Not provided" is the phone of placeholder patient records
+BLANK_VALUES = ('', 'Not provided')
+
+# Fields of a record that grow without bound. Backends may store them apart
+# from the rest of the record and only read the ones a caller asks for; a
+# put() whose value lacks one of them leaves the stored one untouched.
+PARTS = {
+    'user_details': ('medical_history', 'appointments', 'medications'),
+}
+
+# Collections the JSON backend keeps as a directory with one file per record
+# (and per part) instead of one file: name -> directory
+SHARDED = {
+    'user_details': "user_details",
+}
+
+# Dict-shaped collections whose records are lists that only grow at the end,
+# such as chat messages: name -> (directory for the JSON backend, entries kept
+# per key). append() adds an entry without reading the others, tail() reads
+# the newest ones, and entries past the retention are dropped by background
+# compaction instead of on every write.
+LOGS = {
+    'chat_history': ("chat_history", 50),
+}
+
+
+def profile_version(storage, role, email):
+    """Counter bumped whenever the name or picture of a patient ("user") or doctor changes"""
+    return storage.get('profile_versions', f"{role}:{email}", 0)
+
+
+def bump_profile_version(storage, role, email):
+    """Mark the profile headers cached in sessions for role/email as stale, in every app and worker"""
+    key = f"{role}:{email}"
+    # Under the lock, so bumps from concurrent requests all count
+    with storage.locked('profile_versions'):
+        storage.put('profile_versions', key, storage.get('profile_versions', key, 0) + 1)
+
+
+def record_key(name, item):
+    """Key of an item of a list-shaped collection"""
+    key_field = COLLECTIONS[name][2]
+    if isinstance(item, dict):
+        return item.get(key_field)
+    return item
+
+
+def select_parts(name, record, parts):
+    """record without the PARTS not listed in parts (None keeps them all)"""
+    skip = [part for part in PARTS.get(name, ()) if parts is not None and part not in parts]
+    if not skip or not isinstance(record, dict):
+        return record
+    return {field: value for field, value in record.items() if field not in skip}
+
+
+def merge_parts(name, old, new):
+    """new, with the PARTS it lacks carried over from old"""
+    missing = [part for part in PARTS.get(name, ()) if part not in new and part in (old or {})]
+    if not missing or not isinstance(new, dict):
+        return new
+    return dict(new, **{part: old[part] for part in missing})
+
+
+class DuplicateError(ValueError):
+    """A write would give another key's value of a UNIQUE field to key"""
+
+    def __init__(self, name, field):
+        super().__init__(f"{name}: {field} is already taken")
+        self.field = field
+
+
+def matches(record, criteria):
+    return isinstance(record, dict) and all(record.get(field) == value for field, value in criteria.items())
+
+
+class Storage:
+    """Interface of the storage backends.
+
+    Every collection maps a key to a JSON value: dict-shaped collections by
+    their dict keys, list-shaped ones by the key field in COLLECTIONS.
+    load()/save() work on a whole collection in its original file shape;
+    get()/put()/delete() work on a single record and are what request
+    handlers should use for writes. Records with PARTS can be read without
+    them (get(..., parts=())) and have one part read or replaced on its own.
+    """
+
+    def load(self, name):
+        raise NotImplementedError
+
+    def save(self, name, data):
+        raise NotImplementedError
+
+    def get(self, name, key, default=None, parts=None):
+        """Record under key, with only the listed PARTS (None: all of them)"""
+        raise NotImplementedError
+
+    def put(self, name, key, value):
+        raise NotImplementedError
+
+    def get_part(self, name, key, part, default=None):
+        record = self.get(name, key, parts=(part,))
+        return default if record is None else record.get(part, default)
+
+    def put_part(self, name, key, part, value):
+        """Replace one part of an existing record; returns whether the record exists"""
+        record = self.get(name, key, parts=())
+        if record is None:
+            return False
+        self.put(name, key, dict(record, **{part: value}))
+        return True
+
+    def append_part(self, name, key, part, entry):
+        """Add entry to the end of one list part of an existing record; returns whether the record exists.
+
+        The part is read and written back under the collection's lock, so
+        concurrent appends all land.
+        """
+        with self.locked(name):
+            record = self.get(name, key, parts=(part,))
+            if record is None:
+                return False
+            return self.put_part(name, key, part, list(record.get(part) or []) + [entry])
+
+    def delete(self, name, key):
+        """Remove a record; returns whether it existed"""
+        raise NotImplementedError
+
+    def version(self, name):
+        """Token that changes whenever any process writes the collection"""
+        raise NotImplementedError
+
+    def locked(self, name):
+        """Context manager holding the collection's writer lock across processes.
+
+        Reads inside it see every earlier write and writes inside it join it,
+        so a check followed by a put cannot race another writer.
+        """
+        raise NotImplementedError
+
+    def find(self, name, **criteria):
+        """Records whose fields equal all the given values (PARTS may be left out)"""
+        raise NotImplementedError
+
+    def find_keys(self, name, **criteria):
+        """Keys of the records matching the criteria"""
+        raise NotImplementedError
+
+    def conflict(self, name, key, record):
+        """First UNIQUE field whose value in record another key already holds, or None"""
+        for field in UNIQUE.get(name, ()):
+            value = record.get(field)
+            if value is not None and value not in BLANK_VALUES and any(other != key for other in self.find_keys(name, **{field: value})):
+                return field
+        return None
+
+    def put_unique(self, name, key, value):
+        """put() unless another key holds one of value's UNIQUE values; returns that field, or None.
+
+        Only the fields whose value differs from the stored record's are
+        checked, so value must be a changed copy, not the record get() gave. The check and the write happen under the collection's lock,
+        so two writers cannot both take the same value.
+        """
+        with self.locked(name):
+            old = self.get(name, key, parts=()) or {}
+            changed = {field: value[field] for field in UNIQUE.get(name, ())
+                       if field in value and value[field] != old.get(field)}
+            taken = self.conflict(name, key, changed)
+            if taken is not None:
+                return taken
+            try:
+                self.put(name, key, value)
+            except DuplicateError as e:
+                return e.field
+            return None
+
+    def find_one(self, name, **criteria):
+        """First record matching the criteria, or None"""
+        records = self.find(name, **criteria)
+        return records[0] if records else None
+
+    def count(self, name, **criteria):
+        """Number of records matching the criteria"""
+        return len(self.find(name, **criteria))
+
+    def count_distinct(self, name, field, **criteria):
+        """Number of distinct values of field among the records matching the criteria"""
+        return len({record.get(field) for record in self.find(name, **criteria)})
+
+    def append(self, name, key, entry):
+        """Add entry to the end of the list under key in a LOGS collection.
+
+        Returns the stored entry, which carries an "id" higher than those of
+        the entries before it.
+        """
+        raise NotImplementedError
+
+    def tail(self, name, key, limit, before=None, after=None):
+        """The last limit entries of the list under key in a LOGS collection, oldest first.
+
+        before and after are entry ids: before pages back through older
+        entries, after gives the oldest limit entries newer than that id.
+        """
+        raise NotImplementedError
+
+    def log_version(self, name, key):
+        """(version, modified time or None) of the list under key, None when there is none.
+
+        The version changes whenever the list does and is cheap to get, so
+        callers can tell that nothing changed without reading the entries.
+        """
+        raise NotImplementedError
+
+
+class CollectionIndex:
+    """Hash indexes over one loaded collection.
+
+    Maps each key to its position (list-shaped collections) and, for every
+    field tuple in INDEXES, each value tuple to the keys holding it. The
+    values indexed for a key are remembered, so a record that was modified in
+    place before being put back is still removed from its old buckets.
+
+    Bucket sizes double as counters, and for composite indexes the number of
+    distinct last-field values under each prefix is kept as well (e.g. the
+    patients of a doctor), so both counts are O(1).
+    """
+
+    def __init__(self, name, data):
+        self.name = name
+        self.data = data
+        self.positions = None if isinstance(data, dict) else {}
+        self.buckets = {fields: {} for fields in INDEXES.get(name, ())}
+        self.distinct = {fields: {} for fields in self.buckets if len(fields) > 1}
+        self._indexed = {}  # key -> value tuples it was indexed under
+
+        if isinstance(data, dict):
+            for key, record in data.items():
+                self.add(key, record)
+        else:
+            for position, record in enumerate(data):
+                key = record_key(name, record)
+                if key not in self.positions:  # First copy wins, as in a linear scan
+                    self.positions[key] = position
+                    self.add(key, record)
+
+    def add(self, key, record):
+        if not isinstance(record, dict) or not self.buckets:
+            return
+        values = tuple(tuple(record.get(field) for field in fields) for fields in self.buckets)
+        for (fields, buckets), value in zip(self.buckets.items(), values):
+            bucket = buckets.get(value)
+            if bucket is None:
+                bucket = buckets[value] = {}
+                if fields in self.distinct:
+                    prefixes = self.distinct[fields]
+                    prefixes[value[:-1]] = prefixes.get(value[:-1], 0) + 1
+            bucket[key] = None
+        self._indexed[key] = values
+
+    def remove(self, key):
+        values = self._indexed.pop(key, None)
+        if values is None:
+            return
+        for (fields, buckets), value in zip(self.buckets.items(), values):
+            bucket = buckets.get(value)
+            if bucket is not None:
+                bucket.pop(key, None)
+                if not bucket:
+                    del buckets[value]
+                    if fields in self.distinct:
+                        prefixes = self.distinct[fields]
+                        prefixes[value[:-1]] -= 1
+                        if not prefixes[value[:-1]]:
+                            del prefixes[value[:-1]]
+
+    def record(self, key, default=None):
+        if self.positions is None:
+            return self.data.get(key, default)
+        position = self.positions.get(key)
+        return default if position is None else self.data[position]
+
+    def bucket(self, criteria):
+        """Keys matching the criteria (unordered), or None when no index covers them"""
+        for fields, buckets in self.buckets.items():
+            if len(fields) == len(criteria) and all(field in criteria for field in fields):
+                return buckets.get(tuple(criteria[field] for field in fields), {})
+        return None
+
+    def keys(self, criteria):
+        """Keys matching the criteria in file order, or None when no index covers them"""
+        bucket = self.bucket(criteria)
+        if bucket is None or self.positions is None:
+            return bucket if bucket is None else list(bucket)
+        return sorted(bucket, key=self.positions.get)
+
+    def count_distinct(self, field, criteria):
+        """Distinct values of field under the criteria, or None when not indexed"""
+        for fields, prefixes in self.distinct.items():
+            if fields[-1] == field and len(fields) == len(criteria) + 1 and all(f in criteria for f in fields[:-1]):
+                return prefixes.get(tuple(criteria[f] for f in fields[:-1]), 0)
+        return None
+
+
+def _absent():
+    return None
+
+
+_SHARD_FILE = re.compile(r'[0-9a-f]{40}\.json$')
+
+
+class ShardedStore:
+    """Dict-shaped collection kept as one JSON file per record in a directory.
+
+    A record lives in <sha1 of its key>.json as {"key", "seq", "data"} and each
+    of its PARTS in <sha1>.<part>.json next to it, so a write touches only that
+    record's files and parts are parsed only when asked for. Every file is a
+    JsonStore, cached and written atomically like the flat collections.
+
+    Writers hold the lock of version.json, whose number is bumped after each
+    change to a record; readers in any process rescan the directory when its
+    signature changes. Part writes do not bump it, since the scan only covers
+    the records without their parts.
+    """
+
+    def __init__(self, name, directory, legacy_path):
+        self.name = name
+        self.directory = directory
+        self.legacy_path = legacy_path  # Flat file split up on first use
+        self.parts = PARTS.get(name, ())
+        self.version = get_store(os.path.join(directory, 'version.json'), dict)
+        self._cached = (None, None)  # (version file signature, {key: record without parts})
+        self._scan_lock = threading.Lock()
+        self._ready = False
+
+    def _file_name(self, key, part=None):
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        return digest + ('.' + part if part else '') + '.json'
+
+    def _store(self, key, part=None):
+        return get_store(os.path.join(self.directory, self._file_name(key, part)), dict if part is None else _absent)
+
+    def _split_legacy_file(self):
+        """Create the directory from the flat file the first time it is needed"""
+        if not self._ready:
+            split_legacy_file(self.legacy_path, self.directory, 'records', self._write_split)
+            self._ready = True
+
+    def _write_split(self, tmp_dir, legacy):
+        for seq, (key, record) in enumerate(legacy.items()):
+            head = {field: value for field, value in record.items() if field not in self.parts}
+            atomic_write_json(os.path.join(tmp_dir, self._file_name(key)), {"key": key, "seq": seq, "data": head})
+            for part in self.parts:
+                if part in record:
+                    atomic_write_json(os.path.join(tmp_dir, self._file_name(key, part)), record[part])
+        atomic_write_json(os.path.join(tmp_dir, 'version.json'), {"version": len(legacy)})
+
+    def heads(self):
+        """{key: record without its parts}, in creation order; the shared cached copy"""
+        self._split_legacy_file()
+        signature = file_signature(self.version.path)
+        cached_signature, heads = self._cached
+        if heads is not None and signature == cached_signature:
+            return heads
+
+        with self._scan_lock:
+            cached_signature, heads = self._cached
+            if heads is not None and signature == cached_signature:
+                return heads
+
+            shards = []
+            for file_name in os.listdir(self.directory):
+                if _SHARD_FILE.match(file_name):
+                    shard = get_store(os.path.join(self.directory, file_name)).load()
+                    if isinstance(shard, dict) and 'key' in shard:
+                        shards.append(shard)
+            shards.sort(key=lambda shard: shard.get('seq', 0))
+            heads = {shard['key']: shard.get('data', {}) for shard in shards}
+            self._cached = (signature, heads)
+            return heads
+
+    def with_parts(self, key, head, parts=None):
+        """head plus the requested parts of the record under key"""
+        wanted = self.parts if parts is None else [part for part in parts if part in self.parts]
+        if not wanted:
+            return head
+        record = dict(head)
+        for part in wanted:
+            value = self._store(key, part).load()
+            if value is not None:
+                record[part] = value
+        return record
+
+    def load(self):
+        return {key: self.with_parts(key, head) for key, head in self.heads().items()}
+
+    def locked(self):
+        self._split_legacy_file()
+        return self.version.locked()
+
+    def _bump_version(self, heads):
+        version = self.version.load().get('version', 0) + 1
+        self.version.save({"version": version})
+        # Still holding the lock, so heads reflects every write before this one
+        self._cached = (file_signature(self.version.path), heads)
+        return version
+
+    def put(self, key, value):
+        """Write the record and the parts it carries; returns the stored head"""
+        with self.locked():
+            heads = self.heads()
+            head = {field: item for field, item in value.items() if field not in self.parts}
+            for part in self.parts:
+                if part in value:
+                    self._store(key, part).save(value[part])
+            store = self._store(key)
+            shard = store.load()
+            seq = shard.get('seq') if shard.get('key') == key else None
+            if seq is None:
+                seq = self.version.load().get('version', 0) + 1
+            store.save({"key": key, "seq": seq, "data": head})
+            heads[key] = head
+            self._bump_version(heads)
+            return head
+
+    def get_part(self, key, part):
+        return self._store(key, part).load()
+
+    def put_part(self, key, part, value):
+        with self.locked():
+            if key not in self.heads():
+                return False
+            self._store(key, part).save(value)
+            return True
+
+    def delete(self, key):
+        with self.locked():
+            heads = self.heads()
+            if key not in heads:
+                return False
+            # Parts first: a crash in between leaves a record without parts, not orphaned parts
+            for part in self.parts + (None,):
+                store = self._store(key, part)
+                try:
+                    os.unlink(store.path)
+                except FileNotFoundError:
+                    pass
+                store.invalidate()
+            del heads[key]
+            self._bump_version(heads)
+            return True
+
+    def save(self, data):
+        with self.locked():
+            for key in [key for key in self.heads() if key not in data]:
+                self.delete(key)
+            for key, value in data.items():
+                self.put(key, value)
+
+
+class BackgroundWorker:
+    """Runs jobs one at a time, in the order scheduled, on a daemon thread.
+
+    schedule() returns at once. With coalesce, a job that is already waiting
+    is not queued again, so a burst of writes to one key costs a single
+    compaction; without it every job runs, as for messages to be saved.
+    """
+
+    def __init__(self, run, name='compaction', coalesce=True):
+        self.run = run  # Called with each scheduled job
+        self.name = name
+        self.coalesce = coalesce
+        self._pending = set()
+        self._jobs = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def schedule(self, job):
+        with self._lock:
+            if self.coalesce:
+                if job in self._pending:
+                    return
+                self._pending.add(job)
+            # Started on first use, so a worker forked after import gets its own thread
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+        self._jobs.put(job)
+
+    def _run(self):
+        while True:
+            job = self._jobs.get()
+            if self.coalesce:
+                with self._lock:
+                    self._pending.discard(job)
+            try:
+                self.run(job)
+            except Exception as e:
+                print(f"Warning: {self.name} job {job!r} failed: {e}")
+            finally:
+                self._jobs.task_done()
+
+    def join(self):
+        """Wait until every scheduled job has run"""
+        self._jobs.join()
+
+
+_LOG_FILE = re.compile(r'[0-9a-f]{40}\.ndjson$')
+
+
+class AppendLog:
+    """LOGS collection kept as one NDJSON file per key in a directory.
+
+    The entries under a key are the lines of <sha1 of its key>.ndjson, after a
+    first line holding the key itself. append() writes one line at the end of
+    the file and tail() reads backwards from the end until it has enough
+    lines, so neither depends on how long the history is. Once a file has
+    grown well past what it held after its last compaction, a background
+    thread rewrites it with only the newest `retention` entries; readers cap
+    what they return at the retention, so they never see the difference.
+
+    Every entry gets an "id" one above the previous entry's, which tail()
+    takes as a cursor. The file's signature serves as the key's version, so
+    checking for changes is a stat() rather than a read.
+
+    Appends and rewrites hold the file's lock, so an append cannot land in a
+    file that a compaction is about to replace. Lines are not fsynced: a crash
+    can lose the last messages, and a torn last line is skipped on read.
+    """
+
+    # A file is compacted once it is this big and twice its compacted size
+    COMPACT_BYTES = 64 * 1024
+    # Bytes read per step when scanning back from the end of a file
+    TAIL_BLOCK = 8192
+
+    def __init__(self, name, directory, legacy_path, retention):
+        self.name = name
+        self.directory = directory
+        self.legacy_path = legacy_path  # Flat dict-of-lists file split up on first use
+        self.retention = retention
+        self.compactor = BackgroundWorker(self.compact)
+        self._compacted_size = {}  # key -> file size after this process last compacted it
+        self._ready = False
+
+    def _path(self, key):
+        return os.path.join(self.directory, hashlib.sha1(key.encode('utf-8')).hexdigest() + '.ndjson')
+
+    @staticmethod
+    def _lines(key, entries):
+        """File contents for entries, numbering the ones that have no id yet"""
+        lines = [json.dumps([key])]
+        last_id = 0
+        for entry in entries:
+            if isinstance(entry, dict):
+                if not isinstance(entry.get('id'), int):
+                    entry = dict(entry, id=last_id + 1)
+                last_id = entry['id']
+            lines.append(json.dumps(entry))
+        return '\n'.join(lines) + '\n'
+
+    def _split_legacy_file(self):
+        """Create the directory from the flat file the first time it is needed"""
+        if not self._ready:
+            split_legacy_file(self.legacy_path, self.directory, 'logs', self._write_split)
+            self._ready = True
+
+    def _write_split(self, tmp_dir, legacy):
+        for key, entries in legacy.items():
+            atomic_write_text(os.path.join(tmp_dir, os.path.basename(self._path(key))),
+                              self._lines(key, entries[-self.retention:]))
+
+    def append(self, key, entry):
+        """Write entry after the others under key; returns it with its id"""
+        self._split_legacy_file()
+        path = self._path(key)
+        with file_lock(path):
+            last = next(self._backwards(path), None)
+            entry = dict(entry, id=(last.get('id', 0) if isinstance(last, dict) else 0) + 1)
+            with open(path, 'a') as f:
+                if not f.tell():
+                    f.write(json.dumps([key]) + '\n')
+                f.write(json.dumps(entry) + '\n')
+                size = f.tell()
+        if size > max(self.COMPACT_BYTES, 2 * self._compacted_size.get(key, 0)):
+            self.compactor.schedule(key)
+        return entry
+
+    def _backwards(self, path):
+        """Entries of path newest first, read from the end a block at a time; nothing when there is no file"""
+        try:
+            f = open(path, 'rb')
+        except FileNotFoundError:
+            return
+        with f:
+            position = f.seek(0, os.SEEK_END)
+            pending = b''  # Start of the file up to the first newline read so far
+            last_dropped = False
+            while position:
+                step = min(self.TAIL_BLOCK, position)
+                position -= step
+                f.seek(position)
+                lines = (f.read(step) + pending).split(b'\n')
+                # The first piece may go on in the block before, or is the key line at the start
+                pending = lines.pop(0)
+                if not last_dropped and lines:
+                    # Empty after the final newline, or a line still being written
+                    lines.pop()
+                    last_dropped = True
+                for line in reversed(lines):
+                    try:
+                        yield json.loads(line)
+                    except ValueError:
+                        print(f"Warning: skipping a damaged line in {path}")
+
+    def tail(self, key, limit=None, before=None, after=None):
+        """Up to limit of the newest `retention` entries under key, oldest first; None for an unknown key.
+
+        With before, only entries with a lower id; with after, the oldest
+        entries with a higher id instead of the newest ones.
+        """
+        self._split_legacy_file()
+        path = self._path(key)
+        if not os.path.exists(path):
+            return None
+        limit = self.retention if limit is None else min(limit, self.retention)
+        if limit <= 0:
+            return []
+        entries = []
+        for n, entry in enumerate(self._backwards(path)):
+            entry_id = entry.get('id', 0) if isinstance(entry, dict) else 0
+            if n == self.retention or (after is not None and entry_id <= after):
+                break
+            if before is not None and entry_id >= before:
+                continue
+            entries.append(entry)
+            if after is None and len(entries) == limit:
+                break
+        entries.reverse()
+        return entries[:limit]
+
+    def version(self, key):
+        """(inode, mtime, size) of the key's file, which changes with every write; None for an unknown key"""
+        return file_signature(self._path(key))
+
+    def keys(self):
+        self._split_legacy_file()
+        keys = []
+        for file_name in os.listdir(self.directory):
+            if _LOG_FILE.match(file_name):
+                try:
+                    with open(os.path.join(self.directory, file_name)) as f:
+                        keys.append(json.loads(f.readline())[0])
+                except (FileNotFoundError, ValueError, IndexError):
+                    continue
+        return sorted(keys)
+
+    def load(self):
+        logs = {key: self.tail(key) for key in self.keys()}
+        return {key: entries for key, entries in logs.items() if entries is not None}
+
+    def compact(self, key):
+        path = self._path(key)
+        with file_lock(path):
+            if not os.path.exists(path):
+                return
+            entries = list(islice(self._backwards(path), self.retention))
+            atomic_write_text(path, self._lines(key, reversed(entries)))
+            self._compacted_size[key] = os.path.getsize(path)
+
+    def put(self, key, entries):
+        self._split_legacy_file()
+        path = self._path(key)
+        with file_lock(path):
+            atomic_write_text(path, self._lines(key, entries[-self.retention:]))
+
+    def delete(self, key):
+        self._split_legacy_file()
+        path = self._path(key)
+        with file_lock(path):
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                return False
+        return True
+
+    def save(self, data):
+        for key in self.keys():
+            if key not in data:
+                self.delete(key)
+        for key, entries in data.items():
+            self.put(key, entries)
+
+
+class JsonStorage(Storage):
+    """Storage backed by the flat JSON files, one JsonStore per collection.
+
+    Single-record writes still rewrite the file, but they happen under the
+    file lock on the latest data, so concurrent writers never lose each
+    other's records. Collections in SHARDED are a ShardedStore instead, whose
+    writes only touch the record concerned, and collections in LOGS are an
+    AppendLog.
+    """
+
+    def __init__(self, base_dir='.'):
+        self.stores = {
+            name: get_store(os.path.join(base_dir, file_name), shape)
+            for name, (file_name, shape, _) in COLLECTIONS.items()
+        }
+        self.shards = {
+            name: ShardedStore(name, os.path.join(base_dir, directory), self.stores[name].path)
+            for name, directory in SHARDED.items()
+        }
+        self.logs = {
+            name: AppendLog(name, os.path.join(base_dir, directory), self.stores[name].path, retention)
+            for name, (directory, retention) in LOGS.items()
+        }
+        self._indexes = {}
+
+    def _locked(self, name):
+        shard = self.shards.get(name)
+        return shard.locked() if shard is not None else self.stores[name].locked()
+
+    def locked(self, name):
+        return self._locked(name)
+
+    def version(self, name):
+        if name in self.shards:
+            return file_signature(self.shards[name].version.path)
+        # Reloading the file after another process wrote it bumps the generation as well
+        self.stores[name].load()
+        return self.stores[name].generation
+
+    def load(self, name):
+        if name in self.shards:
+            return self.shards[name].load()
+        if name in self.logs:
+            return self.logs[name].load()
+        data = self.stores[name].load()
+        shape = COLLECTIONS[name][1]
+        # An empty file of the wrong shape (e.g. {} in a list file) reads as empty
+        return data if isinstance(data, shape) or data else shape()
+
+    def save(self, name, data):
+        if name in self.shards:
+            self.shards[name].save(data)
+        elif name in self.logs:
+            self.logs[name].save(data)
+        else:
+            self.stores[name].save(data)
+
+    def _index(self, name):
+        """Index of the current data, rebuilt only when the file was reloaded"""
+        shard = self.shards.get(name)
+        data = shard.heads() if shard is not None else self.load(name)
+        index = self._indexes.get(name)
+        if index is None or index.data is not data:
+            index = self._indexes[name] = CollectionIndex(name, data)
+        return index
+
+    def get(self, name, key, default=None, parts=None):
+        if name in self.logs:
+            entries = self.logs[name].tail(key)
+            return default if entries is None else entries
+        record = self._index(name).record(key)
+        if record is None:
+            return default
+        if name in self.shards:
+            return self.shards[name].with_parts(key, record, parts)
+        return select_parts(name, record, parts)
+
+    def put(self, name, key, value):
+        if name in self.shards:
+            with self._locked(name):
+                index = self._index(name)
+                head = self.shards[name].put(key, value)
+                index.remove(key)
+                index.add(key, head)
+            return
+        if name in self.logs:
+            self.logs[name].put(key, value)
+            return
+
+        store = self.stores[name]
+        with store.locked():
+            index = self._index(name)
+            data = index.data
+            try:
+                if index.positions is None:
+                    value = data[key] = merge_parts(name, data.get(key), value)
+                else:
+                    position = index.positions.get(key)
+                    if position is None:
+                        index.positions[key] = len(data)
+                        data.append(value)
+                    else:
+                        data[position] = value
+                store.save(data)
+            except BaseException:
+                # The cached copy holds a change that was never saved; re-read the file next time
+                store.invalidate()
+                raise
+            index.remove(key)
+            index.add(key, value)
+
+    def get_part(self, name, key, part, default=None):
+        if name in self.shards:
+            if self._index(name).record(key) is None:
+                return default
+            value = self.shards[name].get_part(key, part)
+            return default if value is None else value
+        return super().get_part(name, key, part, default)
+
+    def put_part(self, name, key, part, value):
+        if name in self.shards:
+            return self.shards[name].put_part(key, part, value)
+        with self._locked(name):
+            return super().put_part(name, key, part, value)
+
+    def delete(self, name, key):
+        if name in self.shards:
+            with self._locked(name):
+                index = self._index(name)
+                if not self.shards[name].delete(key):
+                    return False
+                index.remove(key)
+                return True
+        if name in self.logs:
+            return self.logs[name].delete(key)
+
+        store = self.stores[name]
+        with store.locked():
+            index = self._index(name)
+            data = index.data
+            try:
+                if index.positions is None:
+                    if key not in data:
+                        return False
+                    del data[key]
+                else:
+                    position = index.positions.get(key)
+                    if position is None:
+                        return False
+                    del data[position]
+                store.save(data)
+            except BaseException:
+                store.invalidate()  # As in put(): drop the unsaved change
+                raise
+            if index.positions is None:
+                index.remove(key)
+            else:
+                # Later items moved up one place
+                self._indexes[name] = CollectionIndex(name, data)
+            return True
+
+    def find(self, name, **criteria):
+        index = self._index(name)
+        keys = index.keys(criteria)
+        if keys is not None:
+            return [index.record(key) for key in keys]
+        data = index.data
+        records = data.values() if isinstance(data, dict) else data
+        return [record for record in records if matches(record, criteria)]
+
+    def find_keys(self, name, **criteria):
+        index = self._index(name)
+        keys = index.keys(criteria)
+        if keys is not None:
+            return keys
+        data = index.data
+        if isinstance(data, dict):
+            return [key for key, record in data.items() if matches(record, criteria)]
+        return [record_key(name, record) for record in data if matches(record, criteria)]
+
+    def count(self, name, **criteria):
+        bucket = self._index(name).bucket(criteria)
+        if bucket is not None:
+            return len(bucket)
+        return super().count(name, **criteria)
+
+    def count_distinct(self, name, field, **criteria):
+        distinct = self._index(name).count_distinct(field, criteria)
+        if distinct is not None:
+            return distinct
+        return super().count_distinct(name, field, **criteria)
+
+    def append(self, name, key, entry):
+        return self.logs[name].append(key, entry)
+
+    def tail(self, name, key, limit, before=None, after=None):
+        return self.logs[name].tail(key, limit, before, after) or []
+
+    def log_version(self, name, key):
+        signature = self.logs[name].version(key)
+        if signature is None:
+            return None
+        return '-'.join(str(part) for part in signature), signature[1] / 1e9
+
+
+def open_storage(base_dir='.'):
+    """Open the backend selected by PASMA_STORAGE ("json", the default, or "sqlite").
+
+    The SQLite database lives at PASMA_DB (default pasma.db in base_dir).
+    """
+    backend = os.environ.get('PASMA_STORAGE', 'json').lower()
+    if backend == 'json':
+        return JsonStorage(base_dir)
+    if backend == 'sqlite':
+        from sqlite_storage import SQLiteStorage
+        return SQLiteStorage(os.path.join(base_dir, os.environ.get('PASMA_DB', 'pasma.db')))
+    raise ValueError(f"Unknown storage backend: {backend}")
@@ -0,0 +1,378 @@
+import argparse
+import hashlib
+import json
+import os
+
+import numpy as np
+
+EXPORT_DIR = 'models/svc'
+
+# Arrays written by export_svc(); every one is loaded memory-mapped
+ARRAYS = ('support_vectors', 'pair_weights', 'abs_pair_weights', 'pair_index', 'pair_coef', 'intercept', 'classes')
+
+# Size and mtime of the pickle when it last matched the export's signature;
+# local to the machine, so it is not part of the export itself
+SOURCE_STAT_FILE = 'source_stat.json'
+
+
+def model_signature(path):
+    """SHA-256 of the pickle an export was made from (mtimes do not survive a git checkout)"""
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def source_stat(path):
+    st = os.stat(path)
+    return [st.st_size, st.st_mtime_ns]
+
+
+def record_source_stat(directory, model_path, signature):
+    """Remember that model_path, as its size and mtime are now, has the given signature"""
+    try:
+        with open(os.path.join(directory, SOURCE_STAT_FILE), 'w') as f:
+            json.dump({"signature": signature, "stat": source_stat(model_path)}, f)
+    except OSError as e:
+        print(f"Warning: could not record the model's size and mtime in {directory}: {e}")
+
+
+def _pairs(n_classes):
+    """Class pairs in libsvm's one-vs-one order"""
+    return [(i, j) for i in range(n_classes) for j in range(i + 1, n_classes)]
+
+
+def pair_terms(svc):
+    """Support vector indices and coefficients of every one-vs-one pair.
+
+    Row p lists the support vectors of class i followed by those of class j,
+    the order libsvm sums them in, padded with index -1 and coefficient 0.
+    """
+    n_classes = len(svc.classes_)
+    starts = np.concatenate([[0], np.cumsum(svc.n_support_)])
+    dual_coef = svc._dual_coef_
+    pairs = _pairs(n_classes)
+    width = max(svc.n_support_[i] + svc.n_support_[j] for i, j in pairs)
+    index = np.full((len(pairs), width), -1, dtype=np.int32)
+    coef = np.zeros((len(pairs), width))
+    for p, (i, j) in enumerate(pairs):
+        si = np.arange(starts[i], starts[i + 1])
+        sj = np.arange(starts[j], starts[j + 1])
+        index[p, :len(si) + len(sj)] = np.concatenate([si, sj])
+        coef[p, :len(si) + len(sj)] = np.concatenate([dual_coef[j - 1, si], dual_coef[i, sj]])
+    return index, coef
+
+
+def pair_weights(n_support_vectors, index, coef):
+    """The same terms as a dense (n_SV, n_pairs) matrix, for one matrix product"""
+    weights = np.zeros((n_support_vectors + 1, len(index)))
+    weights[index, np.arange(len(index))[:, None]] = coef
+    return weights[:-1]  # Drop the row the -1 padding landed in
+
+
+def svc_arrays(svc, source=None):
+    """(meta, arrays) describing a fitted multi-class sklearn SVC"""
+    if len(svc.classes_) < 3:
+        raise ValueError("Only multi-class (one-vs-one) SVCs are supported")
+    index, coef = pair_terms(svc)
+    weights = pair_weights(len(svc.support_vectors_), index, coef)
+    arrays = {
+        'support_vectors': np.ascontiguousarray(svc.support_vectors_, dtype=np.float64),
+        'pair_weights': weights,
+        # For the rounding error bounds; exported so every worker maps it instead of computing a copy
+        'abs_pair_weights': np.abs(weights),
+        'pair_index': index,
+        'pair_coef': coef,
+        'intercept': np.asarray(svc._intercept_, dtype=np.float64),
+        'classes': np.asarray(svc.classes_),
+    }
+    meta = {
+        'kernel': svc.kernel,
+        'gamma': float(svc._gamma),
+        'coef0': float(svc.coef0),
+        'degree': int(svc.degree),
+        'source': os.path.basename(source) if source else None,
+        'source_signature': model_signature(source) if source else None,
+    }
+    return meta, arrays
+
+
+def export_svc(svc, directory=EXPORT_DIR, source=None):
+    """Write a fitted multi-class sklearn SVC as .npy arrays plus meta.json"""
+    meta, arrays = svc_arrays(svc, source)
+    os.makedirs(directory, exist_ok=True)
+    for name, array in arrays.items():
+        np.save(os.path.join(directory, name + '.npy'), array)
+    with open(os.path.join(directory, 'meta.json'), 'w') as f:
+        json.dump(meta, f, indent=4)
+    if source:
+        record_source_stat(directory, source, meta['source_signature'])
+    return meta
+
+
+def load_arrays(directory=EXPORT_DIR):
+    """(meta, memory-mapped arrays) of an export"""
+    with open(os.path.join(directory, 'meta.json')) as f:
+        meta = json.load(f)
+    arrays = {name: np.load(os.path.join(directory, name + '.npy'), mmap_mode='r') for name in ARRAYS}
+    return meta, arrays
+
+
+class SVCEngine:
+    """Prediction-only stand-in for a multi-class sklearn SVC.
+
+    Runs the same one-vs-one vote as libsvm: each pair (i, j) votes for i when
+    its decision value is positive, otherwise for j, and the first class with
+    the most votes wins. Decision values come from one matrix product; the
+    few whose rounding error could change their sign (values that cancel to
+    zero are common with 0/1 inputs) are recomputed one support vector at a
+    time in libsvm's order, so the votes match it exactly. The arrays are
+    memory-mapped, so every worker on the machine shares one page-cache copy,
+    and nothing is unpickled.
+    """
+
+    def __init__(self, meta, arrays):
+        self.meta = meta
+        self.kernel = meta['kernel']
+        # Plain ndarray views of the mapped memory; np.memmap indexing is slow per call
+        arrays = {name: np.asarray(array).view(np.ndarray) for name, array in arrays.items()}
+        self.support_vectors = arrays['support_vectors']
+        self.pair_weights = arrays['pair_weights']
+        self.abs_pair_weights = arrays['abs_pair_weights']
+        self.pair_index = arrays['pair_index']
+        self.pair_coef = arrays['pair_coef']
+        self.intercept = arrays['intercept']
+        self.classes_ = arrays['classes']
+
+        # Worst-case disagreement between two summation orders is this times |K| @ |W|
+        self._error_scale = 4 * (sum(self.support_vectors.shape) + 1) * np.finfo(np.float64).eps
+
+        # Every pair votes for j unless its value is positive, which moves the vote to i
+        n_classes = len(self.classes_)
+        pairs = np.array(_pairs(n_classes))
+        # (vote counts are small integers, exact in single precision)
+        self._vote_shift = np.zeros((len(pairs), n_classes), dtype=np.float32)
+        self._vote_shift[np.arange(len(pairs)), pairs[:, 0]] = 1
+        self._vote_shift[np.arange(len(pairs)), pairs[:, 1]] = -1
+        self._base_votes = np.bincount(pairs[:, 1], minlength=n_classes).astype(np.float32)
+
+    @classmethod
+    def load(cls, directory=EXPORT_DIR):
+        return cls(*load_arrays(directory))
+
+    def _kernel(self, X):
+        K = X @ self.support_vectors.T
+        if self.kernel == 'linear':
+            return K
+        gamma, coef0 = self.meta['gamma'], self.meta['coef0']
+        if self.kernel == 'poly':
+            return (gamma * K + coef0) ** self.meta['degree']
+        if self.kernel == 'sigmoid':
+            return np.tanh(gamma * K + coef0)
+        if self.kernel == 'rbf':
+            sq_dist = (X * X).sum(axis=1)[:, None] - 2 * K + (self.support_vectors ** 2).sum(axis=1)[None, :]
+            return np.exp(-gamma * sq_dist)
+        raise ValueError(f"Unsupported kernel: {self.kernel}")
+
+    def decision_values(self, X):
+        """One-vs-one decision values, shape (n_samples, n_pairs)"""
+        X = np.asarray(X, dtype=np.float64)
+        K = self._kernel(X)
+        values = K @ self.pair_weights + self.intercept
+        bound = (np.abs(K) @ self.abs_pair_weights) * self._error_scale
+        return self._settle(values, bound, lambda rows: K[rows])
+
+    def _settle(self, values, bound, kernel_rows):
+        """Recompute, in libsvm's order, the values too close to zero to trust their sign.
+
+        bound holds an upper bound of every value's rounding error, such as
+        _error_scale * |K| @ |W|; kernel_rows(rows) returns the kernel rows of
+        the given samples.
+        """
+        # Where every term is zero the bound is 0 and both orders give exactly the intercept
+        near = np.flatnonzero(np.abs(values) < bound)
+        if len(near):
+            rows, pairs = np.divmod(near, values.shape[1])
+            samples, rows = np.unique(rows, return_inverse=True)
+            # A trailing zero column for the padding index -1
+            K = kernel_rows(samples)
+            K = np.concatenate([K, np.zeros((len(K), 1))], axis=1)
+            index, coef = self.pair_index[pairs], self.pair_coef[pairs]
+            total = np.zeros(len(rows))
+            for k in range(index.shape[1]):
+                total += K[rows, index[:, k]] * coef[:, k]
+            values[samples[rows], pairs] = total + self.intercept[pairs]
+        return values
+
+    def votes(self, values):
+        """One-vs-one votes of every class, shape (n_samples, n_classes)"""
+        positive = (values > 0).astype(np.float32)
+        return positive @ self._vote_shift + self._base_votes
+
+    def vote(self, values):
+        """Winning class of every row of one-vs-one decision values"""
+        return self.classes_[np.argmax(self.votes(values), axis=1)]
+
+    def top_k(self, values, k):
+        """(classes, votes) of the k most voted classes per row, best first.
+
+        Ties keep class order, as vote() does, so column 0 is the prediction.
+        """
+        votes = self.votes(values)
+        order = np.argsort(-votes, axis=1, kind='stable')[:, :k]
+        return self.classes_[order], np.take_along_axis(votes, order, axis=1).astype(int)
+
+    def predict(self, X):
+        return self.vote(self.decision_values(X))
+
+    def active_to_dense(self, active):
+        """0/1 input matrix from lists of active feature indices"""
+        X = np.zeros((len(active), self.support_vectors.shape[1]))
+        rows = np.repeat(np.arange(len(active)), [len(indices) for indices in active])
+        X[rows, np.fromiter((i for indices in active for i in indices), dtype=np.intp, count=len(rows))] = 1
+        return X
+
+    def decision_values_active(self, active):
+        """decision_values() for 0/1 inputs given as lists of active feature indices"""
+        return self.decision_values(self.active_to_dense(active))
+
+    def predict_active(self, active):
+        """predict() for 0/1 inputs given as lists of active feature indices"""
+        return self.predict(self.active_to_dense(active))
+
+    def top_k_active(self, active, k):
+        return self.top_k(self.decision_values_active(active), k)
+
+
+class LinearSVCEngine(SVCEngine):
+    """SVCEngine for linear kernels, reduced to one weight vector per symptom.
+
+    With a linear kernel every pair's decision value is x @ w_pair + b_pair,
+    where w_pair folds the support vectors into the dual coefficients. For
+    0/1 symptom vectors that is just the sum of the rows of the active
+    symptoms, so predict_active() adds a handful of 820-wide rows per request
+    instead of running a kernel against every support vector. Values too close
+    to zero still go through the exact libsvm-order recompute.
+
+    Dense batches bound the rounding error with a single precision product,
+    rounded up so it never falls below the double precision one: it only has
+    to be large enough, and costs less than half of the values themselves.
+    """
+
+    SMALL_BATCH = 16
+    # Large batches run in chunks so the (rows, n_pairs) temporaries stay in cache
+    CHUNK = 512
+
+    def __init__(self, meta, arrays):
+        super().__init__(meta, arrays)
+        if self.kernel != 'linear':
+            raise ValueError("LinearSVCEngine needs a linear kernel")
+        # (n_features, n_pairs)
+        self.feature_weights = self.support_vectors.T @ self.pair_weights
+        # Rounding error bound of each symptom's contribution to each value
+        self._error_weights = (np.abs(self.support_vectors).T @ self.abs_pair_weights) * self._error_scale
+        # The same in single precision, with room for its own rounding; terms
+        # stay nonzero, so a bound is only 0 where the double one is
+        tiny = np.finfo(np.float32).tiny
+        self._error_weights32 = np.where(self._error_weights > 0,
+                                         np.maximum(self._error_weights * 1.001, tiny), 0).astype(np.float32)
+
+    def decision_values(self, X):
+        X = np.asarray(X, dtype=np.float64)
+        values = X @ self.feature_weights + self.intercept
+        bound = np.abs(X).astype(np.float32) @ self._error_weights32
+        return self._settle(values, bound, lambda rows: X[rows] @ self.support_vectors.T)
+
+    def decision_values_active(self, active):
+        """Decision values of 0/1 inputs given as lists of distinct active feature indices"""
+        if len(active) > self.SMALL_BATCH:
+            # Past a few rows one BLAS product over the dense matrix beats summing row by row
+            return self.decision_values(self.active_to_dense(active))
+
+        values = np.empty((len(active), len(self.intercept)))
+        bound = np.empty_like(values)
+        for row, indices in enumerate(active):
+            values[row] = self.feature_weights[indices].sum(axis=0)
+            bound[row] = self._error_weights[indices].sum(axis=0)
+        values += self.intercept
+
+        def kernel_rows(rows):
+            return self.active_to_dense([active[row] for row in rows]) @ self.support_vectors.T
+
+        return self._settle(values, bound, kernel_rows)
+
+    def predict_active(self, active):
+        if len(active) <= self.CHUNK:
+            return self.vote(self.decision_values_active(active))
+        return np.concatenate([self.vote(self.decision_values_active(active[start:start + self.CHUNK]))
+                               for start in range(0, len(active), self.CHUNK)])
+
+
+def engine_from(meta, arrays):
+    """The fastest engine for a model: LinearSVCEngine for linear kernels"""
+    return (LinearSVCEngine if meta['kernel'] == 'linear' else SVCEngine)(meta, arrays)
+
+
+def load_engine(directory=EXPORT_DIR):
+    return engine_from(*load_arrays(directory))
+
+
+def engine_for_svc(svc, source=None):
+    """Engine built in memory from an unpickled SVC, for when there is no current export"""
+    return engine_from(*svc_arrays(svc, source))
+
+
+def is_current(directory, model_path):
+    """Whether directory holds an export of the pickle at model_path as it is now.
+
+    The pickle is only hashed when its size or mtime differ from the last time
+    it matched (SOURCE_STAT_FILE), so an unchanged model costs a stat().
+    """
+    try:
+        with open(os.path.join(directory, 'meta.json')) as f:
+            meta = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return False
+    if not all(os.path.exists(os.path.join(directory, name + '.npy')) for name in ARRAYS):
+        return False  # Exported before an array was added
+    if not os.path.exists(model_path):
+        return True
+    signature = meta.get('source_signature')
+    try:
+        with open(os.path.join(directory, SOURCE_STAT_FILE)) as f:
+            known = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        known = None
+    if known == {"signature": signature, "stat": source_stat(model_path)}:
+        return True
+    if signature != model_signature(model_path):
+        return False
+    # Same contents with a new mtime, e.g. after a git checkout
+    record_source_stat(directory, model_path, signature)
+    return True
+
+
+def check_against(svc, engine, X):
+    """Number of rows where the engine and svc.predict disagree"""
+    return int(np.count_nonzero(engine.predict(X) != svc.predict(X)))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Export models/svc.pkl as memory-mappable .npy arrays")
+    parser.add_argument('--model', default='models/svc.pkl', help="Pickled SVC (default: models/svc.pkl)")
+    parser.add_argument('--out', default=EXPORT_DIR, help=f"Export directory (default: {EXPORT_DIR})")
+    parser.add_argument('--data', default='datasets/Training.csv',
+                        help="CSV whose rows are compared with svc.predict after exporting")
+    args = parser.parse_args()
+
+    import pickle
+    import pandas as pd
+
+    with open(args.model, 'rb') as f:
+        model = pickle.load(f)
+    export_svc(model, args.out, source=args.model)
+    print(f"Exported {args.model} to {args.out}")
+
+    rows = pd.read_csv(args.data).iloc[:, :-1].to_numpy(dtype=np.float64)
+    mismatches = check_against(model, load_engine(args.out), rows)
+    print(f"Checked {len(rows)} rows of {args.data}: {mismatches} mismatches")
+    if mismatches:
+        raise SystemExit(1)
@@ -0,0 +1,227 @@
+import re
+from collections import Counter
+
+# Everyday wording for the model's symptom names; only phrases that mean the
+# symptom in any sentence, so no disease names or words like "tired" or "gas"
+SYNONYMS = {
+    'itching': ['itchy', 'itchy skin', 'itch'],
+    'skin_rash': ['rash', 'rashes'],
+    'continuous_sneezing': ['sneezing', 'sneezes'],
+    'joint_pain': ['joint ache', 'aching joints', 'sore joints'],
+    'stomach_pain': ['stomach ache', 'stomachache', 'tummy ache'],
+    'acidity': ['heartburn', 'acid reflux'],
+    'ulcers_on_tongue': ['mouth ulcers', 'tongue ulcers'],
+    'vomiting': ['throwing up', 'puking', 'vomit'],
+    'burning_micturition': ['burning urination', 'painful urination', 'burning when peeing'],
+    'fatigue': ['tiredness', 'exhaustion'],
+    'cold_hands_and_feets': ['cold hands', 'cold feet', 'cold hands and feet'],
+    'high_fever': ['high temperature'],
+    'breathlessness': ['shortness of breath', 'short of breath', 'difficulty breathing'],
+    'sweating': ['sweats', 'night sweats'],
+    'indigestion': ['upset stomach', 'dyspepsia'],
+    'yellowish_skin': ['yellow skin'],
+    'nausea': ['nauseous', 'queasy', 'feeling sick'],
+    'loss_of_appetite': ['no appetite', 'not hungry'],
+    'constipation': ['constipated'],
+    'diarrhoea': ['diarrhea', 'loose motions', 'loose stools'],
+    'yellowing_of_eyes': ['yellow eyes'],
+    'swelled_lymph_nodes': ['swollen lymph nodes', 'swollen glands'],
+    'blurred_and_distorted_vision': ['blurred vision', 'blurry vision'],
+    'throat_irritation': ['sore throat', 'scratchy throat'],
+    'redness_of_eyes': ['red eyes', 'bloodshot eyes'],
+    'runny_nose': ['running nose'],
+    'congestion': ['stuffy nose', 'blocked nose', 'nasal congestion'],
+    'fast_heart_rate': ['racing heart', 'rapid heartbeat'],
+    'dizziness': ['dizzy', 'lightheaded', 'light headed'],
+    'swollen_legs': ['leg swelling'],
+    'excessive_hunger': ['always hungry'],
+    'spinning_movements': ['vertigo', 'room spinning'],
+    'loss_of_smell': ['cant smell', 'no sense of smell'],
+    'passage_of_gases': ['flatulence'],
+    'muscle_pain': ['muscle ache', 'body ache', 'body aches'],
+    'polyuria': ['frequent urination'],
+    'watering_from_eyes': ['watery eyes'],
+    'lack_of_concentration': ['cant concentrate', 'poor concentration'],
+    'distention_of_abdomen': ['bloating', 'bloated stomach'],
+    'pus_filled_pimples': ['pimples'],
+    'skin_peeling': ['peeling skin'],
+}
+
+
+def normalise(text):
+    """Lower case words separated by single spaces; '_', '-' and punctuation count as spaces"""
+    # The model's names carry quirks like 'spotting_ urination' and a pandas '.1' duplicate suffix
+    text = re.sub(r'\.\d+$', '', text.strip().lower())
+    return ' '.join(re.sub(r'[^a-z0-9]+', ' ', text).split())
+
+
+def trigrams(text):
+    padded = f'  {text} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class SymptomResolver:
+    """Maps free text to the model's symptom names through a trigram index.
+
+    Every symptom is indexed under its readable name ('spotting urination')
+    and its synonyms. Lookups only score the aliases that share a trigram
+    with the query, so resolving a word touches a few posting lists instead
+    of comparing against all 132 names.
+    """
+
+    def __init__(self, symptom_index, synonyms=SYNONYMS, threshold=0.5):
+        self.threshold = threshold
+        self._exact = {name: name for name in symptom_index}
+        self.aliases = []  # (alias, symptom)
+        self._readable = set()  # Numbers of the aliases that are a symptom's own name
+        seen = set()
+        for name in symptom_index:
+            candidates = [normalise(name)] + [normalise(synonym) for synonym in synonyms.get(name, ())]
+            for alias in candidates:
+                if alias and alias not in seen:
+                    seen.add(alias)
+                    if alias == candidates[0]:
+                        self._readable.add(len(self.aliases))
+                    self.aliases.append((alias, name))
+        for alias, name in self.aliases:
+            self._exact.setdefault(alias, name)
+
+        self._grams = [trigrams(alias) for alias, _ in self.aliases]
+        self._postings = {}
+        for n, grams in enumerate(self._grams):
+            for gram in grams:
+                self._postings.setdefault(gram, []).append(n)
+
+    def _scored(self, query):
+        """[(similarity, alias number)] of the aliases sharing a trigram with query"""
+        grams = trigrams(query)
+        shared = Counter()
+        for gram in grams:
+            shared.update(self._postings.get(gram, ()))
+        # Dice coefficient of the two trigram sets
+        return [(2 * common / (len(grams) + len(self._grams[n])), n) for n, common in shared.items()]
+
+    def resolve(self, text, fuzzy=True):
+        """The symptom name text most likely means, or None.
+
+        Without fuzzy, only a symptom's name or one of its synonyms (in any
+        case and spacing) resolves; close spellings are left to suggest().
+        """
+        name = self._exact.get(text.strip())
+        if name is not None:
+            return name
+        query = normalise(text)
+        name = self._exact.get(query)
+        if name is not None or not query or not fuzzy:
+            return name
+        best = {}
+        for similarity, n in self._scored(query):
+            name = self.aliases[n][1]
+            best[name] = max(best.get(name, 0), similarity)
+        ranked = sorted(best.items(), key=lambda item: item[1], reverse=True)
+        if not ranked or ranked[0][1] < self.threshold:
+            return None
+        # 'fever' is as close to 'mild fever' as to 'high fever': too ambiguous to pick one
+        if len(ranked) > 1 and ranked[1][1] == ranked[0][1]:
+            return None
+        return ranked[0][0]
+
+    # Suggestions that neither contain the typed text nor come this close are noise
+    MIN_SUGGEST_SIMILARITY = 0.3
+
+    def suggest(self, text, limit=8):
+        """Up to limit {"symptom", "label"} completions for a partly typed name, best first"""
+        query = normalise(text)
+        if not query:
+            return []
+        ranked = []
+        for similarity, n in self._scored(query):
+            alias = self.aliases[n][0]
+            if query not in alias and similarity < self.MIN_SUGGEST_SIMILARITY:
+                continue
+            # Prefix matches first, then names containing the text, then the closest spellings;
+            # a symptom's own name goes before its synonyms
+            ranked.append((not alias.startswith(query), query not in alias, n not in self._readable,
+                           -similarity, alias, n))
+        ranked.sort()
+
+        suggestions = []
+        seen = set()
+        for *_, n in ranked:
+            alias, name = self.aliases[n]
+            if name not in seen:
+                seen.add(name)
+                suggestions.append({"symptom": name, "label": alias})
+                if len(suggestions) == limit:
+                    break
+        return suggestions
+
+
+# Words that cancel the symptom right after them ("no fever", "without nausea")
+NEGATIONS = frozenset({'no', 'not', 'without', 'never', 'denies'})
+
+
+class SymptomExtractor:
+    """Finds symptom phrases in free text with a word-level Aho-Corasick automaton.
+
+    The automaton is compiled once from the resolver's aliases, so one pass
+    over the words of a message finds every alias in it, however many there
+    are. Overlapping matches keep the longest ('high fever' over 'fever'),
+    and a match right after a negation word is dropped.
+    """
+
+    def __init__(self, resolver):
+        # Node 0 is the root; each node has word -> node edges, a failure link and its matches
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [[]]  # (phrase length in words, symptom)
+        for alias, name in resolver.aliases:
+            node = 0
+            for word in alias.split():
+                nxt = self._goto[node].get(word)
+                if nxt is None:
+                    nxt = len(self._goto)
+                    self._goto[node][word] = nxt
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append([])
+                node = nxt
+            self._out[node].append((len(alias.split()), name))
+
+        # Breadth-first, so every failure link points at an already finished node;
+        # first-level nodes keep the root as theirs
+        queue = list(self._goto[0].values())
+        for node in queue:
+            for word, child in self._goto[node].items():
+                fail = self._fail[node]
+                while fail and word not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[child] = self._goto[fail].get(word, 0)
+                self._out[child] = self._out[child] + self._out[self._fail[child]]
+                queue.append(child)
+
+    def matches(self, words):
+        """(start, end, symptom) of every alias in an iterable of words, as they stream in"""
+        node = 0
+        for position, word in enumerate(words):
+            while node and word not in self._goto[node]:
+                node = self._fail[node]
+            node = self._goto[node].get(word, 0)
+            for length, name in self._out[node]:
+                yield position + 1 - length, position + 1, name
+
+    def extract(self, text):
+        """Symptom names mentioned in text, in order of appearance, without repeats"""
+        words = normalise(text).split()
+        found = []
+        taken_until = -1
+        # Leftmost first, then longest
+        for start, end, name in sorted(self.matches(words), key=lambda match: (match[0], -match[1])):
+            if start < taken_until:
+                continue
+            taken_until = end
+            if start and words[start - 1] in NEGATIONS:
+                continue
+            if name not in found:
+                found.append(name)
+        return found
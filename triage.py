@@ -0,0 +1,111 @@
+import csv
+import re
+
+import numpy as np
+
+SEVERITY_PATH = 'datasets/Symptom-severity.csv'
+
+# Symptom sets that need prompt care whatever the predicted disease is.
+# A rule fires when every symptom in it is present.
+URGENT_COMBINATIONS = (
+    ("Chest pain with breathlessness", ('chest_pain', 'breathlessness')),
+    ("Chest pain with sweating", ('chest_pain', 'sweating')),
+    ("Chest pain with a fast heart rate", ('chest_pain', 'fast_heart_rate')),
+    ("High fever with a stiff neck", ('high_fever', 'stiff_neck')),
+    ("Slurred speech with one-sided weakness", ('slurred_speech', 'weakness_of_one_body_side')),
+    ("Vomiting with dehydration", ('vomiting', 'dehydration')),
+    ("Altered sensorium", ('altered_sensorium',)),
+    ("Coma", ('coma',)),
+    ("Stomach bleeding", ('stomach_bleeding',)),
+    ("Blood in sputum", ('blood_in_sputum',)),
+    ("Acute liver failure", ('acute_liver_failure',)),
+)
+
+# A total severity this high is urgent even without a matching combination
+URGENT_SCORE = 40
+
+
+def _symptom_key(name):
+    # The CSV spells a few names differently from the model ("foul_smell_of urine"),
+    # and pandas-style duplicate columns carry a ".1" suffix
+    return re.sub(r'\.\d+$', '', name.replace(' ', ''))
+
+
+def load_severity_weights(path, symptom_index):
+    """Weight of every symptom as a vector aligned with symptom_index (name -> column)"""
+    with open(path, newline='') as f:
+        weights = {_symptom_key(row['Symptom']): float(row['weight']) for row in csv.DictReader(f)}
+
+    vector = np.zeros(len(symptom_index))
+    missing = []
+    for name, column in symptom_index.items():
+        weight = weights.get(_symptom_key(name))
+        if weight is None:
+            missing.append(name)
+        else:
+            vector[column] = weight
+    if missing:
+        print(f"Warning: no severity weight for {', '.join(missing)} in {path}; counting them as 0")
+    return vector
+
+
+class TriageScorer:
+    """Severity score and urgent-combination flags for 0/1 symptom vectors.
+
+    The score is a dot product with the per-symptom weights and a rule fires
+    when its symptom count equals the number of its symptoms present, so a
+    whole batch is scored and checked with two matrix products.
+    """
+
+    def __init__(self, weights, symptom_index, combinations=URGENT_COMBINATIONS, urgent_score=URGENT_SCORE):
+        self.weights = np.asarray(weights, dtype=np.float64)
+        self.urgent_score = urgent_score
+        self.rule_names = [name for name, _ in combinations]
+        # (n_rules, n_features) 0/1 matrix of the symptoms in each rule
+        self.rules = np.zeros((len(combinations), len(self.weights)))
+        for row, (_, symptoms) in enumerate(combinations):
+            self.rules[row, [symptom_index[symptom] for symptom in symptoms]] = 1
+        self.rule_sizes = self.rules.sum(axis=1)
+
+    @classmethod
+    def from_csv(cls, symptom_index, path=SEVERITY_PATH):
+        return cls(load_severity_weights(path, symptom_index), symptom_index)
+
+    def dense(self, active):
+        """0/1 matrix from lists of active symptom columns"""
+        X = np.zeros((len(active), len(self.weights)))
+        for row, columns in enumerate(active):
+            X[row, list(columns)] = 1
+        return X
+
+    def scores(self, X):
+        return X @ self.weights
+
+    def fired_rules(self, X):
+        """(n_samples, n_rules) bool matrix of the urgent combinations present"""
+        return X @ self.rules.T == self.rule_sizes
+
+    def assess(self, X):
+        """(scores, fired_rules, urgent) for every row of X"""
+        X = np.asarray(X, dtype=np.float64)
+        scores = self.scores(X)
+        fired = self.fired_rules(X)
+        urgent = fired.any(axis=1) | (scores >= self.urgent_score)
+        return scores, fired, urgent
+
+    def rank(self, X):
+        """Row order, most urgent first: urgent rows, then by descending score, ties in input order"""
+        scores, _, urgent = self.assess(X)
+        return self.order(scores, urgent)
+
+    @staticmethod
+    def order(scores, urgent):
+        """rank() of rows that were already assessed"""
+        return np.lexsort((-scores, ~urgent))
+
+    def reasons(self, fired_row, score):
+        """Readable list of why one row is urgent"""
+        reasons = [name for name, fired in zip(self.rule_names, fired_row) if fired]
+        if score >= self.urgent_score:
+            reasons.append(f"Total severity score of {self.urgent_score:g} or more")
+        return reasons